@@ -53,3 +53,17 @@ def doc_to_text_cot(doc) -> str:
     prompt += "Reasoning: " + doc["reasoning_trace"] + "\n\n"    
     prompt += "Answer:"
     return prompt
+
+
+
+def process_results_cot(doc, results) -> dict:
+    """
+    Accuracy of a cot doc (option with highest loglikelihood). Examples
+    the COT chain failed on (empty reasoning trace, error in column
+    `reasoning_error`) are scored as wrong; they are kept, so that base and
+    cot tasks score the same rows.
+    """
+    if doc.get("reasoning_error"):
+        return {"acc": 0.0}
+    lls = [ll for ll, _ in results]
+    return {"acc": float(lls.index(max(lls)) == doc["answer"])}
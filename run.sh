@@ -37,6 +37,29 @@ LOTMP_ELEU_CONFIGSFOLDER="$COTEVAL_CACHE_DIR/eleuther/tasks/logikon"  # folder w
 LOTMP_ELEU_CONFIGSINFO="$COTEVAL_CACHE_DIR/lm_eval_harness_tasks.json"  # groups names of lm-eval-harness tasks that will be used
 LOTMP_ELEU_OUTPUTDIR="$COTEVAL_CACHE_DIR/eleuther/output"  # folder with lm-eval-harness output
 LOTMP_DEFAULT="$COTEVAL_CACHE_DIR/TMP"  # folder with other temporary files
+LOTMP_TIMELINE="$COTEVAL_CACHE_DIR/timeline.jsonl"  # timing spans of all stages and python entry points
+
+# run timeline (see src/cot_eval/timeline.py): python entry points write spans to $COTEVAL_CACHE_DIR/timeline.jsonl
+export COTEVAL_CACHE_DIR
+export COTEVAL_RUN_ID="${COTEVAL_RUN_ID:-$(date +"%y%m%d-%H%M%S")-$$}"
+if [[ "${PROFILE}" = true ]]; then
+  export COTEVAL_PROFILE=true  # cProfile and tracemalloc snapshots per span in $COTEVAL_CACHE_DIR/profiles
+fi
+
+# usage: timeline_span <stage> <command> [args...]
+# runs command and appends a span of the stage to the run timeline
+timeline_span() {
+  local stage=$1; shift
+  local start=$(date +%s.%N)
+  local status=0
+  "$@" || status=$?
+  local end=$(date +%s.%N)
+  mkdir -p $(dirname $LOTMP_TIMELINE)
+  printf '{"name": "%s", "kind": "stage", "attrs": {}, "run_id": "%s", "pid": %d, "start": %s, "end": %s, "duration_s": %s, "status": "%s", "max_rss_mb": null}\n' \
+    "$stage" "$COTEVAL_RUN_ID" $$ $start $end $(awk "BEGIN {print $end - $start}") \
+    $([[ $status -eq 0 ]] && echo ok || echo error) >> $LOTMP_TIMELINE
+  return $status
+}
 
 # cp pre-built eleuther tasks and templates to cache dir
 mkdir -p $LOTMP_DEFAULT
@@ -49,14 +72,72 @@ cp -r ./eleuther/tasks/logikon/* $LOTMP_ELEU_CONFIGSFOLDER
 huggingface-cli login --token $HUGGINGFACEHUB_API_TOKEN
 
 
+##############################
+# worker mode: evaluate pending models one after the other in a long-running process (see src/cot_eval/worker.py)
+
+if [[ -z "${NEXT_MODEL_PATH}" && "${WORKER}" = true ]]; then
+  exec cot-eval worker --cache_dir $COTEVAL_CACHE_DIR
+fi
+
+
+##############################
+# pack several models onto this node's GPUs
+# each job runs the full pipeline on its own GPUs, with its own cache dir
+
+if [[ -z "${NEXT_MODEL_PATH}" && "${PACK_MODELS}" = true ]]; then
+  LOTMP_JOBSDIR="$COTEVAL_CACHE_DIR/jobs"
+  timeline_span lookup python scripts/lookup_pending_model.py --keys_file $LOTMP_NEXTMODELINFO --max_params $MAX_MODEL_PARAMS --requests_repo $REQUESTS_REPO --tmp_dir $LOTMP_DEFAULT \
+    --jobs_dir $LOTMP_JOBSDIR --num_gpus $NUM_GPUS --gpu_memory_gb ${GPU_MEMORY_GB:-80} --gpu_memory_utilization $gpu_memory_utilization
+  jobfiles=$(cat $LOTMP_NEXTMODELINFO)  # format is "job1.json,job2.json"
+  job_pids=()
+  heartbeat_pids=()
+  for jobfile in ${jobfiles//,/ }
+  do
+    python scripts/request_lease.py heartbeat --keys_file $jobfile --requests_repo $REQUESTS_REPO --tmp_dir $LOTMP_DEFAULT &
+    heartbeat_pids+=($!)
+    jobname=$(basename $jobfile .json)
+    echo "Starting $jobname: $(jq -r .model $jobfile) on GPUs $(jq -r .gpu_ids $jobfile)"
+    NEXT_MODEL_PATH=$(jq -r .model $jobfile) \
+    NEXT_MODEL_REVISION=$(jq -r .revision $jobfile) \
+    NEXT_MODEL_PRECISION=$(jq -r .precision $jobfile) \
+    NUM_GPUS=$(jq -r .tensor_parallel_size $jobfile) \
+    CUDA_VISIBLE_DEVICES=$(jq -r .gpu_ids $jobfile) \
+    COTEVAL_CACHE_DIR="$COTEVAL_CACHE_DIR/$jobname" \
+    COTEVAL_NODE_CACHE_DIR="$COTEVAL_CACHE_DIR" \
+    COTEVAL_RUN_ID="$COTEVAL_RUN_ID-$jobname" \
+    PACK_MODELS=false \
+      bash run.sh > "$LOTMP_JOBSDIR/$jobname.log" 2>&1 &
+    job_pids+=($!)
+  done
+  trap 'kill ${heartbeat_pids[@]} 2>/dev/null || true' EXIT
+  failed=0
+  for pid in "${job_pids[@]}"
+  do
+    wait $pid || failed=$((failed+1))
+  done
+  echo "Finished packed jobs ($failed failed). Logs in $LOTMP_JOBSDIR"
+  exit $failed
+fi
+
+
 ##############################
 # lookup model to-be evaluated
 
 if [[ -z "${NEXT_MODEL_PATH}" ]]; then
-  python scripts/lookup_pending_model.py --keys_file $LOTMP_NEXTMODELINFO --max_params $MAX_MODEL_PARAMS --requests_repo $REQUESTS_REPO --tmp_dir $LOTMP_DEFAULT
+  timeline_span lookup python scripts/lookup_pending_model.py --keys_file $LOTMP_NEXTMODELINFO --max_params $MAX_MODEL_PARAMS --requests_repo $REQUESTS_REPO --tmp_dir $LOTMP_DEFAULT
   model=$(cat $LOTMP_NEXTMODELINFO | jq -r .model)
   revision=$(cat $LOTMP_NEXTMODELINFO | jq -r .revision)
   precision=$(cat $LOTMP_NEXTMODELINFO | jq -r .precision)
+  # keep lease on claimed request alive while pipeline runs (expired leases are reclaimed by other workers)
+  python scripts/request_lease.py heartbeat --keys_file $LOTMP_NEXTMODELINFO --requests_repo $REQUESTS_REPO --tmp_dir $LOTMP_DEFAULT &
+  heartbeat_pid=$!
+  # download weights of the next pending models into the HF cache while this one is evaluated (see src/cot_eval/weight_prefetch.py)
+  if [[ "${PREFETCH_MODELS:-0}" -gt 0 ]]; then
+    cot-eval prefetch --requests_repo $REQUESTS_REPO --tmp_dir $LOTMP_DEFAULT --num_models $PREFETCH_MODELS --max_params $MAX_MODEL_PARAMS \
+        --exclude_model $model ${PREFETCH_MAX_MBPS:+--max_mbps $PREFETCH_MAX_MBPS} > $COTEVAL_CACHE_DIR/prefetch.log 2>&1 &
+    prefetch_pid=$!
+  fi
+  trap 'kill $heartbeat_pid $prefetch_pid 2>/dev/null || true' EXIT
 else
   model="${NEXT_MODEL_PATH}"
   revision="${NEXT_MODEL_REVISION}"
@@ -64,6 +145,10 @@ else
 fi
 echo "Model to evaluate: $model : $revision. Precision: $precision"
 
+# keep HF cache and cache dir within disk budget (COTEVAL_CACHE_BUDGET_GB), evicting least recently used entries
+# except this model, models of active runs and prefetched models (see src/cot_eval/cache_manager.py)
+timeline_span cache_evict cot-eval cache evict --cache_dir $COTEVAL_CACHE_DIR --pin $model@$revision
+
 # set lm-eval-harness model_args
 lm_eval_model_args="pretrained=${model},revision=${revision},dtype=${precision},tensor_parallel_size=${NUM_GPUS},gpu_memory_utilization=${gpu_memory_utilization},trust_remote_code=$TRUST_REMOTE_CODE"
 if [[ -z "${MAX_LENGTH}" ]]; then
@@ -73,120 +158,133 @@ else
   lm_eval_model_args="${lm_eval_model_args},max_length=$MAX_LENGTH"
   cot_config_extra_args="--max_model_len $MAX_LENGTH"
 fi
+if [[ "${FINAL_ANSWER}" = true ]]; then
+  # instruct model to state final answer label, enables `cot-eval accuracy` on traces
+  cot_config_extra_args="$cot_config_extra_args --final_answer"
+fi
 echo "lm-eval model_args: $lm_eval_model_args"
 
 
+##############################
+# run manifest of this model and revision (see src/cot_eval/run_manifest.py)
+# a rerun after a failure skips finished units, and reuses config names and timestamp
+
+# usage: run_manifest <action> [args...]
+run_manifest() {
+  python -m cot_eval.run_manifest $1 --model $model --revision $revision "${@:2}"
+}
+
+# usage: run_unit <unit> <command> [args...]
+# runs command as stage of the run timeline, unless the unit has finished in an earlier attempt
+run_unit() {
+  local unit=$1; shift
+  if run_manifest done --unit $unit; then
+    echo "Skipping $unit (finished according to run manifest)"
+    return 0
+  fi
+  timeline_span $unit "$@"
+  run_manifest mark --unit $unit
+}
+
+run_inputs="$precision|$CHAINS|$MODELKWARGS|$TASKS|$NUM_GPUS|$DO_BASEEVAL|$cot_config_extra_args|$lm_eval_model_args"
+export COTEVAL_RUN_MANIFEST=$(run_manifest start --inputs "$run_inputs")  # cot-eval skips tasks with uploaded traces
+
+
 ##############################
 # create CoT configs
 # a 'config' defines how reasoning traces are generated for a given task
-python scripts/create_cot_configs.py $cot_config_extra_args \
-    --model $model \
-    --revision $revision \
-    --precision ${precision} \
-    --chains $CHAINS \
-    --model_kwargs "$MODELKWARGS" \
-    --tasks $TASKS \
-    --output_dir $LOTMP_CONFIGSFOLDER \
-    --template_path "./src/cot_eval/configs/template.yaml" \
-    --keys_file $LOTMP_CONFIGKEYSINFO \
-    --num_gpus $NUM_GPUS \
-    --gpu_memory_utilization $gpu_memory_utilization \
-    --swap_space $swap_space
-configkeys=$(cat $LOTMP_CONFIGKEYSINFO)  # format is "config1,config2,config3"
-echo "Created configs: $configkeys and stored in $LOTMP_CONFIGSFOLDER"
+if run_manifest done --unit create_configs; then
+  configkeys=$(run_manifest get --key config_keys)
+  echo "Reusing configs: $configkeys (run manifest)"
+else
+  timeline_span create_configs python scripts/create_cot_configs.py $cot_config_extra_args \
+      --model $model \
+      --revision $revision \
+      --precision ${precision} \
+      --chains $CHAINS \
+      --model_kwargs "$MODELKWARGS" \
+      --tasks $TASKS \
+      --output_dir $LOTMP_CONFIGSFOLDER \
+      --template_path "./src/cot_eval/configs/template.yaml" \
+      --keys_file $LOTMP_CONFIGKEYSINFO \
+      --num_gpus $NUM_GPUS \
+      --gpu_memory_utilization $gpu_memory_utilization \
+      --swap_space $swap_space
+  configkeys=$(cat $LOTMP_CONFIGKEYSINFO)  # format is "config1,config2,config3"
+  run_manifest set --key config_keys --value $configkeys
+  run_manifest mark --unit create_configs
+  echo "Created configs: $configkeys and stored in $LOTMP_CONFIGSFOLDER"
+fi
 
 
 ##############################
-# generate reasoning traces
-# run cot_eval to create reasoning traces for every config (model and task)
-# reasoning traces are uploaded to huggingface hub
-arr_configkeys=(${configkeys//,/ })
-for config in "${arr_configkeys[@]}"
-do
-    cot-eval \
-        --config "${LOTMP_CONFIGSFOLDER}/${config}.yaml" \
-        --upload_dataset $TRACES_REPO \
-        --hftoken $HUGGINGFACEHUB_API_TOKEN
-done
+# two-tier generation budgets (see src/cot_eval/generation_budgets.py), learned with `cot-eval budgets`
+if [[ -n "${COTEVAL_GENERATION_BUDGETS}" ]]; then
+  export COTEVAL_GENERATION_BUDGETS
+fi
 
 
 ##############################
-# create lm-eval-harness tasks
-# a 'harness task' defines how to evaluate a given model on a given task,
-# specifically whether to include the model's reasoning traces or not
-python scripts/create_lm_eval_harness_tasks.py \
-    --model $model \
-    --configs $configkeys \
-    --output_dir $LOTMP_ELEU_CONFIGSFOLDER \
-    --configs_dir $LOTMP_CONFIGSFOLDER \
-    --traces_dataset_path $TRACES_REPO \
-    --keys_file $LOTMP_ELEU_CONFIGSINFO
-harness_tasks_base=$(cat $LOTMP_ELEU_CONFIGSINFO | jq -r .base) # format is "task1,task2,task3"
-harness_tasks_cot=$(cat $LOTMP_ELEU_CONFIGSINFO | jq -r .cot) # format is "task1,task2,task3"
-echo "Created lm-eval-harness tasks base: $harness_tasks_base" # no cot
-echo "Created lm-eval-harness tasks cot: $harness_tasks_cot"
-
+# mirror tasks locally (once per mirror dir, memory-mapped and shared by all cot-eval runs)
+if [[ -n "${COTEVAL_TASKS_MIRROR}" ]]; then
+  export COTEVAL_TASKS_MIRROR
+  timeline_span mirror cot-eval mirror --mirror_dir $COTEVAL_TASKS_MIRROR --tasks $TASKS --hftoken $HUGGINGFACEHUB_API_TOKEN
+fi
 
-timestamp=$(date +"%y-%m-%d-%T")
 
 ##############################
-# ORIG evaluation
-# run lm-eval originial BASE (unperturbed) for each task
-if [ "$DO_BASEEVAL" = true ] ; then
-    arrTASKS=(${TASKS//,/ })
-    basetasks=$(printf "%s_base," "${arrTASKS[@]}")
-    basetasks=${basetasks:0:-1}
-    output_path=$LOTMP_ELEU_OUTPUTDIR/${model}/orig/results_${timestamp}
-    if [ -f $output_path ]; then
-        echo "Outputfile $FILE exists. Skipping eval of $basetasks."
-    else
-        lm-eval --model vllm \
-            --model_args $lm_eval_model_args \
-            --tasks $basetasks \
-            --num_fewshot 0 \
-            --batch_size auto \
-            --output_path $output_path \
-            --include_path $LOTMP_ELEU_CONFIGSFOLDER
-    fi
+# preflight: check configs, estimate token volume and GPU hours, fail fast before any model is loaded
+timeline_span preflight cot-eval preflight \
+    --configs_dir $LOTMP_CONFIGSFOLDER \
+    --configs $configkeys \
+    --upload_dataset $TRACES_REPO \
+    --hftoken $HUGGINGFACEHUB_API_TOKEN \
+    --output $COTEVAL_CACHE_DIR/preflight.json
+
+
+timestamp=$(run_manifest get --key timestamp)  # resumed run writes to the same output paths
+if [[ -z "${timestamp}" ]]; then
+  timestamp=$(date +"%y-%m-%d-%T")
+  run_manifest set --key timestamp --value $timestamp
 fi
 
 
 ##############################
-# BASE and COT evaluation
-# run lm evaluation harness for each of the tasks
-
-# without reasoning traces
-lm-eval --model vllm \
-    --model_args $lm_eval_model_args \
-    --tasks ${harness_tasks_base} \
-    --num_fewshot 0 \
-    --batch_size auto \
-    --output_path $LOTMP_ELEU_OUTPUTDIR/${model}/base/${timestamp} \
-    --include_path $LOTMP_ELEU_CONFIGSFOLDER
-
-# with reasoning traces
-arrHT=(${harness_tasks_cot//,/ })
-ht_batch_size=5
-# batched processing of harness_tasks_cot
-for((i=0; i < ${#arrHT[@]}; i+=ht_batch_size))
-do
-    ht_batch=( "${arrHT[@]:i:ht_batch_size}" )
-    ht_batch_s=$(printf ",%s" "${ht_batch[@]}")
-    ht_batch_s=${ht_batch_s:1}
-    echo "Evaluating cot tasks: $ht_batch_s"
-
-    lm-eval --model vllm \
-        --model_args $lm_eval_model_args \
-        --tasks ${ht_batch_s} \
-        --num_fewshot 0 \
-        --batch_size auto \
-        --output_path $LOTMP_ELEU_OUTPUTDIR/${model}/cot/${timestamp}_idx${i} \
-        --include_path $LOTMP_ELEU_CONFIGSFOLDER
-done
+# generate reasoning traces and evaluate (stage graph, see scripts/run_pipeline.py)
+# - cot-eval creates reasoning traces for every config (model and task), uploaded to huggingface hub
+# - lm-eval-harness tasks define how to evaluate the model on a given task, with or without the model's reasoning traces
+# - ORIG evaluation: lm-eval on original BASE (unperturbed) tasks
+# - BASE and COT evaluation: lm-eval on harness tasks without / with reasoning traces
+# independent stages (e.g. orig evaluation, or cot evaluation of one config and trace generation of another)
+# run in parallel if the node has more GPUs than one model instance needs
+# with MODEL_SERVER=true, the model is loaded once into a shared local server used by all stages
+# with SCREENING=true, the model is screened on stratified subsets of the tasks, grown in rounds until the delta CI decides
+python scripts/run_pipeline.py \
+    --model $model \
+    --configs $configkeys \
+    --configs_dir $LOTMP_CONFIGSFOLDER \
+    --tasks $TASKS \
+    --timestamp $timestamp \
+    --lm_eval_model_args $lm_eval_model_args \
+    --harness_tasks_dir $LOTMP_ELEU_CONFIGSFOLDER \
+    --harness_keys_file $LOTMP_ELEU_CONFIGSINFO \
+    --output_dir $LOTMP_ELEU_OUTPUTDIR \
+    --traces_repo $TRACES_REPO \
+    --hftoken $HUGGINGFACEHUB_API_TOKEN \
+    --do_baseeval $DO_BASEEVAL \
+    --num_gpus ${NODE_GPUS:-$NUM_GPUS} \
+    --gpus_per_model $NUM_GPUS \
+    --log_dir $COTEVAL_CACHE_DIR/logs \
+    $([[ "${MODEL_SERVER}" = true ]] && echo --model_server) \
+    $([[ "${SCREENING}" = true ]] && echo --screening)
+
 
 ##############################
 # collect and upload results
-python scripts/upload_results.py \
+if [[ -n "${heartbeat_pid}" ]]; then
+  kill $heartbeat_pid 2>/dev/null || true
+fi
+run_unit upload python scripts/upload_results.py \
     --model $model \
     --revision $revision \
     --precision $precision \
@@ -197,5 +295,8 @@ python scripts/upload_results.py \
     --results_repo $RESULTS_REPO \
     --requests_repo $REQUESTS_REPO \
     --leaderboard_results_repo $LEADERBOARD_RESULTS_REPO \
-    --create_pr $CREATE_PULLREQUESTS
+    --timeline_file $LOTMP_TIMELINE \
+    --create_pr $CREATE_PULLREQUESTS \
+    $([[ "${SCREENING}" = true ]] && echo --screening_file $LOTMP_ELEU_OUTPUTDIR/$model/screening/$timestamp/screening.json)
 
+run_manifest finish
@@ -0,0 +1,95 @@
+"""benchmark bootstrap confidence intervals across the leaderboard
+
+Times the vectorized paired bootstrap (`cot_eval.bootstrap`) on synthetic
+per-sample correctness for all models, and compares it with a pure-python
+resampling loop (measured on a single model and extrapolated).
+
+usage:
+python scripts/benchmark_bootstrap.py --num_models 200 --num_configs 6
+"""
+
+import argparse
+import logging
+import random
+import time
+
+import numpy as np
+
+from cot_eval.bootstrap import bootstrap_cis
+
+logging.basicConfig(level=logging.INFO)
+
+# approximate test split sizes of logikon-bench
+TASK_SIZES = {
+    "logiqa": 651,
+    "logiqa2": 1572,
+    "lsat-ar": 230,
+    "lsat-rc": 269,
+    "lsat-lr": 510,
+}
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_models", type=int, default=200)
+    parser.add_argument("--num_configs", type=int, default=6)
+    parser.add_argument("--n_resamples", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def synthetic_correctness(num_configs: int, rng: np.random.Generator) -> dict:
+    correctness = {}
+    for task, n in TASK_SIZES.items():
+        p_base = rng.uniform(0.2, 0.6)
+        runs = {"base": dict(enumerate((rng.random(n) < p_base).astype(float)))}
+        for c in range(num_configs):
+            p_cot = min(1.0, max(0.0, p_base + rng.normal(0, 0.05)))
+            runs[f"config-{c}"] = dict(enumerate((rng.random(n) < p_cot).astype(float)))
+        correctness[task] = runs
+    return correctness
+
+
+def python_bootstrap(correctness: dict, n_resamples: int, seed: int):
+    """Reference implementation: resampling in pure python"""
+    rnd = random.Random(seed)
+    for runs in correctness.values():
+        doc_ids = sorted(runs["base"])
+        n = len(doc_ids)
+        maxima = []
+        for _ in range(n_resamples):
+            idx = [doc_ids[rnd.randrange(n)] for _ in range(n)]
+            acc_base = sum(runs["base"][i] for i in idx) / n
+            maxima.append(max(
+                sum(run[i] for i in idx) / n - acc_base
+                for key, run in runs.items() if key != "base"
+            ))
+        maxima.sort()
+        _ = (maxima[int(0.025 * n_resamples)], maxima[int(0.975 * n_resamples) - 1])
+
+
+def main():
+    args = parse_eval_args()
+    rng = np.random.default_rng(args.seed)
+    leaderboard = [synthetic_correctness(args.num_configs, rng) for _ in range(args.num_models)]
+
+    start = time.perf_counter()
+    for correctness in leaderboard:
+        bootstrap_cis(correctness, n_resamples=args.n_resamples, seed=args.seed)
+    time_vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    python_bootstrap(leaderboard[0], args.n_resamples, args.seed)
+    time_python = (time.perf_counter() - start) * args.num_models
+
+    logging.info(
+        f"Bootstrap CIs for {args.num_models} models x {len(TASK_SIZES)} tasks x {args.num_configs} configs "
+        f"({args.n_resamples} resamples)"
+    )
+    logging.info(f"vectorized (numpy): {time_vectorized:.2f}s")
+    logging.info(f"pure python (extrapolated from one model): {time_python:.2f}s")
+    logging.info(f"speedup: {time_python / time_vectorized:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""benchmark two-tier generation budgets against single-tier generation
+
+Generates greedy reasoning traces for a sample of each task's problems
+twice, with the full `max_new_tokens` budget and with the task's
+first-tier budget (continuing truncated traces only), and reports time
+and reserved tokens saved and whether traces are identical. Runs with the
+CPU transformers backend, or against a model server (`--server_url`, e.g.
+scripts/stand_in_model_server.py).
+
+usage:
+python scripts/benchmark_generation_budgets.py --model sshleifer/tiny-gpt2 --tasks logiqa,lsat-ar --num_examples 32 \
+    --max_new_tokens 256 --budgets ./cot-eval-cache/generation_budgets.json [--output benchmark.json]
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from cot_eval.chain_registry import CHAIN_REGISTRY
+from cot_eval.generation_budgets import TwoTierLLM, load_budgets
+from cot_eval.model_server import ServerLLM
+from cot_eval.preprocessing import load_and_preprocess
+from cot_eval.transformers_backend import TransformersCPU
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="sshleifer/tiny-gpt2")
+    parser.add_argument("--revision", type=str, default="main")
+    parser.add_argument("--server_url", type=str, default=None, help="Generate with a model server instead of on CPU")
+    parser.add_argument("--chain", type=str, default="HandsOn")
+    parser.add_argument("--tasks", type=str, default="logiqa,lsat-ar")
+    parser.add_argument("--num_examples", type=int, default=32)
+    parser.add_argument("--max_new_tokens", type=int, default=256)
+    parser.add_argument("--budgets", type=str, default=None, help="Generation budgets file (default: $COTEVAL_GENERATION_BUDGETS)")
+    parser.add_argument("--first_tier", type=int, default=None, help="First-tier budget of all tasks (overrides budgets file)")
+    parser.add_argument("--hftoken", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None, help="Write results as json to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_eval_args()
+    if args.server_url:
+        llm = ServerLLM.from_modelkwargs(args.server_url, args.model, temperature=0, max_new_tokens=args.max_new_tokens)
+    else:
+        llm = TransformersCPU.from_modelkwargs(
+            args.model, temperature=0, max_new_tokens=args.max_new_tokens, vllm_kwargs={"revision": args.revision}
+        )
+    budgets = load_budgets(args.budgets)
+    two_tier_llm = TwoTierLLM(llm=llm)
+
+    results = []
+    for task in args.tasks.split(","):
+        first_tier = args.first_tier or budgets.get(task, {}).get("first_tier_tokens")
+        if not first_tier:
+            logging.warning(f"No first-tier budget for {task}, skipping")
+            continue
+        task_ds = load_and_preprocess(task, token=args.hftoken, answer_shuffle_seed=42)
+        task_ds = task_ds.select(range(min(args.num_examples, len(task_ds))))
+        inputs = [
+            {"passage": passage, "question_options": question_options}
+            for passage, question_options in zip(task_ds["passage"], task_ds["question_options"])
+        ]
+
+        start = time.perf_counter()
+        single = CHAIN_REGISTRY[args.chain].build(llm).batch(inputs)
+        single_s = time.perf_counter() - start
+
+        two_tier_llm.first_tier = first_tier
+        start = time.perf_counter()
+        two_tier = CHAIN_REGISTRY[args.chain].build(two_tier_llm).batch(inputs)
+        two_tier_s = time.perf_counter() - start
+        stats = two_tier_llm.pop_stats()
+
+        results.append({
+            "task": task,
+            "first_tier": first_tier,
+            "max_new_tokens": args.max_new_tokens,
+            "single_tier_s": single_s,
+            "two_tier_s": two_tier_s,
+            "time_saved_s": single_s - two_tier_s,
+            "identical": sum(a == b for a, b in zip(single, two_tier)) / len(inputs),
+            **stats,
+        })
+        logging.info(
+            f"{task}: first tier {first_tier} of {args.max_new_tokens} tokens, {stats.get('continued', 0)} of "
+            f"{len(inputs)} traces continued; {single_s:.1f}s single-tier vs. {two_tier_s:.1f}s two-tier "
+            f"({single_s - two_tier_s:.1f}s saved), {stats.get('reserved_tokens_saved', 0)} reserved tokens saved, "
+            f"{results[-1]['identical']:.0%} traces identical"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "chain": args.chain, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
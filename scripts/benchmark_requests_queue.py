@@ -0,0 +1,86 @@
+"""benchmark requests queue lookup
+
+Compares the former full scan of the requests repo (snapshot_download of
+the whole repo + json.load of every file) with cold and warm starts of the
+incrementally synced requests queue index.
+
+usage:
+python scripts/benchmark_requests_queue.py --requests_repo $REQUESTS_REPO
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+
+from huggingface_hub import HfApi, snapshot_download
+
+from cot_eval.requests_queue import RequestsQueueIndex
+
+logging.basicConfig(level=logging.INFO)
+
+TOKEN = os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+API = HfApi(token=TOKEN)
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests_repo", type=str, default="cot-leaderboard/cot-leaderboard-requests")
+    parser.add_argument("--max_params", type=int, default=None)
+    return parser.parse_args()
+
+
+def full_scan(local_dir: str, hf_repo: str, max_params) -> list:
+    snapshot_download(
+        repo_id=hf_repo,
+        revision="main",
+        local_dir=local_dir,
+        repo_type="dataset",
+        etag_timeout=30,
+        max_workers=60,
+        token=TOKEN,
+    )
+    pending = []
+    for json_filepath in glob.glob(f"{local_dir}/**/*.json", recursive=True):
+        with open(json_filepath) as fp:
+            data = json.load(fp)
+        if data["status"] in "PENDING" and (max_params is None or (data.get("params") and data["params"] <= max_params)):
+            pending.append(data)
+    return pending
+
+
+def main():
+    args = parse_eval_args()
+
+    with tempfile.TemporaryDirectory() as scan_dir, tempfile.TemporaryDirectory() as index_dir:
+
+        start = time.perf_counter()
+        pending_scan = full_scan(scan_dir, args.requests_repo, args.max_params)
+        time_scan = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = RequestsQueueIndex(args.requests_repo, index_dir, API)
+        n_downloaded = index.sync()
+        pending_cold = index.get_eval_requests("PENDING", max_params=args.max_params)
+        time_cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = RequestsQueueIndex(args.requests_repo, index_dir, API)
+        index.sync()
+        pending_warm = index.get_eval_requests("PENDING", max_params=args.max_params)
+        time_warm = time.perf_counter() - start
+
+    if not len(pending_scan) == len(pending_cold) == len(pending_warm):
+        logging.warning("Full scan and index disagree on number of pending requests.")
+
+    logging.info(f"{len(pending_scan)} pending requests, {n_downloaded} request files in repo")
+    logging.info(f"full scan:         {time_scan:.2f}s")
+    logging.info(f"index, cold start: {time_cold:.2f}s")
+    logging.info(f"index, warm start: {time_warm:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
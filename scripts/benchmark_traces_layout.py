@@ -0,0 +1,121 @@
+"""benchmark trace parquet layouts
+
+Compares writing traces the former way (pandas copy of the dataset, per-row
+`config_data` column, default parquet settings) with the Arrow-native
+layout of `cot_eval.traces_io` on a synthetic traces dataset. Each variant
+runs in a fresh process; reported are write time, peak memory allocated
+during the write (python heap and arrow memory pool), and file size.
+
+usage:
+python scripts/benchmark_traces_layout.py --num_rows 5000
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+import pyarrow as pa
+from datasets import Dataset, load_from_disk
+
+from cot_eval.traces_io import write_traces
+
+logging.basicConfig(level=logging.INFO)
+
+CONFIG_DATA = {
+    "name": "nulla-quas-1234",
+    "model": "mistralai/Mistral-7B-Instruct-v0.2",
+    "cot_chain": "ReflectBeforeRun",
+    "max_new_tokens": "960",
+    "temperature": "0.3",
+    "top_k": "100",
+    "top_p": "0.95",
+    "dtype": "bfloat16",
+    "tensor_parallel_size": "1",
+    "gpu_memory_utilization": "0.9",
+    "revision": "main",
+    "swap_space": "4",
+}
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_rows", type=int, default=5000)
+    parser.add_argument("--questions_per_passage", type=int, default=6)
+    return parser.parse_args()
+
+
+def synthetic_traces(num_rows: int, questions_per_passage: int) -> Dataset:
+    rnd = random.Random(42)
+    words = [f"w{i}" for i in range(5000)]
+
+    def text(n):
+        return " ".join(rnd.choices(words, k=n))
+
+    passages = [text(300) for _ in range(num_rows // questions_per_passage + 1)]
+    rows = []
+    for i in range(num_rows):
+        options = [text(15) for _ in range(5)]
+        question = text(30)
+        rows.append({
+            "passage": passages[i // questions_per_passage],
+            "question": question,
+            "options": options,
+            "answer": rnd.randrange(5),
+            "labels": list("ABCDE"),
+            "question_options": question + "\n" + "\n".join(options),
+            "reasoning_trace": text(500),
+        })
+    return Dataset.from_list(rows)
+
+
+def write_pandas(ds, path):
+    df = pd.DataFrame(ds)
+    df["config_data"] = len(df) * [list(CONFIG_DATA.items()) + [("task", "lsat-rc")]]
+    df.to_parquet(path, index=False)
+
+
+def write_arrow(ds, path):
+    write_traces(ds.with_format("arrow")[:], {**CONFIG_DATA, "task": "lsat-rc"}, path)
+
+
+def run_variant(variant: str, dataset_dir: str, queue):
+    ds = load_from_disk(dataset_dir)  # memory-mapped, as in cot-eval after `map`
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "traces.parquet")
+        arrow_before = pa.default_memory_pool().max_memory()
+        tracemalloc.start()
+        start = time.perf_counter()
+        {"pandas": write_pandas, "arrow": write_arrow}[variant](ds, path)
+        elapsed = time.perf_counter() - start
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        arrow_peak = pa.default_memory_pool().max_memory() - arrow_before
+        queue.put((variant, elapsed, (python_peak + arrow_peak) / 2**20, os.path.getsize(path) / 2**20))
+
+
+def main():
+    args = parse_eval_args()
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    results = []
+    with tempfile.TemporaryDirectory() as dataset_dir:
+        synthetic_traces(args.num_rows, args.questions_per_passage).save_to_disk(dataset_dir)
+        for variant in ["pandas", "arrow"]:
+            process = ctx.Process(target=run_variant, args=(variant, dataset_dir, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+
+    logging.info(f"Writing {args.num_rows} traces ({args.questions_per_passage} questions per passage)")
+    for variant, elapsed, peak_mb, size_mb in results:
+        logging.info(f"{variant:>6}: write time {elapsed:.2f}s, peak memory +{peak_mb:.0f}MB, file size {size_mb:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
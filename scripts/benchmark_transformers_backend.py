@@ -0,0 +1,88 @@
+"""benchmark trace generation with the CPU transformers backend
+
+Generates reasoning traces for a sample of a task's problems with a small
+model, for several batch sizes, with and without length bucketing, and
+reports generated tokens per second. Runs on any machine (no GPU), so
+throughput regressions of the backend can be tracked.
+
+usage:
+python scripts/benchmark_transformers_backend.py --model sshleifer/tiny-gpt2 --task logiqa --num_examples 64 \
+    --batch_sizes 1,8,32 [--output benchmark.json]
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from cot_eval.chain_registry import CHAIN_REGISTRY
+from cot_eval.preprocessing import load_and_preprocess
+from cot_eval.transformers_backend import TransformersCPU
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="sshleifer/tiny-gpt2")
+    parser.add_argument("--revision", type=str, default="main")
+    parser.add_argument("--chain", type=str, default="HandsOn")
+    parser.add_argument("--task", type=str, default="logiqa")
+    parser.add_argument("--num_examples", type=int, default=64)
+    parser.add_argument("--max_new_tokens", type=int, default=64)
+    parser.add_argument("--batch_sizes", type=str, default="1,8,32", help="Comma-separated batch sizes")
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--hftoken", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None, help="Write results as json to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_eval_args()
+    task_ds = load_and_preprocess(args.task, token=args.hftoken, answer_shuffle_seed=42)
+    task_ds = task_ds.select(range(min(args.num_examples, len(task_ds))))
+    inputs = [
+        {"passage": passage, "question_options": question_options}
+        for passage, question_options in zip(task_ds["passage"], task_ds["question_options"])
+    ]
+
+    llm = TransformersCPU.from_modelkwargs(
+        args.model,
+        temperature=0,
+        max_new_tokens=args.max_new_tokens,
+        num_threads=args.num_threads,
+        vllm_kwargs={"revision": args.revision},
+    )
+    tokenizer = llm.tokenizer
+
+    results = []
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        for bucket_by_length in [False, True]:
+            if batch_size == 1 and bucket_by_length:
+                continue  # same as unbucketed
+            llm.batch_size = batch_size
+            llm.bucket_by_length = bucket_by_length
+            chain = CHAIN_REGISTRY[args.chain].build(llm)
+            start = time.perf_counter()
+            traces = chain.batch(inputs)
+            duration = time.perf_counter() - start
+            num_tokens = sum(len(tokenizer(t)["input_ids"]) for t in traces)
+            results.append({
+                "batch_size": batch_size,
+                "bucket_by_length": bucket_by_length,
+                "duration_s": duration,
+                "tokens": num_tokens,
+                "tokens_per_s": num_tokens / duration,
+            })
+            logging.info(
+                f"batch size {batch_size:3d}, {'bucketed' if bucket_by_length else 'unbucketed'}: "
+                f"{duration:.1f}s, {num_tokens / duration:.1f} tokens/s"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "task": args.task, "num_examples": len(inputs), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
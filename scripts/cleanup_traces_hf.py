@@ -10,26 +10,59 @@ The reason why some traces are used stems from failures in the cot-eval pipeline
 
 If step 2 fails, the traces are not used and should be removed.
 
+Two layouts of the traces repo are reconciled:
+
+- legacy (`cot-eval-traces`): one top-level folder per traces config,
+  listed in the README's `dataset_info`
+- 2.0 (`cot-eval-traces-2.0`): one parquet file per config and task,
+  `data/<org>/<model>/<config>-<task>.parquet` (answer permutations
+  suffixed `-perm<k>`); the cot alias `<config>_<task>_cot` in the results
+  refers to it. Screening traces (`-screen<k>`) have no harness results
+  and are never deleted.
+
+The layout is detected from the top-level `data` folder. Only traces
+configs (legacy) or trace files of config and task (2.0) are deleted;
+other folders are reported but left alone. In the 2.0 layout, results of
+configs without any trace file predate the layout (their traces are in
+the legacy repo): they are reported, but do not block the clean-up.
 """
 
 
-import glob
 import json
 import os
+import re
 import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
 import yaml
 
 import argparse
 from huggingface_hub import HfApi, snapshot_download, CommitOperationAdd, CommitOperationDelete
+from huggingface_hub.hf_api import RepoFile, RepoFolder
+
+try:
+    import ijson  # streaming JSON parser, optional
+except ImportError:  # no cov
+    ijson = None
 
 import logging
 
+from cot_eval.tasks_registry import TASKS_REGISTRY
+from cot_eval.timeline import entry_point
+
 logging.basicConfig(level=logging.INFO)
 
 TOKEN = os.environ.get("HUGGINGFACEHUB_API_TOKEN") # A read/write token for your org
 API = HfApi(token=TOKEN)
 RESULTS_REPO = "cot-leaderboard/cot-eval-results"
 TRACES_REPO = "cot-leaderboard/cot-eval-traces"
+DATA_DIR = "data"  # top-level folder of the 2.0 layout
+# <config>-<task>[-perm<k>][-screen<k>].parquet, tasks longest first (e.g. logiqa2 before logiqa)
+TRACE_FILE_PATTERN = re.compile(
+    r"^(?P<config>.+)-(?P<task>"
+    + "|".join(re.escape(t) for t in sorted(TASKS_REGISTRY, key=len, reverse=True))
+    + r")(?P<perm>-perm\d+)?(?P<screen>-screen\d+)?\.parquet$"
+)
 
 
 def parse_eval_args() -> argparse.Namespace:
@@ -38,6 +71,7 @@ def parse_eval_args() -> argparse.Namespace:
     parser.add_argument("--traces_repo", type=str, default=TRACES_REPO)
     parser.add_argument("--verbose", type=bool, default=False)
     parser.add_argument("--do_cleanup", type=bool, default=False)
+    parser.add_argument("--report_file", type=str, default=None, help="Write (dry-run) diff report as json to this file")
     return parser.parse_args()
 
 
@@ -58,44 +92,146 @@ def parse_readme(readme_path: str):
 
     return metadata, content
 
-def main():
 
-    logging.info("This script is deprectaed and will be removed in future versions.")
-    return
+def result_aliases(json_filepath: str) -> List[str]:
+    """Aliases of all records in a results JSON (streaming only the `results` section if ijson is available)"""
+    if ijson is None:
+        with open(json_filepath, "r") as f:
+            data = json.load(f).get("results", {})
+        return [v["alias"] for v in data.values() if "alias" in v]
+    with open(json_filepath, "rb") as f:
+        return [v["alias"] for _, v in ijson.kvitems(f, "results") if "alias" in v]
+
+
+def trace_units(paths: List[str]) -> Dict[str, List[str]]:
+    """Trace files of the 2.0 layout per unit `<config>_<task>` (the cot alias without `_cot`)
+
+    Screening traces and files not named after a config and task are left out.
+    """
+    units: Dict[str, List[str]] = {}
+    for path in paths:
+        match = TRACE_FILE_PATTERN.match(os.path.basename(path))
+        if match is None:
+            logging.warning(f"Unexpected file {path} in traces repo. Ignoring.")
+            continue
+        if match["screen"]:
+            continue
+        units.setdefault(f"{match['config']}_{match['task']}", []).append(path)
+    return units
+
+
+def unit_config(unit: str) -> str:
+    """Config of a unit `<config>_<task>` (the unit itself if it does not end in a task)"""
+    for task in sorted(TASKS_REGISTRY, key=len, reverse=True):
+        if unit.endswith(f"_{task}"):
+            return unit[:-len(task) - 1]
+    return unit
+
+
+@dataclass
+class Reconciliation:
+    """Set-based diff between cot configs in results repo and traces configs/dirs in traces repo
+
+    With `unit_files` (2.0 layout), traces configs are the units of trace
+    files and deletions are files; otherwise deletions are folders of
+    unused traces configs.
+    """
+
+    cot_configs: Dict[str, str]
+    """cot config name -> results file it was found in"""
+    unknown_aliases: List[dict]
+    traces_configs: Set[str]
+    traces_datadirs: Set[str]
+    unused: List[str] = field(default_factory=list)
+    """traces configs without results"""
+    missing: List[str] = field(default_factory=list)
+    """cot configs without traces"""
+    defects_no_dir: List[str] = field(default_factory=list)
+    """traces configs without data directory"""
+    defects_no_config: List[str] = field(default_factory=list)
+    """data directories without traces config"""
+    unit_files: Optional[Dict[str, List[str]]] = None
+    """trace files per traces config (2.0 layout)"""
+    legacy: List[str] = field(default_factory=list)
+    """cot configs without traces, whose config has no trace files at all (2.0 layout)"""
+
+    def __post_init__(self):
+        # a cot config `a_b` may appear as `a-b` in the traces repo
+        known = set(self.cot_configs) | {name.replace("_", "-") for name in self.cot_configs}
+        self.unused = sorted(self.traces_configs - known)
+        self.missing = sorted(
+            name for name in self.cot_configs
+            if name not in self.traces_configs and name.replace("_", "-") not in self.traces_configs
+        )
+        if self.unit_files is not None:
+            # results of configs that uploaded no trace files predate the 2.0 layout
+            configs = {unit_config(unit) for unit in self.unit_files}
+            self.legacy = [name for name in self.missing if unit_config(name) not in configs]
+            self.missing = [name for name in self.missing if unit_config(name) in configs]
+        self.defects_no_dir = sorted(self.traces_configs - self.traces_datadirs)
+        self.defects_no_config = sorted(self.traces_datadirs - self.traces_configs)
+
+    @property
+    def all_clear(self) -> bool:
+        return not (self.unused or self.missing or self.defects_no_dir or self.defects_no_config)
+
+    def planned_deletions(self) -> List[str]:
+        if self.unit_files is not None:
+            return sorted(path for unit in self.unused for path in self.unit_files[unit])
+        # never delete a folder that is not a traces config (e.g. the data folder of the 2.0 layout)
+        return [f"{d}/" for d in self.unused if d in self.traces_configs and d != DATA_DIR]
+
+    def report(self) -> dict:
+        return {
+            "num_cot_configs": len(self.cot_configs),
+            "num_traces_configs": len(self.traces_configs),
+            "unknown_aliases": self.unknown_aliases,
+            "unused_traces_configs": self.unused,
+            "missing_traces_configs": [{"name": n, "path": self.cot_configs[n]} for n in self.missing],
+            "legacy_cot_configs": [{"name": n, "path": self.cot_configs[n]} for n in self.legacy],
+            "traces_configs_without_datadir": self.defects_no_dir,
+            "traces_datadirs_without_config": self.defects_no_config,
+            "layout": "2.0" if self.unit_files is not None else "legacy",
+            "planned_deletions": self.planned_deletions(),
+        }
+
+
+def collect_cot_configs(results_repo: str, temp_dir: str):
+    """Download only the results JSONs and collect the names of all cot configs"""
+    snapshot_download(
+        repo_id=results_repo,
+        revision="main",
+        local_dir=temp_dir,
+        repo_type="dataset",
+        allow_patterns=["*.json", "**/*.json"],
+        max_workers=60,
+        token=TOKEN
+    )
+    cot_configs = {}
+    unknown_aliases = []
+    for root, _, files in os.walk(temp_dir):
+        for filename in files:
+            if not filename.endswith(".json"):
+                continue
+            json_filepath = os.path.join(root, filename)
+            for alias in result_aliases(json_filepath):
+                if alias.endswith("_cot"):
+                    cot_configs.setdefault(alias[:-4], json_filepath)
+                elif alias.endswith("_base") or alias.endswith("_orig"):
+                    continue
+                else:
+                    logging.debug(f"Unknown alias {alias}. Ignoring entry.")
+                    unknown_aliases.append({"name": alias, "path": json_filepath})
+    return cot_configs, unknown_aliases
+
+
+@entry_point("cleanup_traces_hf")
+def main():
 
     args = parse_eval_args()
 
-
     with tempfile.TemporaryDirectory() as temp_dir:
-
-        snapshot_download(
-            repo_id=args.results_repo,
-            revision="main",
-            local_dir=temp_dir,
-            repo_type="dataset",
-            max_workers=60,
-            token=TOKEN
-        )
-
-        # copy/upload all new results for this model to raw results repo
-        cot_configs = []
-        unknown_aliases = []
-        result_files = glob.glob(f"{temp_dir}/**/*.json", recursive=True)
-        for json_filepath in result_files:
-            with open(json_filepath, "r") as f:
-                result = json.load(f)
-                data = result.get("results", {})
-                for _, v in data.items():
-                    if v["alias"].endswith("_cot"):
-                        cot_configs.append({"name": v["alias"][:-4], "path": json_filepath})    
-                    elif v["alias"].endswith("_base"):
-                        continue
-                    elif v["alias"].endswith("_orig"):
-                        continue
-                    else:
-                        logging.debug(f"Unknown alias {v['alias']}. Ignoring entry.")
-                        unknown_aliases.append({"name": v["alias"], "path": json_filepath})
-
+        cot_configs, unknown_aliases = collect_cot_configs(args.results_repo, temp_dir)
 
     logging.info("Found %d cot_configs", len(cot_configs))
     icon = "⚠️ " if unknown_aliases else "✅"
@@ -104,67 +240,89 @@ def main():
         for e, unknown in enumerate(unknown_aliases):
             logging.info(f"Unknown alias #{e}: {unknown}")
 
-
-
     with tempfile.TemporaryDirectory() as temp_dir:
 
-        snapshot_download(
-            repo_id=args.traces_repo,
-            revision="main",
-            local_dir=temp_dir,
-            repo_type="dataset",
-            max_workers=60,
-            token=TOKEN
-        )
-
-        readme_path = os.path.join(temp_dir, "README.md")
-        metadata, content = parse_readme(readme_path)
-        traces_datadirs = glob.glob(f"{temp_dir}/*/", recursive=True)
-        traces_datadirs = [os.path.basename(d[:-1]) for d in traces_datadirs]
-
-        if "dataset_info" not in metadata:
-            raise ValueError("No dataset_info in README.md yaml block.")
-
-        traces_configs = [c["config_name"] for c in metadata["dataset_info"]]
-        cot_configs_var = [
-            {"name": c["name"].replace("_", "-"), "path": c["path"]}
-            for c in cot_configs
-        ]
-        unused_traces_configs = [
-            c for c in traces_configs
-            if c not in [x["name"] for x in cot_configs+cot_configs_var]
-        ]
-        missing_traces_configs = [
-            c for c,cv in zip(cot_configs,cot_configs_var)
-            if c["name"] not in traces_configs and cv["name"] not in traces_configs
-        ]
-
-        defects1 = [c for c in traces_configs if c not in traces_datadirs]
-        if defects1:
-            logging.warning("🛑 Found %d traces_configs without data directory. Traces dataset is defect.", len(defects1))
+        # metadata only: tree listings and README, no parquet data
+        traces_datadirs = {
+            entry.path for entry in API.list_repo_tree(
+                repo_id=args.traces_repo, repo_type="dataset", revision="main", recursive=False
+            )
+            if isinstance(entry, RepoFolder)
+        }
+
+        if DATA_DIR in traces_datadirs:
+            trace_files = [
+                entry.path for entry in API.list_repo_tree(
+                    repo_id=args.traces_repo, path_in_repo=DATA_DIR, repo_type="dataset", revision="main", recursive=True
+                )
+                if isinstance(entry, RepoFile)
+            ]
+            unit_files = trace_units(trace_files)
+            logging.info("2.0 layout: found %d trace files of %d traces configs", len(trace_files), len(unit_files))
+            readme_path, metadata, content = None, {}, ""
+            diff = Reconciliation(
+                cot_configs=cot_configs,
+                unknown_aliases=unknown_aliases,
+                traces_configs=set(unit_files),
+                traces_datadirs=set(unit_files),
+                unit_files=unit_files,
+            )
+        else:
+            readme_path = API.hf_hub_download(
+                repo_id=args.traces_repo,
+                filename="README.md",
+                repo_type="dataset",
+                revision="main",
+                local_dir=temp_dir,
+            )
+            metadata, content = parse_readme(readme_path)
+
+            if "dataset_info" not in metadata:
+                raise ValueError("No dataset_info in README.md yaml block.")
+
+            diff = Reconciliation(
+                cot_configs=cot_configs,
+                unknown_aliases=unknown_aliases,
+                traces_configs={c["config_name"] for c in metadata["dataset_info"]},
+                traces_datadirs=traces_datadirs,
+            )
+
+        if diff.defects_no_dir:
+            logging.warning("🛑 Found %d traces_configs without data directory. Traces dataset is defect.", len(diff.defects_no_dir))
             if args.verbose:
-                for e, defect in enumerate(defects1):
+                for e, defect in enumerate(diff.defects_no_dir):
                     logging.info(f"Defect traces_config #{e}:\n{defect}")
-        defects2 = [c for c in traces_datadirs if c not in traces_configs]
-        if defects2:
-            logging.warning("🛑 Found %d traces_datadirs without config. Traces dataset is defect.", len(defects2))
+        if diff.defects_no_config:
+            logging.warning("🛑 Found %d traces_datadirs without config (not deleted). Traces dataset is defect.", len(diff.defects_no_config))
             if args.verbose:
-                for e, defect in enumerate(defects2):
+                for e, defect in enumerate(diff.defects_no_config):
                     logging.info(f"Defect traces_dir #{e}: {defect}")
-        if missing_traces_configs:
-            logging.warning("🛑 Found %d missing traces_configs", len(missing_traces_configs))
+        if diff.missing:
+            logging.warning("🛑 Found %d missing traces_configs", len(diff.missing))
+            if args.verbose:
+                for e, missing in enumerate(diff.missing):
+                    logging.info(f"Missing traces_config #{e}: {missing} ({cot_configs[missing]})")
+        if diff.legacy:
+            logging.warning("⚠️  Found %d cot_configs without traces in the 2.0 layout (legacy results, not blocking)", len(diff.legacy))
             if args.verbose:
-                for e, missing in enumerate(missing_traces_configs):
-                    logging.info(f"Missing traces_config #{e}: {missing}")
+                for e, legacy in enumerate(diff.legacy):
+                    logging.info(f"Legacy cot_config #{e}: {legacy} ({cot_configs[legacy]})")
 
-        icon = "⚠️ " if defects1 or defects2 or missing_traces_configs or unused_traces_configs else "✅"
-        logging.info("%s Found %d unused traces_configs of %d", icon, len(unused_traces_configs), len(traces_configs))
+        icon = "⚠️ " if not diff.all_clear else "✅"
+        logging.info("%s Found %d unused traces_configs of %d", icon, len(diff.unused), len(diff.traces_configs))
         if args.verbose:
-            for e, unused in enumerate(unused_traces_configs):
+            for e, unused in enumerate(diff.unused):
                 logging.info(f"Unused traces_config #{e}: {unused}")
 
+        report = diff.report()
+        if args.report_file is not None:
+            with open(args.report_file, "w") as f:
+                json.dump(report, f, indent=2)
+            logging.info(f"Wrote diff report to {args.report_file}")
+
         if not args.do_cleanup:
-            if defects1 or defects2 or missing_traces_configs or unused_traces_configs:
+            if not diff.all_clear:
+                logging.info("Dry run. Planned deletions: %s", report["planned_deletions"])
                 logging.info("Check completed. To cleanup dataset, set --do_cleanup arg.")
             else:
                 logging.info("Check completed. All clear.")
@@ -173,54 +331,41 @@ def main():
         if not TOKEN:
             raise ValueError("No HF token specified")
 
-        if unused_traces_configs or defects2:
-            for unused in unused_traces_configs:
-                metadata["dataset_info"] = [c for c in metadata["dataset_info"] if c["config_name"] != unused]
-                metadata["configs"] = [c for c in metadata["configs"] if c["config_name"] != unused]
-
-            if not all(
-                (c["config_name"] in [x["name"] for x in cot_configs+cot_configs_var])
-                for c in metadata["dataset_info"]
-            ):
-                logging.error("Some traces have no corresponding records in results dataset.")
-                raise ValueError("Traces dataset is not consistent with results dataset. Aborting clean up. Dataset has not been changed.")
-
-            if not all(
-                c["name"] in traces_configs or cv["name"] in traces_configs
-                for c,cv in zip(cot_configs,cot_configs_var)
-            ):
+        if report["planned_deletions"]:
+            if diff.missing:
                 logging.error("Some records in results dataset have no corresponding traces.")
                 raise ValueError("Traces dataset is not consistent with results dataset. Aborting clean up. Dataset has not been changed.")
 
-            #write readme to tmpfile
-            if not content.strip("\n "):
-                content = "# cot-eval-traces"
-            with open(readme_path, "w") as f:
-                f.write("---\n")
-                f.write(yaml.dump(metadata, sort_keys=False))
-                f.write("---\n")
-                f.write(content+"\n")
-                f.flush()
-
-                cleanup_operations = [
-                    CommitOperationAdd(path_in_repo="README.md", path_or_fileobj=readme_path),
-                ]
-                for unused in unused_traces_configs:
-                    cleanup_operations.append(CommitOperationDelete(path_in_repo=f"{unused}/"))
-                for defect in defects2:
-                    cleanup_operations.append(CommitOperationDelete(path_in_repo=f"{defect}/"))
-
-                API.create_commit(
-                    repo_id=args.traces_repo,
-                    operations=cleanup_operations,
-                    repo_type="dataset",
-                    commit_message="Cleanup traces (delete ununsed traces)",
-                    create_pr=True,
-                )
-
-            logging.info("Cleaned up %d unused traces_configs", len(unused_traces_configs))
-            logging.info("Cleaned up %d defect traces_dirs", len(defects2))
+            cleanup_operations = []
+            if readme_path is not None:
+                unused = set(diff.unused)
+                metadata["dataset_info"] = [c for c in metadata["dataset_info"] if c["config_name"] not in unused]
+                metadata["configs"] = [c for c in metadata["configs"] if c["config_name"] not in unused]
+
+                #write readme to tmpfile
+                if not content.strip("\n "):
+                    content = "# cot-eval-traces"
+                with open(readme_path, "w") as f:
+                    f.write("---\n")
+                    f.write(yaml.dump(metadata, sort_keys=False))
+                    f.write("---\n")
+                    f.write(content+"\n")
+                    f.flush()
+                cleanup_operations.append(CommitOperationAdd(path_in_repo="README.md", path_or_fileobj=readme_path))
+
+            for deletion in report["planned_deletions"]:
+                cleanup_operations.append(CommitOperationDelete(path_in_repo=deletion))
+
+            API.create_commit(
+                repo_id=args.traces_repo,
+                operations=cleanup_operations,
+                repo_type="dataset",
+                commit_message="Cleanup traces (delete ununsed traces)",
+                create_pr=True,
+            )
+
+            logging.info("Cleaned up %d unused traces_configs (%d paths)", len(diff.unused), len(report["planned_deletions"]))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
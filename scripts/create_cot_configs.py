@@ -20,6 +20,8 @@ import yaml
 
 import faker
 
+from cot_eval.timeline import entry_point
+
 
 logging.basicConfig(level=logging.INFO)
 
@@ -39,9 +41,12 @@ def parse_eval_args() -> argparse.Namespace:
     parser.add_argument("--output_dir", type=str, default=None)
     parser.add_argument("--template_path", type=str, default=None)
     parser.add_argument("--keys_file", type=str, default=None)
+    parser.add_argument("--backend", type=str, default="vllm", choices=["vllm", "transformers"], help="LLM backend (transformers: CPU)")
+    parser.add_argument("--final_answer", action="store_true", help="Instruct model to state a final answer label (generative accuracy)")
     return parser.parse_args()
 
 
+@entry_point("create_cot_configs")
 def main():
 
     args = parse_eval_args()
@@ -102,6 +107,9 @@ def main():
             config["cot_chain"] = chain
             config["tasks"] = tasks
             config["description"] = "Automatically created with create_cot_configs.py."
+            config["backend"] = args.backend
+            if args.final_answer:
+                config["final_answer"] = True
 
             if "modelkwargs" not in config:
                 config["modelkwargs"] = {}
@@ -6,7 +6,8 @@ python scripts/create_lm_eval_harness_tasks.py \
     --model user/model_id \
     --configs $configkeys \
     --output_dir eleuther/tasks/logikon \
-    --keys_file ./lm_eval_harness_tasks.txt
+    --keys_file ./lm_eval_harness_tasks.txt \
+    [--tasks logiqa,lsat-ar --data_file_suffix -screen0]  # screening round (see src/cot_eval/screening.py)
 """
 
 import argparse
@@ -15,6 +16,8 @@ import json
 import os
 import yaml
 
+from cot_eval.timeline import entry_point
+
 
 logging.basicConfig(level=logging.INFO)
 
@@ -27,9 +30,12 @@ def parse_eval_args() -> argparse.Namespace:
     parser.add_argument("--traces_dataset_path", type=str, default="cot-leaderboard/cot-eval-traces-2.0")
     parser.add_argument("--output_dir", type=str, default=None)
     parser.add_argument("--keys_file", type=str, default=None)
+    parser.add_argument("--tasks", type=str, default=None, help="Comma-separated tasks to create harness tasks for (default: all tasks of configs)")
+    parser.add_argument("--data_file_suffix", type=str, default="", help="Suffix of traces data files (e.g. screening rounds)")
     return parser.parse_args()
 
 
+@entry_point("create_lm_eval_harness_tasks")
 def main():
 
     args = parse_eval_args()
@@ -46,6 +52,7 @@ def main():
         raise ValueError(f"configs_dir is not a directory: {args.configs_dir}")
 
     configs = args.configs.split(",")
+    only_tasks = args.tasks.split(",") if args.tasks else None
 
     created_harness_tasks_keys = {"base": [], "cot": []}
 
@@ -55,6 +62,8 @@ def main():
             config = yaml.load(fp, Loader=yaml.SafeLoader)
         
         for task in config["tasks"]:
+            if only_tasks is not None and task not in only_tasks:
+                continue
             for subtype in ["base", "cot"]:
 
                 # check if base harness_task (without cot traces) has been created for task before
@@ -66,7 +75,7 @@ def main():
                     continue
 
                 # where to find data in cot eval traces repo
-                data_file_path = os.path.join("data", args.model, f"{config['name']}-{task}.parquet")
+                data_file_path = os.path.join("data", args.model, f"{config['name']}-{task}{args.data_file_suffix}.parquet")
 
                 harness_task = {
                     "task": f"{config['name']}_{task}_{subtype}",
@@ -1,11 +1,18 @@
-import glob
 import json
+import logging
 import os
-from dataclasses import dataclass
+import time
 from typing import Optional
 
 import argparse
-from huggingface_hub import HfApi, snapshot_download
+from huggingface_hub import HfApi
+
+from cot_eval.request_leases import LEASE_TTL, MAX_ATTEMPTS, RequestClaimer, claimable_requests
+from cot_eval.requests_queue import EvalRequest, RequestsQueueIndex
+from cot_eval.scheduler import GpuInventory, plan_jobs
+from cot_eval.timeline import entry_point
+
+logging.basicConfig(level=logging.INFO)
 
 TOKEN = os.environ.get("HUGGINGFACEHUB_API_TOKEN") # A read/write token for your org
 if TOKEN is None:
@@ -13,98 +20,86 @@ if TOKEN is None:
 API = HfApi(token=TOKEN)
 
 
-@dataclass
-class EvalRequest:
-    model: str
-    status: str
-    json_filepath: str
-    private: bool = False
-    weight_type: str = "Original"
-    model_type: str = ""  # pretrained, finetuned, with RL
-    precision: str = ""  # float16, bfloat16
-    base_model: Optional[str] = None # for adapter models
-    revision: str = "main" # commit
-    submitted_time: Optional[str] = "2022-05-18T11:40:22.519222"  # random date just so that we can still order requests by date
-    model_type: Optional[str] = None
-    likes: Optional[int] = 0
-    params: Optional[int] = None
-    license: Optional[str] = ""
-    
-    def get_model_args(self):
-        model_args = f"pretrained={self.model},revision={self.revision}"
-
-        if self.precision in ["float16", "bfloat16", "float32"]:
-            model_args += f",dtype={self.precision}"
-            pass
-        else:
-            raise Exception(f"Unknown precision {self.precision}.")
-        
-        return model_args
-
-
 def parse_eval_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--model_id", type=str, default=None)
     parser.add_argument("--keys_file", type=str, default=None)
     parser.add_argument("--max_params", type=int, default=None)
     parser.add_argument("--requests_repo", type=str, default="cot-leaderboard/cot-leaderboard-requests")
-    parser.add_argument("--create_pr", type=bool, default=False, help="Whether to create pull requests when uploading")
+    parser.add_argument("--create_pr", type=bool, default=False, help="Ignored: claims are committed directly (compare-and-set)")
     parser.add_argument("--tmp_dir", type=str, default="./TMP")
+    parser.add_argument("--worker_id", type=str, default=None, help="Unique id of this worker, defaults to hostname-pid")
+    parser.add_argument("--lease_ttl", type=int, default=LEASE_TTL, help="Lease duration in seconds")
+    parser.add_argument("--max_attempts", type=int, default=MAX_ATTEMPTS, help="Claims of a request before it is set to FAILED")
+    parser.add_argument("--jobs_dir", type=str, default=None, help="If set, pack several models onto this node's GPUs and write one keys file per job to this dir")
+    parser.add_argument("--num_gpus", type=int, default=1, help="Number of GPUs on this node (packing only)")
+    parser.add_argument("--gpu_memory_gb", type=float, default=80, help="Memory per GPU in GB (packing only)")
+    parser.add_argument("--gpu_memory_utilization", type=float, default=0.9, help="GPU memory utilization (packing only)")
+    parser.add_argument("--max_jobs", type=int, default=None, help="Maximum number of models evaluated side by side (packing only)")
     return parser.parse_args()
 
 
-def set_eval_request(eval_request: EvalRequest, set_to_status: str, hf_repo: str, local_dir: str, create_pr: bool = False):
-    """Updates a given eval request with its new status on the hub (running, completed, failed, ...)"""
-    json_filepath = eval_request.json_filepath
-
-    with open(json_filepath) as fp:
-        data = json.load(fp)
+def get_claimable_requests(local_dir: str, hf_repo: str, max_params: Optional[float] = None) -> list[EvalRequest]:
+    """Get all claimable evaluation requests, sorted by submission time.
 
-    data["status"] = set_to_status
+    Claimable are pending requests and running requests whose lease has
+    expired (see request_leases.py). Uses a persistent local index of the
+    requests repo, which is synced incrementally (only request files
+    changed since the last sync are downloaded).
 
-    with open(json_filepath, "w") as f:
-        f.write(json.dumps(data, indent=4))
-
-    API.upload_file(
-        path_or_fileobj=json_filepath,
-        path_in_repo=json_filepath.replace(local_dir, ""),
-        repo_id=hf_repo,
-        commit_message=f"Update status to {set_to_status}",
-        create_pr=create_pr,
-        repo_type="dataset",
-    )
-
-
-def get_eval_requests(job_status: list, local_dir: str, hf_repo: str) -> list[EvalRequest]:
-    """Get all pending evaluation requests and return a list in which private
-    models appearing first, followed by public models sorted by the number of
-    likes.
     Returns:
         `list[EvalRequest]`: a list of model info dicts.
     """
-    snapshot_download(
-        repo_id=hf_repo,
-        revision="main",
-        local_dir=local_dir,
-        repo_type="dataset",
-        etag_timeout=30,
-        max_workers=60,
-        token=TOKEN,
-    )
-    json_files = glob.glob(f"{local_dir}/**/*.json", recursive=True)
-
-    eval_requests = []
-    for json_filepath in json_files:
-        with open(json_filepath) as fp:
-            data = json.load(fp)
-        if data["status"] in job_status:
-            data["json_filepath"] = json_filepath
-            eval_request = EvalRequest(**data)
-            eval_requests.append(eval_request)
+    start = time.perf_counter()
+    index = RequestsQueueIndex(hf_repo, local_dir, API)
+    warm = index.sha is not None
+    index.sync()
+    eval_requests = claimable_requests(index, max_params=max_params)
+    logging.info(f"Looked up requests queue ({'warm' if warm else 'cold'} start) in {time.perf_counter() - start:.2f}s")
 
     return eval_requests
 
 
+def claim_jobs(args: argparse.Namespace, eval_requests: list[EvalRequest], claimer: RequestClaimer):
+    """Plan jobs for this node's GPUs, claim them and write one keys file per job"""
+    if args.max_params is not None:
+        eval_requests = [r for r in eval_requests if r.params and r.params <= args.max_params]
+    inventory = GpuInventory(
+        num_gpus=args.num_gpus,
+        memory_gb=args.gpu_memory_gb,
+        gpu_memory_utilization=args.gpu_memory_utilization,
+    )
+    jobs = plan_jobs(eval_requests, inventory, max_jobs=args.max_jobs)
+
+    os.makedirs(args.jobs_dir, exist_ok=True)
+    job_files = []
+    for job in jobs:
+        eval_request = claimer.claim(model_id=job.eval_request.model)
+        if eval_request is None:
+            logging.info(f"{job.eval_request.model} has been claimed by another worker. Skipping.")
+            continue
+        job_file = os.path.join(args.jobs_dir, f"job_{len(job_files)}.json")
+        with open(job_file, "w") as f:
+            json.dump({
+                "model": eval_request.model,
+                "revision": eval_request.revision,
+                "precision": eval_request.precision,
+                "request_file": claimer.path_in_repo(eval_request),
+                "worker_id": claimer.worker_id,
+                "tensor_parallel_size": job.tensor_parallel_size,
+                "gpu_ids": ",".join(str(i) for i in job.gpu_ids),
+            }, f)
+        job_files.append(job_file)
+        logging.info(f"Planned {eval_request.model} on GPUs {job.gpu_ids} (est. {job.memory_gb:.0f}GB).")
+
+    if not job_files:
+        raise ValueError("No pending evaluation requests could be placed on this node.")
+
+    with open(args.keys_file, "w") as f:
+        f.write(",".join(job_files))
+
+
+@entry_point("lookup_pending_model")
 def main():
 
     args = parse_eval_args()
@@ -113,38 +108,38 @@ def main():
 
     local_cache_dir = os.path.join(args.tmp_dir, "cot-leaderboard-requests")
 
-    eval_requests = get_eval_requests("PENDING", local_cache_dir, args.requests_repo)
+    eval_requests = get_claimable_requests(local_cache_dir, args.requests_repo)
 
     if not eval_requests:
-        raise ValueError("No pending evaluation requests found.")
+        raise ValueError("No pending evaluation requests (or expired leases) found.")
 
     if args.model_id:
-        next_eval_request = next(iter([eval_request for eval_request in eval_requests if eval_request.model == args.model_id]), None)
-        if next_eval_request is None:
-            raise ValueError(f"Model {args.model_id} not found in pending requests.")
-    else:
-        # filter by max_params
-        if args.max_params is not None:
-            eval_requests = [
-                eval_request for eval_request in eval_requests
-                if eval_request.params and eval_request.params <= args.max_params
-            ]
-
-        if not eval_requests:
-            raise ValueError("No pending evaluation requests (meeting MAX_PARAMS condition) found.")
-
-        # sort by "submitted_time" and get next
-        eval_requests = sorted(eval_requests, key=lambda x: x.submitted_time)
-        next_eval_request = eval_requests[0]
-
-    # set status to running
-    set_eval_request(next_eval_request, "RUNNING",  args.requests_repo, local_cache_dir, args.create_pr)
+        if not any(eval_request.model == args.model_id for eval_request in eval_requests):
+            raise ValueError(f"Model {args.model_id} not found in claimable requests.")
+
+    index = RequestsQueueIndex(args.requests_repo, local_cache_dir, API)
+    claimer = RequestClaimer(index, worker_id=args.worker_id, ttl=args.lease_ttl, max_attempts=args.max_attempts)
+
+    if args.jobs_dir is not None:
+        claim_jobs(args, eval_requests, claimer)
+        return
+
+    # claim oldest pending request (meeting MAX_PARAMS condition), or the one of model_id,
+    # and set status to running with a lease held by this worker
+    next_eval_request = claimer.claim(
+        max_params=None if args.model_id else args.max_params,
+        model_id=args.model_id,
+    )
+    if next_eval_request is None:
+        raise ValueError("No pending evaluation requests (meeting MAX_PARAMS condition) could be claimed.")
 
     # write model args to output file
     next_model = {
         "model": next_eval_request.model,
         "revision": next_eval_request.revision,
         "precision": next_eval_request.precision,
+        "request_file": claimer.path_in_repo(next_eval_request),
+        "worker_id": claimer.worker_id,
     }
     with open(args.keys_file, "w") as f:
         json.dump(next_model, f)
@@ -0,0 +1,98 @@
+"""rebuild leaderboard records of all models in one pass
+
+Syncs the raw results repo (results JSONs only), updates the local results
+warehouse incrementally and recomputes every model's results_leaderboard.json.
+
+usage:
+python scripts/rebuild_leaderboard.py \
+    --tasks $TASKS \
+    --tmp_dir $LOTMP_DEFAULT \
+    --output_dir ./leaderboard  # write records locally
+    [--upload]  # push all records in a single commit
+"""
+
+import argparse
+import json
+import logging
+import os
+
+from huggingface_hub import HfApi, CommitOperationAdd, snapshot_download
+
+from cot_eval.results_warehouse import ResultsWarehouse, leaderboard_records
+from cot_eval.timeline import entry_point
+
+logging.basicConfig(level=logging.INFO)
+
+TOKEN = os.environ.get("HUGGINGFACEHUB_API_TOKEN") # A read/write token for your org
+API = HfApi(token=TOKEN)
+LEADERBOARD_RESULTS_REPO = "cot-leaderboard/cot-leaderboard-results"
+RESULTS_REPO = "cot-leaderboard/cot-eval-results"
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=str, default="logiqa,logiqa2,lsat-ar,lsat-rc,lsat-lr")
+    parser.add_argument("--tmp_dir", type=str, default="./TMP")
+    parser.add_argument("--output_dir", type=str, default=None, help="Local dir to write leaderboard records to")
+    parser.add_argument("--results_repo", type=str, default=RESULTS_REPO)
+    parser.add_argument("--leaderboard_results_repo", type=str, default=LEADERBOARD_RESULTS_REPO)
+    parser.add_argument("--upload", action="store_true", help="Whether to upload rebuilt records")
+    parser.add_argument("--create_pr", type=bool, default=False, help="Whether to create pull requests when uploading")
+    return parser.parse_args()
+
+
+@entry_point("rebuild_leaderboard")
+def main():
+
+    args = parse_eval_args()
+    tasks = args.tasks.split(",")
+
+    cache_dir_results = os.path.join(args.tmp_dir, "cot-eval-results")
+    warehouse_path = os.path.join(args.tmp_dir, "results_warehouse.parquet")
+
+    snapshot_download(
+        repo_id=args.results_repo,
+        revision="main",
+        local_dir=cache_dir_results,
+        repo_type="dataset",
+        allow_patterns=["data/**/results*.json"],
+        etag_timeout=300,
+        max_workers=60,
+        token=TOKEN
+    )
+
+    warehouse = ResultsWarehouse(warehouse_path)
+    n_parsed = warehouse.update(cache_dir_results)
+    warehouse.save()
+    logging.info(f"Parsed {n_parsed} new or changed results files. Warehouse has {warehouse.table.num_rows} rows.")
+
+    records = leaderboard_records(warehouse.to_pandas(), tasks)
+    logging.info(f"Rebuilt leaderboard records for {len(records)} models.")
+
+    if args.output_dir is not None:
+        for model, record in records.items():
+            record_path = os.path.join(args.output_dir, model, "results_leaderboard.json")
+            os.makedirs(os.path.dirname(record_path), exist_ok=True)
+            with open(record_path, "w") as fp:
+                json.dump(record, fp, indent=4)
+        logging.info(f"Wrote leaderboard records to {args.output_dir}")
+
+    if args.upload and records:
+        API.create_commit(
+            repo_id=args.leaderboard_results_repo,
+            operations=[
+                CommitOperationAdd(
+                    path_in_repo=f"{model}/results_leaderboard.json",
+                    path_or_fileobj=json.dumps(record, indent=4).encode("utf-8"),
+                )
+                for model, record in records.items()
+            ],
+            commit_message=f"Rebuild leaderboard records for {len(records)} models",
+            create_pr=args.create_pr,
+            repo_type="dataset",
+        )
+        logging.info(f"Uploaded {len(records)} leaderboard records.")
+
+
+if __name__ == "__main__":
+    main()
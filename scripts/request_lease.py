@@ -0,0 +1,82 @@
+"""keep alive or release the lease on a claimed eval request
+
+The request is identified by the keys file written by
+`scripts/lookup_pending_model.py` (fields `request_file` and `worker_id`).
+
+usage:
+python scripts/request_lease.py heartbeat --keys_file $LOTMP_NEXTMODELINFO --requests_repo $REQUESTS_REPO &
+python scripts/request_lease.py release --status FAILED --keys_file $LOTMP_NEXTMODELINFO --requests_repo $REQUESTS_REPO
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+
+from huggingface_hub import HfApi
+
+from cot_eval.request_leases import LEASE_TTL, LeaseHeartbeat, RequestClaimer
+from cot_eval.requests_queue import EvalRequest, RequestsQueueIndex
+from cot_eval.timeline import entry_point
+
+logging.basicConfig(level=logging.INFO)
+
+TOKEN = os.environ.get("HUGGINGFACEHUB_API_TOKEN") # A read/write token for your org
+if TOKEN is None:
+    raise ValueError("No HF token specified")
+API = HfApi(token=TOKEN)
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=["heartbeat", "release"])
+    parser.add_argument("--keys_file", type=str, required=True)
+    parser.add_argument("--requests_repo", type=str, default="cot-leaderboard/cot-leaderboard-requests")
+    parser.add_argument("--tmp_dir", type=str, default="./TMP")
+    parser.add_argument("--lease_ttl", type=int, default=LEASE_TTL, help="Lease duration in seconds")
+    parser.add_argument("--status", type=str, default="FAILED", help="Final status when releasing")
+    return parser.parse_args()
+
+
+@entry_point("request_lease")
+def main():
+
+    args = parse_eval_args()
+
+    with open(args.keys_file) as fp:
+        next_model = json.load(fp)
+    if "request_file" not in next_model:
+        logging.info("No claimed request in keys file (model pre-selected). Nothing to do.")
+        return
+
+    local_cache_dir = os.path.join(args.tmp_dir, "cot-leaderboard-requests")
+    index = RequestsQueueIndex(args.requests_repo, local_cache_dir, API)
+    index.sync()
+    claimer = RequestClaimer(index, worker_id=next_model["worker_id"], ttl=args.lease_ttl)
+    eval_request = claimer.request(
+        EvalRequest(
+            model=next_model["model"],
+            status="RUNNING",
+            json_filepath=os.path.join(local_cache_dir, next_model["request_file"]),
+        )
+    )
+
+    if args.action == "release":
+        claimer.release(eval_request, args.status)
+        logging.info(f"Released {eval_request.model} with status {args.status}.")
+        return
+
+    heartbeat = LeaseHeartbeat(claimer, eval_request)
+    signal.signal(signal.SIGTERM, lambda *_: heartbeat.stop())
+    heartbeat.start()
+    logging.info(f"Keeping lease on {eval_request.model} alive (every {heartbeat.interval:.0f}s).")
+    while heartbeat.is_alive():
+        heartbeat.join(1)
+    if heartbeat.lost.is_set():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""run trace generation and harness evaluation of a model as a stage graph
+
+usage:
+python scripts/run_pipeline.py \
+    --model $model \
+    --configs $configkeys \  # comma separated list of cot-eval configs
+    --configs_dir $LOTMP_CONFIGSFOLDER \
+    --tasks $TASKS \
+    --timestamp $timestamp \
+    --lm_eval_model_args $lm_eval_model_args \
+    --harness_tasks_dir $LOTMP_ELEU_CONFIGSFOLDER \
+    --harness_keys_file $LOTMP_ELEU_CONFIGSINFO \
+    --output_dir $LOTMP_ELEU_OUTPUTDIR \
+    --traces_repo $TRACES_REPO \
+    --num_gpus $NODE_GPUS \  # GPUs of node
+    --gpus_per_model $NUM_GPUS  # tensor parallel size
+
+Stages and dependencies:
+
+    orig_eval                                     (GPU, if --do_baseeval)
+    harness_tasks                                 (CPU)
+    generate_<config>                             (GPU, per config)
+    base_eval      <- harness_tasks, generate_<first config>
+    cot_eval_<config> <- harness_tasks, generate_<config>
+
+With --model_server, the model is loaded once: a shared inference server
+(see src/cot_eval/model_server.py) holds the model's GPUs for the whole
+pipeline, trace generation requests completions from it and lm-eval scores
+with it (`local-completions`); it is shut down at the end. Its startup
+time and load are recorded in the run timeline (`model_server` span).
+--server_command starts a stand-in server instead of vLLM (e.g.
+scripts/stand_in_model_server.py).
+
+With --screening, the pipeline screens the model on stratified subsets of
+the tasks (see src/cot_eval/screening.py): every round runs harness_tasks,
+generate_<config> and base/cot evaluation (stages suffixed -screen<k>, no
+orig evaluation) on the round's slices, and rounds continue for the tasks
+whose delta CI is neither tight nor clearly without gain. The screening
+summary is written to <output_dir>/<model>/screening/<timestamp>/screening.json.
+
+With --fake_stages, stages sleep instead of running commands (dry run of
+the graph on CPU).
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+
+from cot_eval.bootstrap import collect_correctness
+from cot_eval.model_server import ModelServer, local_completions_model_args, parse_model_args
+from cot_eval.orchestrator import Orchestrator, ResourcePool, Resources, Stage, StageContext, command_stage, fake_stage
+from cot_eval.preprocessing import load_and_preprocess
+from cot_eval.run_manifest import RunManifest
+from cot_eval.screening import (
+    FIRST_ROUND,
+    GROWTH,
+    MAX_HALFWIDTH,
+    MIN_GAIN,
+    SUMMARY_FILE,
+    Screening,
+    round_suffix,
+    screening_dir,
+)
+from cot_eval.timeline import entry_point, span
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(threadName)s - %(levelname)s - %(message)s")
+
+ANSWER_SHUFFLE_SEED = 42  # cot-eval default; screening orders depend on the shuffled gold answers
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument("--configs", type=str, required=True)
+    parser.add_argument("--configs_dir", type=str, required=True)
+    parser.add_argument("--tasks", type=str, required=True)
+    parser.add_argument("--timestamp", type=str, required=True)
+    parser.add_argument("--lm_eval_model_args", type=str, default="")
+    parser.add_argument("--harness_tasks_dir", type=str, required=True)
+    parser.add_argument("--harness_keys_file", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--traces_repo", type=str, default="cot-leaderboard/cot-eval-traces-2.0")
+    parser.add_argument("--hftoken", type=str, default=None)
+    parser.add_argument("--do_baseeval", type=str, default="true")
+    parser.add_argument("--num_gpus", type=int, default=1, help="Number of GPUs of node")
+    parser.add_argument("--gpus_per_model", type=int, default=1, help="GPUs per model instance (tensor parallel size)")
+    parser.add_argument("--memory_gb", type=float, default=None, help="Host memory of node (GB), default: total RAM")
+    parser.add_argument("--memory_per_model_gb", type=float, default=16.0, help="Host memory per model instance (GB)")
+    parser.add_argument("--log_dir", type=str, default=None, help="Dir for stage logs")
+    parser.add_argument("--model_server", action="store_true", help="Run all stages against one shared model server")
+    parser.add_argument("--server_command", type=str, default=None, help="Command of a stand-in model server ({host}, {port}, {model})")
+    parser.add_argument("--screening", action="store_true", help="Screen on stratified subsets, grown in rounds until the delta CI decides")
+    parser.add_argument("--screening_first_round", type=int, default=FIRST_ROUND, help="Examples per task in the first screening round")
+    parser.add_argument("--screening_growth", type=float, default=GROWTH, help="Growth factor of screened examples per round")
+    parser.add_argument("--screening_max_halfwidth", type=float, default=MAX_HALFWIDTH, help="Stop screening a task once its delta CI is this tight")
+    parser.add_argument("--screening_min_gain", type=float, default=MIN_GAIN, help="Stop screening a task once its delta CI lies below")
+    parser.add_argument("--fake_stages", action="store_true", help="Stages sleep instead of running commands")
+    parser.add_argument("--fake_duration", type=float, default=1.0, help="Duration of fake GPU stages (s)")
+    return parser.parse_args()
+
+
+def lm_eval_command(args: argparse.Namespace, tasks: str, output_path: str, server_url: Optional[str] = None) -> list:
+    if server_url:
+        model = ["--model", "local-completions", "--model_args", local_completions_model_args(parse_model_args(args.lm_eval_model_args), server_url)]
+    else:
+        model = ["--model", "vllm", "--model_args", args.lm_eval_model_args]
+    return [
+        "lm-eval", *model,
+        "--tasks", tasks,
+        "--num_fewshot", "0",
+        "--log_samples",
+        "--batch_size", "1" if server_url else "auto",  # requests are batched by the server
+        "--output_path", output_path,
+        "--include_path", args.harness_tasks_dir,
+    ]
+
+
+def harness_tasks(args: argparse.Namespace, subtype: str, config: str = "", keys_file: Optional[str] = None) -> str:
+    """Comma-separated harness tasks of subtype (base, cot), optionally of a single config"""
+    with open(keys_file or args.harness_keys_file) as fp:
+        keys = json.load(fp)[subtype].split(",")
+    return ",".join(k for k in keys if k.startswith(f"{config}_"))
+
+
+def lazy_command_stage(name: str, build_command, deps: list, resources: Resources, log_dir: str) -> Stage:
+    """Command stage whose command is built when the stage starts (e.g., from outputs of earlier stages)"""
+
+    def run(context: StageContext):
+        command_stage(name, build_command(), resources=resources, log_dir=log_dir).run(context)
+
+    return Stage(name=name, run=run, deps=deps, resources=resources)
+
+
+def pipeline_stages(args: argparse.Namespace, server_url: Optional[str] = None, screening_round: Optional[dict] = None) -> List[Stage]:
+    """Stages of the pipeline
+
+    With a `server_url`, model stages are clients of the shared server and
+    hold no GPUs. With a `screening_round` (plan, plan_path, keys_file),
+    the stages of that screening round.
+    """
+    configs = args.configs.split(",")
+    model_resources = Resources() if server_url else Resources(gpus=args.gpus_per_model, memory_gb=args.memory_per_model_gb)
+    out = os.path.join(args.output_dir, args.model)
+    hftoken = ["--hftoken", args.hftoken] if args.hftoken else []
+    server = ["--server_url", server_url] if server_url else []
+    suffix, timestamp, keys_file, screening, harness_screening = "", args.timestamp, args.harness_keys_file, [], []
+    if screening_round is not None:
+        plan = screening_round["plan"]
+        suffix = round_suffix(plan["round"])
+        out = os.path.join(screening_dir(args.output_dir, args.model, args.timestamp), f"round{plan['round']}")
+        timestamp = f"{args.timestamp}{suffix}"
+        keys_file = screening_round["keys_file"]
+        screening = ["--screening_plan", screening_round["plan_path"]]
+        harness_screening = ["--tasks", ",".join(plan["slices"]), "--data_file_suffix", suffix]
+    stages = []
+
+    if args.do_baseeval == "true" and screening_round is None:
+        base_tasks = ",".join(f"{t}_base" for t in args.tasks.split(","))
+        stages.append(command_stage(
+            "orig_eval",
+            lm_eval_command(args, base_tasks, os.path.join(out, "orig", f"results_{args.timestamp}"), server_url),
+            resources=model_resources,
+            log_dir=args.log_dir,
+        ))
+
+    stages.append(command_stage(
+        f"harness_tasks{suffix}",
+        [
+            "python", "scripts/create_lm_eval_harness_tasks.py",
+            "--model", args.model,
+            "--configs", args.configs,
+            "--output_dir", args.harness_tasks_dir,
+            "--configs_dir", args.configs_dir,
+            "--traces_dataset_path", args.traces_repo,
+            "--keys_file", keys_file,
+            *harness_screening,
+        ],
+        log_dir=args.log_dir,
+    ))
+
+    for config in configs:
+        stages.append(command_stage(
+            f"generate_{config}{suffix}",
+            [
+                "cot-eval",
+                "--config", os.path.join(args.configs_dir, f"{config}.yaml"),
+                "--upload_dataset", args.traces_repo,
+                *hftoken,
+                *server,
+                *screening,
+            ],
+            resources=model_resources,
+            log_dir=args.log_dir,
+        ))
+
+    # base harness tasks are created for the first config (see create_lm_eval_harness_tasks.py)
+    stages.append(lazy_command_stage(
+        f"base_eval{suffix}",
+        lambda: lm_eval_command(args, harness_tasks(args, "base", keys_file=keys_file), os.path.join(out, "base", timestamp), server_url),
+        deps=[f"harness_tasks{suffix}", f"generate_{configs[0]}{suffix}"],
+        resources=model_resources,
+        log_dir=args.log_dir,
+    ))
+
+    for config in configs:
+        stages.append(lazy_command_stage(
+            f"cot_eval_{config}{suffix}",
+            lambda config=config: lm_eval_command(
+                args, harness_tasks(args, "cot", config, keys_file=keys_file), os.path.join(out, "cot", f"{timestamp}_{config}"),
+                server_url,
+            ),
+            deps=[f"harness_tasks{suffix}", f"generate_{config}{suffix}"],
+            resources=model_resources,
+            log_dir=args.log_dir,
+        ))
+
+    return stages
+
+
+def timed_stage(stage: Stage, gpu_seconds: list) -> Stage:
+    """Stage that records the GPU seconds it held"""
+
+    def run(context: StageContext):
+        start = time.perf_counter()
+        try:
+            stage.run(context)
+        finally:
+            gpu_seconds.append((time.perf_counter() - start) * len(context.gpu_ids))
+
+    return Stage(name=stage.name, run=run, deps=stage.deps, resources=stage.resources)
+
+
+def run_stages(
+    args: argparse.Namespace,
+    pool: ResourcePool,
+    server_url: Optional[str] = None,
+    screening_round: Optional[dict] = None,
+    gpu_seconds: Optional[list] = None,
+) -> dict:
+    stages = pipeline_stages(args, server_url, screening_round)
+    if args.fake_stages:
+        stages = [fake_stage(s, args.fake_duration if s.resources.gpus or server_url else 0.1) for s in stages]
+    if gpu_seconds is not None:
+        stages = [timed_stage(s, gpu_seconds) for s in stages]
+    return Orchestrator(stages, pool, manifest=RunManifest.from_env()).run()
+
+
+def run_screening(args: argparse.Namespace, pool: ResourcePool, server_url: Optional[str] = None) -> dict:
+    """Screening rounds until every task is decided (see src/cot_eval/screening.py)"""
+    task_sizes = {
+        task: len(load_and_preprocess(task, token=args.hftoken, answer_shuffle_seed=ANSWER_SHUFFLE_SEED))
+        for task in args.tasks.split(",")
+    }
+    directory = screening_dir(args.output_dir, args.model, args.timestamp)
+    screening = Screening.load_or_create(
+        os.path.join(directory, SUMMARY_FILE),
+        task_sizes,
+        first_round=args.screening_first_round,
+        growth=args.screening_growth,
+        max_halfwidth=args.screening_max_halfwidth,
+        min_gain=args.screening_min_gain,
+    )
+    status = {}
+    while not screening.done:
+        plan = screening.next_round()
+        k = plan["round"]
+        os.makedirs(directory, exist_ok=True)
+        plan_path = os.path.join(directory, f"round{k}.json")
+        with open(plan_path, "w") as fp:
+            json.dump(plan, fp)
+        screening_round = {"plan": plan, "plan_path": plan_path, "keys_file": os.path.join(directory, f"round{k}_harness_tasks.json")}
+
+        with span(f"screening_round{k}", slices=plan["slices"]) as record:
+            start = time.perf_counter()
+            gpu_seconds = []
+            status.update(run_stages(args, pool, server_url, screening_round, gpu_seconds))
+            if server_url:  # the server holds the model's GPUs for the whole round
+                round_gpu_seconds = (time.perf_counter() - start) * args.gpus_per_model
+            else:
+                round_gpu_seconds = sum(gpu_seconds)
+            with open(screening_round["keys_file"]) as fp:
+                task_keys = [key for keys in json.load(fp).values() for key in keys.split(",") if key]
+            correctness = collect_correctness(os.path.join(directory, f"round{k}"), task_keys, list(plan["slices"]))
+            screening.update(plan, correctness, round_gpu_seconds)
+            screening.save()
+            record.attrs.update(gpu_hours=round_gpu_seconds / 3600, decisions=dict(screening.decisions))
+
+    summary = screening.summary()
+    logging.info(
+        f"Screening finished after {summary['rounds']} rounds: {summary['examples_screened']} of "
+        f"{summary['examples_total']} examples, {summary['gpu_hours']:.2f} GPU hours "
+        f"(~{summary['gpu_hours_saved']:.2f} saved vs. full evaluation), decisions {screening.decisions}"
+    )
+    return status
+
+
+@entry_point("run_pipeline")
+def main():
+    args = parse_eval_args()
+    memory_gb = args.memory_gb
+    if memory_gb is None:
+        memory_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30
+
+    if args.screening and args.fake_stages:
+        raise ValueError("Screening needs harness sample logs, fake stages write none")
+    run = run_screening if args.screening else run_stages
+
+    pool = ResourcePool(args.num_gpus, memory_gb)
+    start = time.perf_counter()
+    if not args.model_server:
+        status = run(args, pool)
+    else:
+        server_resources = Resources(gpus=args.gpus_per_model, memory_gb=args.memory_per_model_gb)
+        gpu_ids = pool.try_acquire(server_resources)
+        if gpu_ids is None:
+            raise ValueError(f"Node has no resources for the model server: {server_resources}")
+        server = ModelServer.for_model(
+            parse_model_args(args.lm_eval_model_args),
+            server_command=args.server_command,
+            gpu_ids=gpu_ids,
+            log_path=os.path.join(args.log_dir, "model_server.log") if args.log_dir else None,
+        )
+        with span("model_server", model=args.model, gpus=len(gpu_ids)) as record:
+            try:
+                server.start()
+                status = run(args, pool, server.base_url)
+            finally:
+                server.stop()
+                record.attrs.update(server.load_report())
+        logging.info(f"Model server: {server.load_report()}")
+    logging.info(f"Pipeline finished in {time.perf_counter() - start:.1f}s: {status}")
+
+
+if __name__ == "__main__":
+    main()
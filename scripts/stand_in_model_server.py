@@ -0,0 +1,158 @@
+"""stand-in for a model server, implementing the endpoints used by the pipeline
+
+Serves `/health`, `/metrics` (vLLM load metrics), `/v1/models` and
+`/v1/completions` without a model: completions are canned reasoning
+(one token per word) of a length that depends on the prompt, cut at stop
+words and `max_tokens`; a prompt ending in a partial completion is
+continued where it stopped, like a greedy model would. Prompt logprobs
+(`echo` with `logprobs`) are computed over whitespace tokens. Lets the
+shared server mode of the pipeline run on CPU, e.g.
+
+python scripts/run_pipeline.py ... --model_server \
+    --server_command "python scripts/stand_in_model_server.py --port {port} --model {model}"
+
+usage:
+python scripts/stand_in_model_server.py --port 8000 [--model stand-in] [--startup_delay 2]
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO)
+
+COMPLETION = (
+    "Let's think step by step. The passage states the relevant facts. Each option is checked against them in turn, "
+    "and options that contradict a fact are ruled out. Only one option is consistent with all facts, so the answer "
+    "follows from them."
+).split()
+
+
+def parse_eval_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", type=str, default="stand-in")
+    parser.add_argument("--startup_delay", type=float, default=0.0, help="Seconds before the server is healthy")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per completion request")
+    return parser.parse_args()
+
+
+class StandInState:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.ready_at = time.time() + args.startup_delay
+        self.running = 0
+        self.counters = {"vllm:prompt_tokens_total": 0, "vllm:generation_tokens_total": 0, "vllm:request_success_total": 0}
+        self.lock = threading.Lock()
+
+
+def completion_words(prompt: str) -> tuple:
+    """Words of the prompt's completion already in the prompt, and the completion's length"""
+    done = max(k for k in range(len(COMPLETION) + 1) if prompt.endswith("".join(" " + w for w in COMPLETION[:k])))
+    base = prompt[:len(prompt) - len("".join(" " + w for w in COMPLETION[:done]))]
+    return done, 8 + len(base) % (len(COMPLETION) - 8)
+
+
+def complete(prompt: str, body: dict) -> dict:
+    done, length = completion_words(prompt)
+    words = COMPLETION[done:length]
+    finish_reason = "stop"
+    if len(words) > body.get("max_tokens", 16):
+        words, finish_reason = words[:body.get("max_tokens", 16)], "length"
+    text = "".join(" " + w for w in words)
+    for stop in body.get("stop") or []:
+        if stop in text:
+            text, finish_reason = text[:text.index(stop)], "stop"
+    if body.get("echo"):
+        text = prompt + text
+    choice = {"text": text, "finish_reason": finish_reason, "logprobs": None}
+    if body.get("logprobs") is not None:
+        tokens = text.split(" ")
+        offsets = [sum(len(t) + 1 for t in tokens[:i]) for i in range(len(tokens))]
+        choice["logprobs"] = {
+            "tokens": tokens,
+            "token_logprobs": [None] + [-1.0] * (len(tokens) - 1),
+            "top_logprobs": [None] + [{t: -1.0} for t in tokens[1:]],
+            "text_offset": offsets,
+        }
+    return choice
+
+
+def make_handler(state: StandInState):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status: int, payload, content_type: str = "application/json"):
+            data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if time.time() < state.ready_at:
+                return self._send(503, {"error": "loading"})
+            if self.path == "/health":
+                return self._send(200, "", "text/plain")
+            if self.path == "/v1/models":
+                return self._send(200, {"object": "list", "data": [{"id": state.args.model, "object": "model"}]})
+            if self.path == "/metrics":
+                with state.lock:
+                    lines = [
+                        f'vllm:num_requests_running{{model_name="{state.args.model}"}} {state.running}',
+                        f'vllm:num_requests_waiting{{model_name="{state.args.model}"}} 0',
+                        f'vllm:gpu_cache_usage_perc{{model_name="{state.args.model}"}} {min(state.running / 16, 1.0)}',
+                    ] + [f'{k}{{model_name="{state.args.model}"}} {v}' for k, v in state.counters.items()]
+                return self._send(200, "\n".join(lines) + "\n", "text/plain")
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/v1/completions":
+                return self._send(404, {"error": "not found"})
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+            n = body.get("n", 1)
+            with state.lock:
+                state.running += len(prompts)
+            time.sleep(state.args.latency)
+            choices = [
+                {"index": i * n + j, **complete(prompt, body)} for i, prompt in enumerate(prompts) for j in range(n)
+            ]
+            prompt_tokens = sum(len(p.split()) for p in prompts)
+            completion_tokens = sum(len(c["text"].split()) for c in choices)
+            with state.lock:
+                state.running -= len(prompts)
+                state.counters["vllm:prompt_tokens_total"] += prompt_tokens
+                state.counters["vllm:generation_tokens_total"] += completion_tokens
+                state.counters["vllm:request_success_total"] += len(prompts)
+            self._send(200, {
+                "id": f"cmpl-{time.time_ns()}",
+                "object": "text_completion",
+                "model": state.args.model,
+                "choices": choices,
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+            })
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return Handler
+
+
+def main():
+    args = parse_eval_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StandInState(args)))
+    logging.info(f"Stand-in model server for {args.model} at http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
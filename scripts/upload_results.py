@@ -6,10 +6,19 @@ python scripts/upload_results.py \
     --revision $revision \
     --tasks $TASKS \
     --timestamp $timestamp \
-    --output_dir $OUTPUT_DIR
-
+    --output_dir $OUTPUT_DIR \
+    [--screening_file $OUTPUT_DIR/$model/screening/$timestamp/screening.json]
+
+With --screening_file (run_pipeline.py --screening), the leaderboard record
+is built from the screening summary (pooled base and cot accuracies of all
+screening rounds) and flagged with its metadata (examples screened,
+decisions, GPU hours spent and saved); the summary is uploaded with the
+raw results. Harness results of screening rounds (subsets of the tasks)
+are not uploaded, so that they do not mix with full evaluations in the
+results warehouse.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
@@ -17,14 +26,19 @@ import glob
 import json
 import os
 import shutil
-from dataclasses import dataclass
-import tempfile
+import time
 
 import argparse
-from huggingface_hub import HfApi, snapshot_download
+from huggingface_hub import HfApi, CommitOperationAdd, snapshot_download
 
 import logging
 
+from cot_eval.bootstrap import bootstrap_cis, collect_correctness
+from cot_eval.requests_queue import EvalRequest, RequestsQueueIndex
+from cot_eval.results_warehouse import ResultsWarehouse, leaderboard_records
+from cot_eval.screening import SCREENING_DIR, screening_record
+from cot_eval.timeline import RUN_ID_ENV, entry_point, read_timeline
+
 logging.basicConfig(level=logging.INFO)
 
 TOKEN = os.environ.get("HUGGINGFACEHUB_API_TOKEN") # A read/write token for your org
@@ -32,35 +46,7 @@ API = HfApi(token=TOKEN)
 REQUESTS_REPO = "cot-leaderboard/cot-leaderboard-requests"
 LEADERBOARD_RESULTS_REPO = "cot-leaderboard/cot-leaderboard-results"
 RESULTS_REPO = "cot-leaderboard/cot-eval-results"
-
-
-@dataclass
-class EvalRequest:
-    model: str
-    status: str
-    json_filepath: str
-    private: bool = False
-    weight_type: str = "Original"
-    model_type: str = ""  # pretrained, finetuned, with RL
-    precision: str = ""  # float16, bfloat16
-    base_model: Optional[str] = None # for adapter models
-    revision: str = "main" # commit
-    submitted_time: Optional[str] = "2022-05-18T11:40:22.519222"  # random date just so that we can still order requests by date
-    model_type: Optional[str] = None
-    likes: Optional[int] = 0
-    params: Optional[int] = None
-    license: Optional[str] = ""
-    
-    def get_model_args(self):
-        model_args = f"pretrained={self.model},revision={self.revision}"
-
-        if self.precision in ["float16", "bfloat16", "float32"]:
-            model_args += f",dtype={self.precision}"
-            pass
-        else:
-            raise Exception(f"Unknown precision {self.precision}.")
-        
-        return model_args
+MAX_WORKERS_METADATA = 4
 
 
 def parse_eval_args() -> argparse.Namespace:
@@ -76,57 +62,59 @@ def parse_eval_args() -> argparse.Namespace:
     parser.add_argument("--results_repo", type=str, default=RESULTS_REPO)
     parser.add_argument("--leaderboard_results_repo", type=str, default=LEADERBOARD_RESULTS_REPO)
     parser.add_argument("--create_pr", type=bool, default=False, help="Whether to create pull requests when uploading")
+    parser.add_argument("--timeline_file", type=str, default=None, help="Run timeline to upload with the results")
+    parser.add_argument("--screening_file", type=str, default=None, help="Screening summary (leaderboard record from screening rounds)")
+    parser.add_argument("--n_resamples", type=int, default=1000, help="Number of bootstrap resamples for confidence intervals")
     return parser.parse_args()
 
 
-def set_eval_request(eval_request: EvalRequest, set_to_status: str, hf_repo: str, local_dir: str, create_pr: bool = False):
-    """Updates a given eval request with its new status on the hub (running, completed, failed, ...)"""
+def eval_request_operation(eval_request: EvalRequest, set_to_status: str, local_dir: str) -> CommitOperationAdd:
+    """Updates a given eval request locally and returns the commit operation that pushes the new status"""
     json_filepath = eval_request.json_filepath
 
     with open(json_filepath) as fp:
         data = json.load(fp)
 
     data["status"] = set_to_status
+    if set_to_status != "RUNNING":
+        data.pop("lease", None)
 
     with open(json_filepath, "w") as f:
         f.write(json.dumps(data, indent=4))
 
-    API.upload_file(
+    return CommitOperationAdd(
+        path_in_repo=json_filepath.replace(local_dir, "").lstrip("/"),
         path_or_fileobj=json_filepath,
-        path_in_repo=json_filepath.replace(local_dir, ""),
+    )
+
+
+def set_eval_request(eval_request: EvalRequest, set_to_status: str, hf_repo: str, local_dir: str, create_pr: bool = False):
+    """Updates a given eval request with its new status on the hub (running, completed, failed, ...)"""
+    API.create_commit(
         repo_id=hf_repo,
+        operations=[eval_request_operation(eval_request, set_to_status, local_dir)],
         commit_message=f"Update status to {set_to_status}",
         create_pr=create_pr,
         repo_type="dataset",
     )
 
 
-def get_eval_requests(job_status: list, local_dir: str, hf_repo: str) -> list[EvalRequest]:
-    """Get all pending evaluation requests and return a list in which private
-    models appearing first, followed by public models sorted by the number of
-    likes.
+def get_eval_requests(job_status: list, local_dir: str, hf_repo: str, max_params: Optional[float] = None) -> list[EvalRequest]:
+    """Get all evaluation requests with given status, sorted by submission time.
+
+    Uses a persistent local index of the requests repo, which is synced
+    incrementally (only request files changed since the last sync are
+    downloaded).
+
     Returns:
         `list[EvalRequest]`: a list of model info dicts.
     """
-    snapshot_download(
-        repo_id=hf_repo,
-        revision="main",
-        local_dir=local_dir,
-        repo_type="dataset",
-        etag_timeout=300,        
-        max_workers=60,
-        token=TOKEN,
-    )
-    json_files = glob.glob(f"{local_dir}/**/*.json", recursive=True)
-
-    eval_requests = []
-    for json_filepath in json_files:
-        with open(json_filepath) as fp:
-            data = json.load(fp)
-        if data["status"] in job_status:
-            data["json_filepath"] = json_filepath
-            eval_request = EvalRequest(**data)
-            eval_requests.append(eval_request)
+    start = time.perf_counter()
+    index = RequestsQueueIndex(hf_repo, local_dir, API)
+    warm = index.sha is not None
+    index.sync()
+    eval_requests = index.get_eval_requests(job_status, max_params=max_params)
+    logging.info(f"Looked up requests queue ({'warm' if warm else 'cold'} start) in {time.perf_counter() - start:.2f}s")
 
     return eval_requests
 
@@ -136,69 +124,30 @@ def get_leaderboard_record(
         revision: str,
         tasks: list,
         precision: str,
-        local_dir_results_dataset: str
+        local_dir_results_dataset: str,
+        warehouse_path: Optional[str] = None,
     ) -> dict:
     """aggregate raw results"""
 
-    raw_results = {"base": [], "cot": []}
-    for subfolder in raw_results.keys():
-        result_files = glob.glob(f"{local_dir_results_dataset}/data/{model}/{subfolder}/**/results*.json", recursive=True)
-        for json_filepath in result_files:
-            with open(json_filepath) as fp:
-                data = json.load(fp)
-            if "results" in data.keys():
-                raw_results[subfolder].extend([(k,v) for k,v in data["results"].items()])
-
-    deltas = {k: [] for k in tasks}
-    rates = {k: [] for k in tasks}
-    for key_cot, record_cot in raw_results["cot"]:
-
-        current_task = next(t for t in tasks if t in key_cot.split("_"))
-
-        # find corresponding base record
-        # N.B.: corresp. base record need not agree with current_task-id 
-        # (see `scripts/create_lm_eval_harness_tasks.py`, lines 57ff)
-        record_base = next(iter(
-            r for k,r in raw_results["base"]
-            if k.endswith(f"_{current_task}_base")
-            ), None)
-        if record_base is None:
-            logging.warning(f"Could not find corresponding base record for {key_cot}. Skipping this cot eval record.")
-            continue
-
-        if "acc" in record_base:
-            acc_base = record_base["acc"]
-        elif "acc,none" in record_base:
-            acc_base = record_base["acc,none"]
-        else:
-            logging.warning(f"Could not find acc for base record {record_base}.")
-            continue
-        if "acc" in record_cot:
-            acc_cot = record_cot["acc"]
-        elif "acc,none" in record_cot:
-            acc_cot = record_cot["acc,none"]
-        else:
-            logging.warning(f"Could not find acc for cot record {record_cot}.")
-            continue
-
-        deltas[current_task].append((acc_cot - acc_base))
-        rates[current_task].append((acc_cot - acc_base)/acc_base)
-
-    leaderboard_record = {
-        "config": {
-            "model_dtype": precision,
-            "model_sha": revision,
-            "model_name": model,
-        },
-        "results": {
-            task: {"delta_abs": max(deltas[task]), "delta_rel": max(rates[task])}
-            for task in tasks
-        },
-    }
+    warehouse = ResultsWarehouse(warehouse_path)
+    warehouse.update(local_dir_results_dataset)
+    if warehouse_path is not None:
+        warehouse.save()
+
+    results = warehouse.to_pandas()
+    records = leaderboard_records(
+        results[results["model"] == model],
+        tasks,
+        precision={model: precision},
+        revision={model: revision},
+    )
+    if model not in records:
+        raise ValueError(f"Could not aggregate leaderboard record for model {model}.")
 
-    return leaderboard_record
+    return records[model]
 
 
+@entry_point("upload_results")
 def main():
 
     args = parse_eval_args()
@@ -215,6 +164,7 @@ def main():
 
     cache_dir_requests = os.path.join(args.tmp_dir, "cot-leaderboard-requests")
     cache_dir_results = os.path.join(args.tmp_dir, "cot-eval-results")
+    warehouse_path = os.path.join(args.tmp_dir, "results_warehouse.parquet")
 
 
     tasks = args.tasks.split(",")
@@ -222,69 +172,137 @@ def main():
         raise ValueError("No tasks specified")
     logging.info(f"Tasks: {tasks}")
 
-    snapshot_download(
-        repo_id=args.results_repo,
-        revision="main",
-        local_dir=cache_dir_results,
-        repo_type="dataset",
-        etag_timeout=300,
-        max_workers=60,
-        token=TOKEN
-    )
+    # independent metadata calls: results snapshot (needed for aggregation),
+    # one listing of the results repo tree, and the running eval requests
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS_METADATA) as executor:
+        future_snapshot = executor.submit(
+            snapshot_download,
+            repo_id=args.results_repo,
+            revision="main",
+            local_dir=cache_dir_results,
+            repo_type="dataset",
+            etag_timeout=300,
+            max_workers=60,
+            token=TOKEN
+        )
+        future_remote_files = executor.submit(
+            API.list_repo_files,
+            repo_id=args.results_repo,
+            revision="main",
+            repo_type="dataset",
+        )
+        future_eval_requests = executor.submit(
+            get_eval_requests, "RUNNING", cache_dir_requests, args.requests_repo
+        )
+        future_snapshot.result()
+        remote_files = set(future_remote_files.result())
+        eval_requests = future_eval_requests.result()
 
-    # copy/upload all new results for this model to raw results repo
+    # diff local results against the results repo tree
     result_files = glob.glob(f"{args.output_dir}/{args.model}/**/results*.json", recursive=True)
+    result_files = [f for f in result_files if f"/{SCREENING_DIR}/" not in f]
     logging.info(f"Found {len(result_files)} result files for model {args.model}: {result_files}")
-    log_first_results = Path(result_files[0]).read_text()
-    logging.info(f"Content if first result file:\n{log_first_results}")
+    if result_files:
+        log_first_results = Path(result_files[0]).read_text()
+        logging.info(f"Content if first result file:\n{log_first_results}")
 
+    upload_operations = []
     for json_filepath in result_files:
         path_in_repo = json_filepath.replace(f"{args.output_dir}", "data")
-        if not API.file_exists(
+        if path_in_repo in remote_files:
+            continue
+        # copy file to local dir
+        dest_fpath=f"{cache_dir_results}/{path_in_repo}"
+        os.makedirs(os.path.dirname(dest_fpath), exist_ok=True)
+        shutil.copy(json_filepath, dest_fpath)
+        upload_operations.append(
+            CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=json_filepath)
+        )
+
+    # add the timeline of this run (spans of earlier runs with the same cache dir are dropped)
+    if args.timeline_file is not None:
+        spans = read_timeline(args.timeline_file, run_id=os.environ.get(RUN_ID_ENV))
+        if spans:
+            upload_operations.append(
+                CommitOperationAdd(
+                    path_in_repo=f"data/{args.model}/timelines/timeline_{args.timestamp}.jsonl",
+                    path_or_fileobj="".join(json.dumps(s) + "\n" for s in spans).encode("utf-8"),
+                )
+            )
+            logging.info(f"Adding run timeline with {len(spans)} spans.")
+
+    screening_summary = None
+    if args.screening_file is not None:
+        with open(args.screening_file) as fp:
+            screening_summary = json.load(fp)["summary"]
+        upload_operations.append(
+            CommitOperationAdd(
+                path_in_repo=f"data/{args.model}/{SCREENING_DIR}/screening_{args.timestamp}.json",
+                path_or_fileobj=args.screening_file,
+            )
+        )
+        logging.info(
+            f"Adding screening summary: {screening_summary['examples_screened']} of {screening_summary['examples_total']} "
+            f"examples, {screening_summary['gpu_hours_saved']:.2f} GPU hours saved."
+        )
+
+    # upload all new results for this model to raw results repo in a single commit
+    if upload_operations:
+        API.create_commit(
             repo_id=args.results_repo,
-            filename=path_in_repo,
+            operations=upload_operations,
+            commit_message=f"Upload results for model {args.model}",
+            create_pr=args.create_pr,
             repo_type="dataset",
-        ):
-            # copy file to local dir
-            dest_fpath=f"{cache_dir_results}/{path_in_repo}"
-            os.makedirs(os.path.dirname(dest_fpath), exist_ok=True)
-            shutil.copy(json_filepath, dest_fpath)
-            # upload file to hub
-            API.upload_file(
-                path_or_fileobj=json_filepath,
-                path_in_repo=path_in_repo,
-                repo_id=args.results_repo,
-                commit_message=f"Upload results for model {args.model}",
-                create_pr=args.create_pr,
-                repo_type="dataset",
-            )
+        )
+        logging.info(f"Uploaded {len(upload_operations)} new result files for model {args.model}.")
+    else:
+        logging.info(f"No new result files for model {args.model}.")
+
+    if screening_summary is not None:
+        leaderboard_record = screening_record(screening_summary, args.model, args.revision, args.precision, tasks)
+    else:
+        leaderboard_record = get_leaderboard_record(args.model, args.revision, tasks, args.precision, cache_dir_results, warehouse_path)
 
+        # add paired bootstrap CIs from per-sample correctness (harness runs with --log_samples)
+        task_keys = []
+        for json_filepath in result_files:
+            with open(json_filepath) as fp:
+                task_keys.extend(json.load(fp).get("results", {}).keys())
+        correctness = collect_correctness(f"{args.output_dir}/{args.model}", task_keys, tasks)
+        for task, cis in bootstrap_cis(correctness, n_resamples=args.n_resamples).items():
+            leaderboard_record["results"][task].update(cis)
+    this_eval_request = next((e for e in eval_requests if e.model == args.model), None)
 
-    # update leaderboard
-    leaderboard_record = get_leaderboard_record(args.model, args.revision, tasks, args.precision, cache_dir_results)
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".json") as fp:
-        json.dump(leaderboard_record, fp, indent=4)
-        fp.flush()
-        API.upload_file(
-            path_or_fileobj=fp.name,
-            path_in_repo=f"{args.model}/results_leaderboard.json",
+    # leaderboard record and request status live in different repos: commit both concurrently
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS_METADATA) as executor:
+        future_leaderboard = executor.submit(
+            API.create_commit,
             repo_id=args.leaderboard_results_repo,
+            operations=[
+                CommitOperationAdd(
+                    path_in_repo=f"{args.model}/results_leaderboard.json",
+                    path_or_fileobj=json.dumps(leaderboard_record, indent=4).encode("utf-8"),
+                )
+            ],
             commit_message=f"Update leaderboard for model {args.model}",
             create_pr=args.create_pr,
             repo_type="dataset",
         )
-        logging.info(f"Uploaded leaderboard record for model {args.model}: {leaderboard_record}")
-
+        future_status = None
+        if this_eval_request is not None:
+            # set status to finished
+            future_status = executor.submit(
+                set_eval_request, this_eval_request, "FINISHED", args.requests_repo, cache_dir_requests, args.create_pr
+            )
 
-    # update eval request status to FINISHED
-    eval_requests = get_eval_requests("RUNNING", cache_dir_requests, args.requests_repo)
-    this_eval_request = next((e for e in eval_requests if e.model == args.model), None)
-    if this_eval_request is not None:
-        # set status to finished
-        set_eval_request(this_eval_request, "FINISHED", args.requests_repo, cache_dir_requests, args.create_pr)
-        logging.info(f"Updated status of eval request for model {args.model} to FINISHED.")
-    else:
-        logging.warning(f"No running evaluation requests found for model {args.model}.")
+        future_leaderboard.result()
+        logging.info(f"Uploaded leaderboard record for model {args.model}: {leaderboard_record}")
+        if future_status is not None:
+            future_status.result()
+            logging.info(f"Updated status of eval request for model {args.model} to FINISHED.")
+        else:
+            logging.warning(f"No running evaluation requests found for model {args.model}.")
 
 
 if __name__ == "__main__":
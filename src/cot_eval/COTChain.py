@@ -8,11 +8,40 @@ from langchain_community.llms import VLLM
 class COTChain(abc.ABC):
     """Abstract Base Class for COT chain builders based on langchain"""
 
+    prompt_template: str
+    """Prompt template with `passage` and `question_options` placeholders"""
+
+    final_answer_instruction = (
+        "Conclude your reasoning by stating the label of the correct option "
+        "in the format \"Final answer: <label>\" (e.g., \"Final answer: B\")."
+    )
+    """Instruction inserted before the assistant turn in final answer mode"""
+
+    @classmethod
+    def get_prompt_template(cls, final_answer: bool = False) -> str:
+        """Prompt template, optionally instructing the model to state a final answer label
+
+        Args:
+            final_answer (bool): Whether to add the final answer instruction
+
+        Returns:
+            str: Prompt template
+        """
+        if not final_answer:
+            return cls.prompt_template
+        return cls.prompt_template.replace(
+            "\n\n### Assistant", f"\n\n{cls.final_answer_instruction}\n\n### Assistant", 1
+        )
+
     @classmethod
     @abc.abstractmethod
-    def build(cls, llm: VLLM) -> Runnable:
+    def build(cls, llm: VLLM, final_answer: bool = False) -> Runnable:
         """Build chain
 
+        Args:
+            llm (VLLM): Language model
+            final_answer (bool): Whether to instruct the model to state a final answer label
+
         Returns:
             Runnable: Chain
         """
@@ -1,6 +1,6 @@
 """Config Class for COT evaluations"""
 
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel
 import yaml
@@ -20,6 +20,10 @@ class COTEvalConfig(BaseModel):
     """model kwargs to passed to model init function"""
     tasks: list
     """Tasks to evaluate on"""
+    final_answer: Optional[bool] = False
+    """Whether to instruct the model to conclude with a final answer label (generative accuracy)"""
+    backend: Literal["vllm", "transformers"] = "vllm"
+    """LLM backend: vllm (GPU) or transformers (CPU, small models and local testing)"""
 
     @classmethod
     def from_yaml(cls, path: str) -> "COTEvalConfig":
@@ -1,19 +1,36 @@
+import importlib
+import json
 import os
-import random
+import sys
 import logging
 import argparse
 import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
 
 import huggingface_hub
-import pandas as pd
-from datasets import load_dataset, disable_caching, Dataset
+from datasets import disable_caching, Dataset, Value
+from langchain_core.language_models.llms import BaseLLM
 from langchain_core.runnables import Runnable
 from langchain_community.llms import VLLM
 
 from cot_eval.COTEvalConfig import COTEvalConfig
+from cot_eval.answer_extraction import accuracy, add_parsed_answers
 from cot_eval.chain_registry import CHAIN_REGISTRY
+from cot_eval.generation_budgets import BUDGETS_ENV, TwoTierLLM, load_budgets
+from cot_eval.model_server import SERVER_ENV, ServerLLM, vllm_supports_prefix_caching
+from cot_eval.preprocessing import (
+    load_and_preprocess,
+    load_and_preprocess_permutations,
+    prefill_reuse,
+    split_permutations,
+)
+from cot_eval.run_manifest import RunManifest
+from cot_eval.screening import round_suffix, select_screening_slice
 from cot_eval.tasks_registry import TASKS_REGISTRY
+from cot_eval.timeline import Span, entry_point, span
+from cot_eval.traces_io import write_traces
 
 # Setup logging
 logging.basicConfig(
@@ -24,7 +41,25 @@ logging.basicConfig(
 disable_caching()
 
 
+# `cot-eval <subcommand> ...` dispatches to the main function of these modules
+SUBCOMMANDS = {
+    "stats": "cot_eval.trace_stats",
+    "accuracy": "cot_eval.answer_extraction",
+    "mirror": "cot_eval.tasks_mirror",
+    "preflight": "cot_eval.preflight",
+    "manifest": "cot_eval.run_manifest",
+    "worker": "cot_eval.worker",
+    "prefetch": "cot_eval.weight_prefetch",
+    "cache": "cot_eval.cache_manager",
+    "serve": "cot_eval.model_server",
+    "budgets": "cot_eval.generation_budgets",
+}
+
 MAX_RETRIALS_PUSH_TO_HUB = 5
+MAX_WORKERS_PREPROCESSING = 8
+MAP_BATCH_SIZE = 2048
+MAX_ATTEMPTS_EXAMPLE = 2
+ERROR_COLUMN = "reasoning_error"
 RETRIALS_INTERVAL = 30
 
 COT_CONFIG_KEYS = [
@@ -44,6 +79,8 @@ COT_CONFIG_KEYS = [
     "max_model_len",
     "revision",
     "swap_space",
+    "final_answer",
+    "backend",
 ]
 
 
@@ -54,44 +91,66 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--create_pr", type=bool, default=False, help="Whether to create pull requests when uploading")
     parser.add_argument("--hftoken", default=None, help="HF Token to use for upload")
     parser.add_argument("--answer_shuffle_seed", type=int, default=42, help="Seed for random shuffling of answers")
+    parser.add_argument(
+        "--answer_shuffle_seeds", default=None,
+        help="Comma-separated seeds: generate traces for several answer permutations in one pass (robustness mode)",
+    )
+    parser.add_argument(
+        "--server_url", default=os.environ.get(SERVER_ENV),
+        help=f"Generate with a running model server (see model_server.py) instead of loading the model (default: ${SERVER_ENV})",
+    )
+    parser.add_argument(
+        "--generation_budgets", default=None,
+        help=f"Per-task first-tier budgets (json, see generation_budgets.py) for two-tier generation (default: ${BUDGETS_ENV})",
+    )
+    parser.add_argument(
+        "--screening_plan", default=None,
+        help="Screening round plan (json, see screening.py): generate traces for the planned slices of tasks only",
+    )
     return parser.parse_args()
 
 
-def load_and_preprocess(task: str, token: str, answer_shuffle_seed: int) -> Dataset:
-    """Load and preprocess the task dataset"""
-    ds = load_dataset(**TASKS_REGISTRY[task], token=token)
-    logging.info(f"Loaded {task} dataset with {len(ds)} examples")
-
-    def permutate_options(example):
-        """Permutate the options in the example"""
-        gold_option = example["options"][example["answer"]]
-        options = example["options"]
-        random.Random(answer_shuffle_seed).shuffle(options)
-        example["options"] = options
-        example["labels"] = ["ABCDEF"[i] for i in range(len(options))]
-        example["answer"] = options.index(gold_option)
-        return example
-
-    def format_mcq(example):
-        """Format the question and options"""
-        question = example["question"]
-        options_block = "\n".join([
-            f"{label}) {option}" 
-            for label, option
-            in zip(example["labels"], example["options"])
-        ])
-        example["question_options"] = f"{question}\n{options_block}"
-        return example
-
-    ds = ds.map(permutate_options, load_from_cache_file=False)
-    logging.info(f"Permutated options for {task} dataset")
-    ds = ds.map(format_mcq, load_from_cache_file=False)
-    logging.info(f"Formatted MC-Question-Block for {task} dataset")
-    return ds
-
-
-def run_chain_on_task(task_ds: Dataset, chain: Runnable) -> Dataset:
-    """Run the COT chain on the task dataset"""
+def batch_isolating_failures(chain: Runnable, inputs: list, stats: dict, attempts: int = MAX_ATTEMPTS_EXAMPLE) -> tuple:
+    """Run the chain on a batch, bisecting failing batches down to single examples
+
+    A single failing input (e.g., over-length prompt) fails the whole batch
+    call. Failing batches are split in halves and retried, so that only the
+    failing examples are lost; single examples are retried `attempts` times
+    (transient errors such as backend timeouts).
+
+    Returns:
+        tuple: reasoning traces ("" for failed examples) and errors (None for successful examples)
+    """
+    try:
+        return chain.batch(inputs), [None] * len(inputs)
+    except Exception as e:
+        stats["discarded"] += len(inputs)
+        if len(inputs) > 1:
+            mid = len(inputs) // 2
+            traces_left, errors_left = batch_isolating_failures(chain, inputs[:mid], stats)
+            traces_right, errors_right = batch_isolating_failures(chain, inputs[mid:], stats)
+            return traces_left + traces_right, errors_left + errors_right
+        if attempts > 1:
+            return batch_isolating_failures(chain, inputs, stats, attempts - 1)
+        logging.warning(f"COT chain failed on example: {e}")
+        stats["failed"] += 1
+        return [""], [f"{type(e).__name__}: {e}"]
+
+
+def run_chain_on_task(task_ds: Dataset, chain: Runnable, stats: Optional[dict] = None) -> Dataset:
+    """Run the COT chain on the task dataset
+
+    Examples the chain fails on get an empty reasoning trace and the error in
+    column `reasoning_error` (None otherwise), instead of failing the task;
+    the cot harness tasks score them as wrong (`process_results_cot` in
+    eleuther/tasks/logikon/utils_logikon.py).
+    `stats` is updated with the number of examples (`rows`), failed examples
+    (`failed`) and generations discarded because their batch failed
+    (`discarded`).
+    """
+    if stats is None:
+        stats = {}
+    stats.update(rows=len(task_ds), failed=0, discarded=0)
 
     def add_reasoning(examples):
         input_batch = [
@@ -99,12 +158,274 @@ def run_chain_on_task(task_ds: Dataset, chain: Runnable) -> Dataset:
             for passage, question_options
             in zip(examples["passage"], examples["question_options"])
         ]
-        reasoning_traces = chain.batch(input_batch)
-        return {"reasoning_trace": reasoning_traces}
+        reasoning_traces, errors = batch_isolating_failures(chain, input_batch, stats)
+        return {"reasoning_trace": reasoning_traces, ERROR_COLUMN: errors}
 
-    task_ds = task_ds.map(add_reasoning, batched=True, batch_size=2048, load_from_cache_file=False)
+    features = task_ds.features.copy()
+    features["reasoning_trace"] = Value("string")
+    features[ERROR_COLUMN] = Value("string")
+    task_ds = task_ds.map(add_reasoning, batched=True, batch_size=MAP_BATCH_SIZE, features=features, load_from_cache_file=False)
     return task_ds
 
+
+def log_failure_report(task: str, stats: dict):
+    """Compare work lost to failures with failing the whole task on the first error"""
+    if not stats["discarded"]:
+        return
+    logging.warning(
+        f"COT chain failures on {task}: {stats['failed']} of {stats['rows']} examples failed, "
+        f"{stats['discarded']} generations discarded in failed batch calls; "
+        f"without failure isolation, all {stats['rows']} examples of the task would have been lost"
+    )
+
+
+def log_budget_report(task: str, first_tier: int, max_new_tokens: int, stats: dict):
+    """Compare two-tier generation with generating every trace at the full budget"""
+    if not stats.get("sequences"):
+        return
+    reserved = stats["sequences"] * max_new_tokens
+    logging.info(
+        f"Two-tier budgets on {task}: {stats['continued']} of {stats['sequences']} traces continued beyond "
+        f"{first_tier} of {max_new_tokens} tokens; {stats['reserved_tokens_saved']} of {reserved} reserved tokens "
+        f"({stats['reserved_tokens_saved'] / reserved:.0%}) saved; tiers took {stats['first_tier_s']:.1f}s + {stats['second_tier_s']:.1f}s"
+    )
+
+
+def log_timing_breakdown(timings: Dict[str, Tuple[float, float]]):
+    """Log start/end of stages and the time saved by overlapping data loading with model loading"""
+    for stage, (start, end) in sorted(timings.items(), key=lambda x: x[1]):
+        logging.info(f"Timing {stage:<24} {start:8.1f}s -> {end:8.1f}s ({end - start:8.1f}s)")
+    loading = [v for k, v in timings.items() if k.startswith("load_")]
+    if loading:
+        sequential = sum(end - start for start, end in loading)
+        overlapped = max(end for _, end in loading) - min(start for start, _ in loading)
+        logging.info(
+            f"Timing data and model loading: {overlapped:.1f}s overlapped vs. {sequential:.1f}s sequential "
+            f"({sequential - overlapped:.1f}s saved)"
+        )
+
+
+def llm_token_counter(llm: BaseLLM) -> Callable[[List[str]], List[int]]:
+    """Token counts with the tokenizer of the loaded model (whitespace tokens if unavailable)"""
+    tokenizer = getattr(llm, "tokenizer", None)  # transformers backend
+    client = getattr(llm, "client", None)
+    if tokenizer is None and hasattr(client, "get_tokenizer"):
+        tokenizer = client.get_tokenizer()  # vllm
+    if tokenizer is None:
+        return lambda texts: [len(t.split()) for t in texts]
+    return lambda texts: [len(ids) for ids in tokenizer(list(texts))["input_ids"]]
+
+
+def load_llm(config: COTEvalConfig, server_url: Optional[str] = None) -> BaseLLM:
+    """Language model of the config's backend, or client of a running model server"""
+    if server_url:
+        return ServerLLM.from_modelkwargs(server_url, config.model, **(config.modelkwargs or {}))
+    if config.backend == "transformers":
+        from cot_eval.transformers_backend import TransformersCPU
+
+        return TransformersCPU.from_modelkwargs(config.model, **(config.modelkwargs or {}))
+    return VLLM(
+        model=config.model,
+        **config.modelkwargs,
+    )
+
+
+def generate_traces(
+    config: COTEvalConfig,
+    tasks: List[str],
+    hftoken: str,
+    answer_shuffle_seed: int,
+    llm: Optional[BaseLLM] = None,
+    task_data: Optional[Dict[str, Dataset]] = None,
+    answer_shuffle_seeds: Optional[List[int]] = None,
+    server_url: Optional[str] = None,
+    screening_plan: Optional[dict] = None,
+    generation_budgets: Optional[dict] = None,
+) -> Dict[str, Dataset]:
+    """Generate reasoning traces for tasks
+
+    Task data is loaded and preprocessed while the model is loading. A
+    loaded engine (`llm`) and preprocessed task data (`task_data`, which is
+    updated with newly loaded tasks) can be passed to reuse them across
+    configs and models.
+
+    With several `answer_shuffle_seeds` (robustness mode), every example is
+    expanded into one row per answer permutation, and all permutations are
+    generated in one pass with prefix caching (vLLM backend, if the installed
+    vLLM supports it).
+
+    With a `server_url`, the model is not loaded: completions are requested
+    from the (shared) model server at that url.
+
+    With a `screening_plan`, traces are generated for the round's slice of
+    the stratified order of each task only (see screening.py).
+
+    With `generation_budgets` (per task, see generation_budgets.py), traces
+    are generated with the task's first-tier budget, and only truncated
+    traces are continued up to `max_new_tokens`.
+    """
+    if task_data is None:
+        task_data = {}
+    robustness_mode = answer_shuffle_seeds is not None and len(answer_shuffle_seeds) > 1
+    if robustness_mode and llm is None and server_url is None and config.backend == "vllm" and vllm_supports_prefix_caching():
+        # permutations of an example share the prefill of instructions and passage
+        config.modelkwargs.setdefault("vllm_kwargs", {}).setdefault("enable_prefix_caching", True)
+
+    def data_key(task: str) -> str:
+        return f"{task}@{','.join(map(str, answer_shuffle_seeds))}" if robustness_mode else task
+    t0 = time.time()
+    timings: Dict[str, Tuple[float, float]] = {}
+
+    def record_timing(stage: Span):
+        timings[stage.name] = (stage.start - t0, stage.end - t0)
+
+    def timed_load_and_preprocess(task: str) -> Dataset:
+        if data_key(task) in task_data:
+            return task_data[data_key(task)]
+        with span(f"load_{task}", config=config.name, task=task) as stage:
+            if robustness_mode:
+                ds = load_and_preprocess_permutations(task, token=hftoken, answer_shuffle_seeds=answer_shuffle_seeds)
+            else:
+                ds = load_and_preprocess(task, token=hftoken, answer_shuffle_seed=answer_shuffle_seed)
+        record_timing(stage)
+        return ds
+
+    # Preprocess the task data in worker threads, while the model is loading
+    with ThreadPoolExecutor(max_workers=min(len(tasks), MAX_WORKERS_PREPROCESSING)) as executor:
+        task_futures = {executor.submit(timed_load_and_preprocess, task): task for task in tasks}
+
+        # Load model, unless a loaded engine is passed
+        if llm is None:
+            backend = "server" if server_url else config.backend
+            logging.info(f"Loading {backend} model {config.model}")
+            with span("load_model", config=config.name, model=config.model, backend=backend) as stage:
+                llm = load_llm(config, server_url=server_url)
+            record_timing(stage)
+
+        # Build COT chain
+        logging.info(f"Building COT chain {config.cot_chain}")
+        chain_llm = TwoTierLLM(llm=llm) if generation_budgets else llm
+        chain = CHAIN_REGISTRY[config.cot_chain].build(chain_llm, final_answer=config.final_answer)
+
+        ## Test-run COT chain
+        logging.info("Testing COT chain")
+        test_input = [
+            {"passage": "Peter fell from a tree.", "question_options": "Is Peter injured?"},
+            {"passage": "Peter likes math.", "question_options": "Does Peter like Punk?"},
+        ]
+        test_traces = chain.batch(test_input)
+        logging.info(f"Tested COT chain: {test_traces}")
+
+        # Run COT chain on tasks, as soon as a task's data is ready
+        cot_data: Dict[str, Dataset] = {}
+        for future in as_completed(task_futures):
+            task = task_futures[future]
+            logging.info(f"Running COT chain {config.cot_chain} on {task}")
+            task_ds = future.result()
+            task_data[data_key(task)] = task_ds
+            if screening_plan:
+                task_ds = select_screening_slice(task_ds, *screening_plan["slices"][task], seed=screening_plan["seed"])
+            failure_stats: dict = {}
+            if generation_budgets:
+                chain_llm.first_tier = generation_budgets.get(task, {}).get("first_tier_tokens")
+            with span(f"generate_{task}", config=config.name, task=task, n=len(task_ds)) as stage:
+                cot_data[task] = run_chain_on_task(task_ds, chain, stats=failure_stats)
+                stage.attrs.update(failed=failure_stats["failed"], discarded=failure_stats["discarded"])
+                if generation_budgets and chain_llm.applies():
+                    budget_stats = chain_llm.pop_stats()
+                    stage.attrs.update(first_tier=chain_llm.first_tier, **budget_stats)
+                    log_budget_report(task, chain_llm.first_tier, llm.max_new_tokens, budget_stats)
+            record_timing(stage)
+            log_failure_report(task, failure_stats)
+            if robustness_mode:
+                template = CHAIN_REGISTRY[config.cot_chain].get_prompt_template(config.final_answer)
+                reuse = prefill_reuse(task_ds, template, llm_token_counter(llm))
+                stage.attrs.update(reuse)
+                logging.info(
+                    f"Prefill reuse on {task} ({len(answer_shuffle_seeds)} permutations in one pass): "
+                    f"{reuse['reused_tokens']} of {reuse['prompt_tokens']} prompt tokens ({reuse['reuse']:.0%}) "
+                    f"from prefix cache, vs. {reuse['reused_tokens_separate_runs']} in separate runs per permutation"
+                )
+            logging.info(f"Created reasoning traces for {task}: {cot_data[task]['reasoning_trace'][:2]} ...")
+            if config.final_answer:
+                cot_data[task] = cot_data[task].map(add_parsed_answers, batched=True, load_from_cache_file=False)
+                logging.info(f"Generative accuracy on {task}: {accuracy(cot_data[task]['parsed_answer'], cot_data[task]['answer'])}")
+                if robustness_mode:
+                    for permutation_id, ds in split_permutations(cot_data[task]).items():
+                        logging.info(
+                            f"Generative accuracy on {task}, seed {answer_shuffle_seeds[permutation_id]}: "
+                            f"{accuracy(ds['parsed_answer'], ds['answer'])}"
+                        )
+
+    log_timing_breakdown(timings)
+    return cot_data
+
+
+def upload_traces(
+    config: COTEvalConfig,
+    cot_data: Dict[str, Dataset],
+    upload_dataset: str,
+    hftoken: str,
+    create_pr: bool = False,
+    manifest: Optional[RunManifest] = None,
+    file_suffix: str = "",
+):
+    """Upload reasoning traces, one parquet file per task (name suffixed with `file_suffix`, e.g., screening rounds)"""
+    logging.info("Uploading datasets with reasoning traces")
+    # Metadata
+    config_data = config.model_dump(exclude=["description"])
+    model_kwargs = config_data.pop("modelkwargs", {})
+    vllm_kwargs = model_kwargs.pop("vllm_kwargs", {})
+    config_data = {**config_data, **model_kwargs, **vllm_kwargs}
+    config_data = {k: str(v) for k, v in config_data.items() if k in COT_CONFIG_KEYS}
+    logging.info(f"Adding config_data: {config_data}")
+
+    for task, task_ds in cot_data.items():
+
+        # robustness mode: one file per answer permutation, the first one under the usual name
+        remote_paths = []
+        for permutation_id, ds in split_permutations(task_ds).items():
+            suffix = (f"-perm{permutation_id}" if permutation_id else "") + file_suffix
+
+            with tempfile.TemporaryFile() as tmpfile, span(f"upload_{task}{suffix}", config=config.name, task=task):
+
+                table = ds.with_format("arrow")[:]
+                logging.info(f"Created table with reasoning traces for upload:\n{table.slice(0, 3)}")
+                write_traces(table, {**config_data, "task": task}, tmpfile)
+                tmpfile.seek(0)
+
+                retrials_count = 0
+                while retrials_count < MAX_RETRIALS_PUSH_TO_HUB:
+                    try:
+                        target_dir = os.path.join("data",*config.model.split("/", maxsplit=1))
+                        remote_path = os.path.join(target_dir,f"{config.name}-{task}{suffix}.parquet")
+                        huggingface_hub.upload_file(
+                            path_or_fileobj=tmpfile,
+                            path_in_repo=remote_path,
+                            repo_id=upload_dataset,
+                            repo_type="dataset",
+                            commit_message=f"Add reasoning traces dataset for config {config.name} and task {task}{suffix}",
+                            commit_description=config.to_yaml(),
+                            create_pr=create_pr,
+                            token=hftoken,
+                        )    
+                        logging.info(f"Uploaded reasoning traces for {task}{suffix}")
+                        remote_paths.append(remote_path)
+                        break
+                    except Exception as e:
+                        logging.error(f"Error uploading dataset for {task}{suffix}: {e}")
+                        retrials_count += 1
+                        logging.info(f"Retrying in {RETRIALS_INTERVAL} seconds")
+                        time.sleep(RETRIALS_INTERVAL)
+
+                if retrials_count == MAX_RETRIALS_PUSH_TO_HUB:
+                    logging.error(f"Failed to upload dataset for {task}{suffix}")
+                    raise RuntimeError(f"Failed to upload dataset for {task}{suffix}")
+
+        if manifest is not None:
+            manifest.mark_done(f"generate/{config.name}/{task}{file_suffix}", remote_path=",".join(remote_paths))
+
+
 # FIXME: Remove this block
 # def has_config(path: str, config_name: str, token: str) -> bool:
 #     """helper to check if a config exists"""
@@ -115,7 +436,12 @@ def run_chain_on_task(task_ds: Dataset, chain: Runnable) -> Dataset:
 #         return False
 
 
+@entry_point("cot-eval")
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        subcommand = importlib.import_module(SUBCOMMANDS[sys.argv[1]])
+        return subcommand.main(sys.argv[2:])
+
     args = parse_args()
 
     if args.config is None:
@@ -139,85 +465,37 @@ def main():
 
     tasks = [t for t in config.tasks]
 
-    # Preprocess the task data
-    task_data = {}
-    for task in tasks:
-        task_data[task] = load_and_preprocess(task, token=hftoken, answer_shuffle_seed=args.answer_shuffle_seed)
-
-    # Load model
-    logging.info(f"Loading vLLM model {config.model}")
-    llm = VLLM(
-        model=config.model,
-        **config.modelkwargs,
+    screening_plan = None
+    if args.screening_plan is not None:
+        with open(args.screening_plan) as fp:
+            screening_plan = json.load(fp)
+        tasks = [t for t in tasks if t in screening_plan["slices"]]
+        logging.info(f"Screening round {screening_plan['round']}: {screening_plan['slices']}")
+        if not tasks:
+            logging.info(f"No tasks of config {config.name} in screening round {screening_plan['round']}")
+            return
+    suffix = round_suffix(screening_plan["round"]) if screening_plan else ""
+
+    # resumed run: skip tasks whose traces have been uploaded already
+    manifest = RunManifest.from_env()
+    if manifest is not None:
+        done_tasks = [t for t in tasks if manifest.is_done(f"generate/{config.name}/{t}{suffix}")]
+        if done_tasks:
+            logging.info(f"Skipping tasks with uploaded reasoning traces (run manifest): {done_tasks}")
+        tasks = [t for t in tasks if t not in done_tasks]
+        if not tasks:
+            logging.info(f"All tasks of config {config.name} done")
+            return
+
+    answer_shuffle_seeds = [int(seed) for seed in args.answer_shuffle_seeds.split(",")] if args.answer_shuffle_seeds else None
+    cot_data = generate_traces(
+        config, tasks, hftoken, args.answer_shuffle_seed, answer_shuffle_seeds=answer_shuffle_seeds,
+        server_url=args.server_url, screening_plan=screening_plan,
+        generation_budgets=load_budgets(args.generation_budgets),
+    )
+    upload_traces(
+        config, cot_data, args.upload_dataset, hftoken, create_pr=args.create_pr, manifest=manifest, file_suffix=suffix
     )
-
-    # Build COT chain
-    logging.info(f"Building COT chain {config.cot_chain}")
-    chain = CHAIN_REGISTRY[config.cot_chain].build(llm)
-
-    ## Test-run COT chain
-    logging.info("Testing COT chain")
-    test_input = [
-        {"passage": "Peter fell from a tree.", "question_options": "Is Peter injured?"},
-        {"passage": "Peter likes math.", "question_options": "Does Peter like Punk?"},
-    ]
-    test_traces = chain.batch(test_input)
-    logging.info(f"Tested COT chain: {test_traces}")
-
-    # Run COT chain on tasks
-    cot_data: dict[str, Dataset] = {}
-    for task in tasks:
-        logging.info(f"Running COT chain {config.cot_chain} on {task}")
-        cot_data[task] = run_chain_on_task(task_data[task], chain)
-        logging.info(f"Created reasoning traces for {task}: {cot_data[task]['reasoning_trace'][:2]} ...")
-
-    # Upload reasoning traces
-    logging.info("Uploading datasets with reasoning traces")
-    # Metadata
-    config_data = config.model_dump(exclude=["description"])
-    model_kwargs = config_data.pop("modelkwargs", {})
-    vllm_kwargs = model_kwargs.pop("vllm_kwargs", {})
-    config_data = {**config_data, **model_kwargs, **vllm_kwargs}
-    config_data = {k: str(v) for k, v in config_data.items() if k in COT_CONFIG_KEYS}
-    logging.info(f"Adding config_data: {config_data}")
-
-    for task, ds in cot_data.items():
-
-        with tempfile.TemporaryFile() as tmpfile:
-
-            df = pd.DataFrame(ds)
-            df["config_data"] = len(df) * [list(config_data.items()) +[("task",task)]]
-            logging.info(f"Created dataframe with reasoning traces for upload:\n{df.head(3)}")
-            df.to_parquet(tmpfile, index=False)
-
-            retrials_count = 0
-            while retrials_count < MAX_RETRIALS_PUSH_TO_HUB:
-                try:
-                    target_dir = os.path.join("data",*config.model.split("/", maxsplit=1))
-                    remote_path = os.path.join(target_dir,f"{config.name}-{task}.parquet")
-                    huggingface_hub.upload_file(
-                        path_or_fileobj=tmpfile,
-                        path_in_repo=remote_path,
-                        repo_id=args.upload_dataset,
-                        repo_type="dataset",
-                        commit_message=f"Add reasoning traces dataset for config {config.name} and task {task}",
-                        commit_description=config.to_yaml(),
-                        create_pr=args.create_pr,
-                        token=hftoken,
-                    )    
-                    logging.info(f"Uploaded reasoning traces for {task}")
-                    break
-                except Exception as e:
-                    logging.error(f"Error uploading dataset for {task}: {e}")
-                    retrials_count += 1
-                    logging.info(f"Retrying in {RETRIALS_INTERVAL} seconds")
-                    time.sleep(RETRIALS_INTERVAL)
-
-            if retrials_count == MAX_RETRIALS_PUSH_TO_HUB:
-                logging.error(f"Failed to upload dataset for {task}")
-                raise RuntimeError(f"Failed to upload dataset for {task}")
-
-
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+"""Generative accuracy: parse answer labels directly from reasoning traces
+
+usage:
+cot-eval accuracy --traces_dir ./cot-eval-traces [--harness_output_dir ./cot-eval-cache/eleuther/output]
+
+Traces generated in final answer mode (`final_answer: true` in the cot-eval
+config) end with "Final answer: <label>". Compiled patterns extract the last
+stated label, which is checked against the `labels` column created by
+`load_and_preprocess`. This yields per-task CoT accuracy without a second
+model pass through lm-eval-harness. Traces without a parseable label are
+flagged (and count as wrong). Where harness results for the same config and
+task exist, agreement with harness accuracy is reported.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from cot_eval.bootstrap import find_samples_files, load_sample_correctness
+from cot_eval.preprocessing import EXAMPLE_ID_COLUMN
+from cot_eval.traces_io import read_config_data, read_traces
+
+
+# uppercase label, followed by a delimiter or the end of the trace (so that prose like "option is a compromise" is no answer)
+LABEL = r"\(?\**\s*([A-F])(?=\**\s*(?:[().:,;\]]|\n|$))"
+# ordered by reliability; for each pattern, the last match in the trace counts; only lead-ins ignore case
+ANSWER_PATTERNS = [
+    re.compile(r"(?i:final answer\s*(?:is)?\s*[:\-]?\s*)" + LABEL),
+    re.compile(r"(?i:(?:correct|best|right) (?:answer|option|choice) is\s*[:\-]?\s*(?:option\s*)?)" + LABEL),
+    re.compile(r"(?i:\banswer\s*[:\-]\s*)" + LABEL),
+    re.compile(r"(?i:\btherefore,?\s+(?:the answer is\s+)?(?:option\s+)?)\(?([A-F])\)"),
+]
+NOT_PARSED = -1
+
+
+def extract_answer(trace: Optional[str], labels: List[str]) -> int:
+    """Index of the answer label stated in a trace, NOT_PARSED if there is none
+
+    Args:
+        trace: reasoning trace
+        labels: option labels of the item, e.g. ["A", "B", "C", "D"]
+
+    Returns:
+        int: index of the stated option in `labels`
+    """
+    if not trace:
+        return NOT_PARSED
+    for pattern in ANSWER_PATTERNS:
+        matches = [m for m in pattern.findall(trace) if m in labels]
+        if matches:
+            return labels.index(matches[-1])
+    return NOT_PARSED
+
+
+def parsed_answers(traces: List[Optional[str]], labels: List[List[str]]) -> List[int]:
+    return [extract_answer(t, ls) for t, ls in zip(traces, labels)]
+
+
+def add_parsed_answers(examples: dict) -> dict:
+    """Batched `datasets.map` function adding a `parsed_answer` column"""
+    return {"parsed_answer": parsed_answers(examples["reasoning_trace"], examples["labels"])}
+
+
+def accuracy(parsed: List[int], answers: List[int]) -> Dict[str, float]:
+    n = len(answers)
+    correct = sum(p == a for p, a in zip(parsed, answers))
+    unparsed = sum(p == NOT_PARSED for p in parsed)
+    return {
+        "n": n,
+        "acc_generative": correct / n if n else float("nan"),
+        "unparsed_rate": unparsed / n if n else float("nan"),
+    }
+
+
+def harness_results(harness_output_dir: str) -> Tuple[Dict[str, float], Dict[str, Dict[int, float]]]:
+    """Accuracy and per-sample correctness of harness cot tasks, keyed `<config>_<task>`"""
+    accs = {}
+    for json_filepath in glob.glob(f"{harness_output_dir}/**/results*.json", recursive=True):
+        with open(json_filepath) as fp:
+            results = json.load(fp).get("results", {})
+        for key, record in results.items():
+            if key.endswith("_cot"):
+                accs[key[:-4]] = record.get("acc,none", record.get("acc"))
+    samples_files = find_samples_files(harness_output_dir, [f"{k}_cot" for k in accs])
+    samples = {key[:-4]: load_sample_correctness(path) for key, path in samples_files.items()}
+    return accs, samples
+
+
+def trace_file_accuracy(path: str) -> Tuple[dict, List[int], List[int], List[int]]:
+    """Generative accuracy of a single trace file, with parsed answers, gold answers and sample ids of its rows
+
+    Sample ids are example ids, or row indices for traces without example
+    ids (see `bootstrap.sample_id`).
+    """
+    config = read_config_data(pq.ParquetFile(path, memory_map=True))
+    table = read_traces(path, columns=["reasoning_trace", "labels", "answer", EXAMPLE_ID_COLUMN], with_config_column=False)
+    parsed = parsed_answers(table["reasoning_trace"].to_pylist(), table["labels"].to_pylist())
+    answers = table["answer"].to_pylist()
+    if EXAMPLE_ID_COLUMN in table.column_names:
+        ids = table[EXAMPLE_ID_COLUMN].to_pylist()
+    else:
+        ids = list(range(table.num_rows))
+    row = {
+        "model": config.get("model", ""),
+        "config": config.get("name", ""),
+        "task": config.get("task", ""),
+        "final_answer": config.get("final_answer", ""),
+        **accuracy(parsed, answers),
+    }
+    return row, parsed, answers, ids
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval accuracy", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--traces_dir", required=True, help="Local dir with trace parquet files")
+    parser.add_argument("--harness_output_dir", default=None, help="lm-eval-harness output dir to compare with")
+    parser.add_argument("--output", default=None, help="Write accuracy table to this csv file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+
+    harness_accs: Dict[str, float] = {}
+    harness_samples: Dict[str, Dict[int, float]] = {}
+    if args.harness_output_dir is not None:
+        harness_accs, harness_samples = harness_results(args.harness_output_dir)
+
+    rows = []
+    for path in sorted(glob.glob(f"{args.traces_dir}/**/*.parquet", recursive=True)):
+        row, parsed, answers, ids = trace_file_accuracy(path)
+        key = f"{row['config']}_{row['task']}"
+        if key in harness_accs:
+            row["acc_harness"] = harness_accs[key]
+            row["acc_diff"] = row["acc_generative"] - harness_accs[key]
+        if key in harness_samples:
+            correct = harness_samples[key]
+            agree = [float(p == a) == correct[i] for i, p, a in zip(ids, parsed, answers) if i in correct]
+            row["sample_agreement"] = sum(agree) / len(agree) if agree else float("nan")
+        rows.append(row)
+        logging.info(f"{os.path.basename(path)}: {row}")
+
+    summary = pd.DataFrame(rows)
+    with pd.option_context("display.max_rows", None, "display.width", 200, "display.precision", 3):
+        print(summary.to_string(index=False))
+    if args.output is not None:
+        summary.to_csv(args.output, index=False)
+        logging.info(f"Wrote accuracy table to {args.output}")
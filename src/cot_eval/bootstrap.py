@@ -0,0 +1,167 @@
+"""Paired bootstrap confidence intervals for CoT effectiveness
+
+Per-sample correctness is read from lm-eval-harness sample logs
+(`--log_samples`). Resampling is vectorized: for every task, one matrix of
+resample counts is drawn and multiplied with the correctness
+matrix of the base run and all cot configs, so that all configs are
+resampled jointly (paired) in a single matmul.
+"""
+
+import glob
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from cot_eval.preprocessing import EXAMPLE_ID_COLUMN
+
+
+N_RESAMPLES = 1000
+ALPHA = 0.05
+SEED = 42
+
+
+def sample_id(sample: dict) -> int:
+    """Id of a harness sample: the example id of its doc, or its doc id for traces without example ids
+
+    Doc ids are row indices of the evaluated trace file, which differ
+    between slices of a task (screening rounds); example ids are row
+    indices of the task's test split (see preprocessing.py).
+    """
+    doc = sample.get("doc") or {}
+    return int(doc.get(EXAMPLE_ID_COLUMN, sample["doc_id"]))
+
+
+def load_sample_correctness(samples_path: str, metric: str = "acc") -> Dict[int, float]:
+    """Load per-sample correctness from a harness sample log
+
+    lm-eval v0.4.1 writes a json array, later versions json lines; both are supported.
+
+    Returns:
+        Dict[int, float]: correctness per sample id (see `sample_id`)
+    """
+    with open(samples_path) as fp:
+        text = fp.read()
+    try:
+        samples = json.loads(text)
+    except json.JSONDecodeError:
+        samples = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return {sample_id(s): float(s[metric]) for s in samples if metric in s}
+
+
+def find_samples_files(output_dir: str, task_keys: List[str]) -> Dict[str, str]:
+    """Map harness task keys to sample log files in output_dir
+
+    Sample logs are named `<model_args>_<key>.jsonl` (lm-eval v0.4.1) or
+    `samples_<key>_<timestamp>.jsonl` (later versions).
+    """
+    # longest keys first, so that `a_b_cot` is not shadowed by `b_cot`
+    keys = sorted(task_keys, key=len, reverse=True)
+    samples_files = {}
+    for samples_path in glob.glob(f"{output_dir}/**/*.jsonl", recursive=True):
+        basename = os.path.basename(samples_path)
+        key = next(
+            (k for k in keys if basename.endswith(f"_{k}.jsonl") or basename.startswith(f"samples_{k}_")),
+            None,
+        )
+        if key is not None:
+            samples_files[key] = samples_path
+    return samples_files
+
+
+def paired_bootstrap(
+        base: np.ndarray,
+        cot: np.ndarray,
+        n_resamples: int = N_RESAMPLES,
+        alpha: float = ALPHA,
+        rng: Optional[np.random.Generator] = None,
+    ) -> Dict[str, List[Optional[float]]]:
+    """Paired bootstrap CIs of the best cot config's delta over base
+
+    The statistic is the one reported in the leaderboard, i.e. the maximum
+    over configs of the absolute (relative) accuracy delta.
+
+    Args:
+        base: correctness of base run, shape (n,)
+        cot: correctness of cot configs on the same docs, shape (n_configs, n)
+        n_resamples: number of bootstrap resamples
+        alpha: 1 - confidence level
+        rng: random generator
+
+    Returns:
+        Dict[str, List[Optional[float]]]: lower and upper bounds for `delta_abs` and `delta_rel`;
+            bounds of `delta_rel` that are not finite (resamples with base accuracy 0) are None
+    """
+    rng = np.random.default_rng(SEED) if rng is None else rng
+    n = base.shape[0]
+    correctness = np.vstack([base[None, :], cot]).T  # (n, 1 + n_configs)
+    # resample counts per doc, via one flat bincount over offset indices
+    idx = rng.integers(0, n, size=(n_resamples, n)) + n * np.arange(n_resamples)[:, None]
+    counts = np.bincount(idx.ravel(), minlength=n_resamples * n).reshape(n_resamples, n)
+    acc = counts @ correctness / n  # (n_resamples, 1 + n_configs)
+    delta_abs = acc[:, 1:] - acc[:, :1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta_rel = delta_abs / acc[:, :1]
+    quantiles = [alpha / 2, 1 - alpha / 2]
+    return {
+        "delta_abs_ci": np.quantile(delta_abs.max(axis=1), quantiles).tolist(),
+        "delta_rel_ci": [
+            float(bound) if np.isfinite(bound) else None  # json has no inf or nan
+            for bound in np.nanquantile(delta_rel.max(axis=1), quantiles)
+        ],
+    }
+
+
+def bootstrap_cis(
+        correctness: Dict[str, Dict[str, Dict[int, float]]],
+        n_resamples: int = N_RESAMPLES,
+        alpha: float = ALPHA,
+        seed: int = SEED,
+    ) -> Dict[str, Dict[str, List[Optional[float]]]]:
+    """Compute bootstrap CIs for all tasks
+
+    Args:
+        correctness: per task, per-doc correctness of the "base" run and of
+            every cot config (all other keys)
+
+    Returns:
+        Dict[str, Dict[str, List[Optional[float]]]]: CIs per task
+    """
+    rng = np.random.default_rng(seed)
+    cis = {}
+    for task, runs in correctness.items():
+        base = runs.get("base")
+        cot_runs = [v for k, v in runs.items() if k != "base"]
+        if not base or not cot_runs:
+            logging.warning(f"Missing sample logs for task {task}. Skipping bootstrap.")
+            continue
+        doc_ids = sorted(set(base).intersection(*cot_runs))
+        if not doc_ids:
+            logging.warning(f"No shared docs between base and cot sample logs for task {task}.")
+            continue
+        base_arr = np.array([base[i] for i in doc_ids])
+        cot_arr = np.array([[run[i] for i in doc_ids] for run in cot_runs])
+        cis[task] = paired_bootstrap(base_arr, cot_arr, n_resamples=n_resamples, alpha=alpha, rng=rng)
+    return cis
+
+
+def collect_correctness(output_dir: str, task_keys: List[str], tasks: List[str]) -> Dict[str, Dict[str, Dict[int, float]]]:
+    """Gather per-sample correctness for base and cot harness tasks in output_dir
+
+    Harness task keys have the form `<config>_<task>_<subtype>`.
+    """
+    samples_files = find_samples_files(output_dir, task_keys)
+    correctness: Dict[str, Dict[str, Dict[int, float]]] = {}
+    for key, samples_path in samples_files.items():
+        parts = key.rsplit("_", 2)
+        if len(parts) != 3 or parts[1] not in tasks:
+            continue
+        config, task, subtype = parts
+        runs = correctness.setdefault(task, {})
+        if subtype == "base":
+            runs.setdefault("base", load_sample_correctness(samples_path))
+        elif subtype == "cot":
+            runs[config] = load_sample_correctness(samples_path)
+    return correctness
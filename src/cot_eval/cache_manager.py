@@ -0,0 +1,357 @@
+"""Disk budget for model weights (HF cache) and pipeline artifacts (COTEVAL_CACHE_DIR)
+
+usage:
+cot-eval cache usage [--cache_dir ./cot-eval-cache]
+cot-eval cache evict --budget_gb 500 [--min_free_gb 50] [--pin $model@$revision] [--dry_run]
+
+Cache entries are model repos in the HF cache and pipeline artifacts in the
+cache dir (configs, harness tasks, eleuther outputs per model, `TMP`
+snapshots, logs, profiles, packed job dirs, archived run manifests). An
+eviction first removes artifacts older than `max_artifact_age_days`, then
+evicts entries in least-recently-used order for as long as the cache
+exceeds its budget (`COTEVAL_CACHE_BUDGET_GB`) or the disk holding an entry
+has less than `min_free_gb` free.
+
+Pinned entries are never evicted: models passed as pins (the current job),
+models of recently active run manifests, models of recently packed jobs,
+models prefetched recently or being prefetched (see weight_prefetch.py),
+and artifacts modified since the oldest active run started. Packed jobs
+run with their own cache dir (`<node cache dir>/job_<i>`) but share the
+HF cache, so run manifests and job files are looked up in the node-level
+cache dir (`COTEVAL_NODE_CACHE_DIR`, set by run.sh for packed jobs).
+Persistent state (requests index, results warehouse, tasks mirror,
+manifests of unfinished runs, timeline) and the harness templates shipped
+with the repo are not cache entries.
+
+Usage metrics are printed (`usage`) or written to `cache_usage.json` in
+the cache dir and recorded in the run timeline (`evict`).
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from huggingface_hub import CacheNotFound, constants, scan_cache_dir
+
+from cot_eval.run_manifest import MANIFESTS_DIR
+from cot_eval.tasks_registry import TASKS_REGISTRY
+from cot_eval.timeline import span
+from cot_eval.weight_prefetch import read_state as read_prefetch_state
+
+
+BUDGET_ENV = "COTEVAL_CACHE_BUDGET_GB"
+NODE_CACHE_ENV = "COTEVAL_NODE_CACHE_DIR"
+USAGE_FILE = "cache_usage.json"
+PIN_HOURS = 24  # runs and prefetches older than this do not pin entries any more
+# pipeline artifacts, relative to cache dir; every match is an entry
+ARTIFACT_PATTERNS = [
+    "cot_eval_configs/*",
+    "eleuther/tasks/logikon/*",
+    "eleuther/output/*/*",  # <org>/<model>
+    "TMP/*",
+    "logs/*",
+    "profiles/*",
+    "jobs/*",
+    "job_*",
+    f"{MANIFESTS_DIR}/*.json.[0-9]*",  # archived manifests
+]
+# harness templates shipped with the repo, copied into every run's harness tasks dir (with the checkout's mtimes)
+SHIPPED_HARNESS_FILES = ["_logikon_base_template_yaml", "_logikon_cot_template_yaml", "utils_logikon.py"] + [
+    f"{task}_base.yaml" for task in TASKS_REGISTRY
+]
+PROTECTED_ARTIFACTS = ["TMP/cot-leaderboard-requests", "TMP/results_warehouse.parquet"] + [
+    f"eleuther/tasks/logikon/{name}" for name in SHIPPED_HARNESS_FILES
+]
+
+
+@dataclass
+class CacheEntry:
+    """Unit of eviction"""
+
+    kind: str  # model, artifact
+    name: str  # repo id or path relative to cache dir
+    path: str
+    size: int
+    last_used: float
+    pinned: bool = False
+    commits: List[str] = field(default_factory=list)
+
+
+def _tree_stats(path: str) -> tuple:
+    """Size and latest mtime of a file or dir"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        stat = os.lstat(path)
+        return stat.st_size, stat.st_mtime
+    size, mtime = 0, os.lstat(path).st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            stat = os.lstat(os.path.join(root, name))
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+def _device_path(path: str) -> str:
+    """Path itself or its closest existing parent"""
+    while not os.path.exists(path):
+        path = os.path.dirname(os.path.abspath(path))
+    return path
+
+
+def _device(path: str) -> int:
+    return os.stat(_device_path(path)).st_dev
+
+
+class CacheManager:
+    """Keeps the HF cache and the pipeline cache dir within a disk budget
+
+    Args:
+        cache_dir: pipeline cache dir, default: `$COTEVAL_CACHE_DIR`
+        hf_cache_dir: HF hub cache dir, default: `$HF_HUB_CACHE`
+        budget_gb: max size of both caches together, default: `$COTEVAL_CACHE_BUDGET_GB` (None: no budget)
+        min_free_gb: free disk space to keep
+        max_artifact_age_days: artifacts not used for longer are evicted regardless of budget
+        pins: models (`<model>` or `<model>@<revision>`) never to evict
+        node_cache_dir: cache dir holding the job dirs of packed jobs, default: `$COTEVAL_NODE_CACHE_DIR` or `cache_dir`
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        hf_cache_dir: Optional[str] = None,
+        budget_gb: Optional[float] = None,
+        min_free_gb: float = 50.0,
+        max_artifact_age_days: float = 7.0,
+        pins: Optional[List[str]] = None,
+        node_cache_dir: Optional[str] = None,
+    ):
+        self.cache_dir = cache_dir or os.environ.get("COTEVAL_CACHE_DIR") or "./cot-eval-cache"
+        self.node_cache_dir = node_cache_dir or os.environ.get(NODE_CACHE_ENV) or self.cache_dir
+        self.hf_cache_dir = hf_cache_dir or constants.HF_HUB_CACHE
+        if budget_gb is None and os.environ.get(BUDGET_ENV):
+            budget_gb = float(os.environ[BUDGET_ENV])
+        self.budget_gb = budget_gb
+        self.min_free_gb = min_free_gb
+        self.max_artifact_age_days = max_artifact_age_days
+        self.pins = [p.split("@")[0] for p in pins or []]
+
+    def _active_runs(self) -> List[dict]:
+        """Unfinished run manifests (of this cache dir, the node cache dir and all packed job dirs) updated within PIN_HOURS"""
+        paths = set()
+        for cache_dir in {self.cache_dir, self.node_cache_dir}:
+            paths.update(glob.glob(os.path.join(cache_dir, MANIFESTS_DIR, "*.json")))
+            paths.update(glob.glob(os.path.join(cache_dir, "job_*", MANIFESTS_DIR, "*.json")))
+        runs = []
+        for path in sorted(paths):
+            if time.time() - os.path.getmtime(path) > PIN_HOURS * 3600:
+                continue
+            try:
+                with open(path) as fp:
+                    data = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            if data.get("status") == "running":
+                runs.append(data)
+        return runs
+
+    def _packed_models(self) -> List[str]:
+        """Models of packed jobs planned within PIN_HOURS (their runs may not have a manifest yet)"""
+        models = []
+        for path in glob.glob(os.path.join(self.node_cache_dir, "jobs", "job_*.json")):
+            if time.time() - os.path.getmtime(path) > PIN_HOURS * 3600:
+                continue
+            try:
+                with open(path) as fp:
+                    models.append(json.load(fp)["model"])
+            except (OSError, ValueError, KeyError):
+                continue
+        return models
+
+    def pinned_models(self) -> List[str]:
+        pinned = set(self.pins)
+        pinned.update(run["model"] for run in self._active_runs())
+        pinned.update(self._packed_models())
+        for entry in read_prefetch_state(self.hf_cache_dir).values():
+            recent = time.time() - entry.get("started", 0) < PIN_HOURS * 3600
+            if entry.get("status") in ("running", "complete") and recent:
+                pinned.add(entry["model"])
+        return sorted(pinned)
+
+    def model_entries(self, pinned_models: List[str]) -> List[CacheEntry]:
+        try:
+            cache_info = scan_cache_dir(self.hf_cache_dir)
+        except CacheNotFound:
+            return []
+        return [
+            CacheEntry(
+                kind="model",
+                name=repo.repo_id,
+                path=str(repo.repo_path),
+                size=repo.size_on_disk,
+                last_used=max(repo.last_accessed, repo.last_modified),
+                pinned=repo.repo_id in pinned_models,
+                commits=[r.commit_hash for r in repo.revisions],
+            )
+            for repo in cache_info.repos
+            if repo.repo_type == "model"
+        ]
+
+    def artifact_entries(self, pinned_models: List[str]) -> List[CacheEntry]:
+        active_since = min((run.get("created", time.time()) for run in self._active_runs()), default=None)
+        entries = []
+        for pattern in ARTIFACT_PATTERNS:
+            for path in glob.glob(os.path.join(self.cache_dir, pattern)):
+                name = os.path.relpath(path, self.cache_dir)
+                if name in PROTECTED_ARTIFACTS or os.path.basename(path).startswith(".tmp"):
+                    continue
+                size, mtime = _tree_stats(path)
+                pinned = (active_since is not None and mtime >= active_since) or (
+                    name.startswith(os.path.join("eleuther", "output", "")) and name.split(os.sep, 2)[-1] in pinned_models
+                )
+                entries.append(CacheEntry(kind="artifact", name=name, path=path, size=size, last_used=mtime, pinned=pinned))
+        return entries
+
+    def entries(self) -> List[CacheEntry]:
+        """All cache entries, least recently used first"""
+        pinned_models = self.pinned_models()
+        entries = self.model_entries(pinned_models) + self.artifact_entries(pinned_models)
+        return sorted(entries, key=lambda e: e.last_used)
+
+    def usage(self, entries: Optional[List[CacheEntry]] = None) -> dict:
+        entries = self.entries() if entries is None else entries
+        metrics = {
+            "budget_gb": self.budget_gb,
+            "total_gb": sum(e.size for e in entries) / 2**30,
+            "pinned_gb": sum(e.size for e in entries if e.pinned) / 2**30,
+            "pinned_models": self.pinned_models(),
+        }
+        for kind in ["model", "artifact"]:
+            of_kind = [e for e in entries if e.kind == kind]
+            metrics[f"{kind}s"] = len(of_kind)
+            metrics[f"{kind}s_gb"] = sum(e.size for e in of_kind) / 2**30
+        for name, path in [("hf_cache", self.hf_cache_dir), ("cache_dir", self.cache_dir)]:
+            if os.path.exists(path):
+                metrics[f"{name}_free_gb"] = shutil.disk_usage(path).free / 2**30
+        return metrics
+
+    def _delete(self, entry: CacheEntry, dry_run: bool):
+        logging.info(
+            f"{'Would evict' if dry_run else 'Evicting'} {entry.kind} {entry.name} ({entry.size / 2**30:.2f}GB, "
+            f"last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.last_used))})"
+        )
+        if dry_run:
+            return
+        if entry.kind == "model":
+            scan_cache_dir(self.hf_cache_dir).delete_revisions(*entry.commits).execute()
+        elif os.path.isdir(entry.path) and not os.path.islink(entry.path):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+    def evict(self, extra_bytes: int = 0, dry_run: bool = False) -> List[CacheEntry]:
+        """Evict stale artifacts, then LRU entries until the caches fit, with room for `extra_bytes` in the HF cache
+
+        Returns:
+            List[CacheEntry]: evicted entries
+        """
+        entries = self.entries()
+        total = sum(e.size for e in entries) + extra_bytes
+        budget = self.budget_gb * 2**30 if self.budget_gb is not None else None
+        min_free = self.min_free_gb * 2**30
+        free: Dict[int, int] = {}
+        for path in [self.hf_cache_dir, self.cache_dir]:
+            free.setdefault(_device(path), shutil.disk_usage(_device_path(path)).free)
+        free[_device(self.hf_cache_dir)] -= extra_bytes
+
+        evicted = []
+        for entry in entries:
+            if entry.pinned:
+                continue
+            device = _device(entry.path)
+            stale = entry.kind == "artifact" and time.time() - entry.last_used > self.max_artifact_age_days * 86400
+            over_budget = budget is not None and total > budget
+            low_disk = free.get(device, min_free) < min_free
+            if not (stale or over_budget or low_disk):
+                continue
+            try:
+                self._delete(entry, dry_run)
+            except OSError as e:
+                logging.warning(f"Could not evict {entry.name}: {e}")
+                continue
+            evicted.append(entry)
+            total -= entry.size
+            if device in free:
+                free[device] += entry.size
+
+        if budget is not None and total > budget:
+            logging.warning(f"Cache ({total / 2**30:.1f}GB) exceeds budget ({self.budget_gb:.0f}GB) after evicting all unpinned entries")
+        for device, free_bytes in free.items():
+            if free_bytes < min_free:
+                logging.warning(f"Less than {self.min_free_gb:.0f}GB disk space free after evicting all unpinned entries")
+        return evicted
+
+    def make_room(self, num_bytes: int, pin: Optional[List[str]] = None) -> bool:
+        """Evict until `num_bytes` fit into the HF cache (within budget and free disk space)
+
+        Returns:
+            bool: whether there is room
+        """
+        self.pins = sorted(set(self.pins) | {p.split("@")[0] for p in pin or []})
+        self.evict(extra_bytes=num_bytes)
+        total = sum(e.size for e in self.entries()) + num_bytes
+        fits_budget = self.budget_gb is None or total <= self.budget_gb * 2**30
+        free = shutil.disk_usage(_device_path(self.hf_cache_dir)).free
+        return fits_budget and free - num_bytes >= self.min_free_gb * 2**30
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval cache", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("action", choices=["usage", "evict"])
+    parser.add_argument("--cache_dir", default=None, help="Pipeline cache dir (default: $COTEVAL_CACHE_DIR)")
+    parser.add_argument("--hf_cache_dir", default=None, help="HF hub cache dir (default: $HF_HUB_CACHE)")
+    parser.add_argument("--budget_gb", type=float, default=None, help=f"Disk budget of both caches (default: ${BUDGET_ENV})")
+    parser.add_argument("--min_free_gb", type=float, default=50.0, help="Free disk space to keep (GB)")
+    parser.add_argument("--max_artifact_age_days", type=float, default=7.0, help="Evict artifacts unused for longer")
+    parser.add_argument("--pin", action="append", default=[], help="Model (<model>[@<revision>]) not to evict")
+    parser.add_argument("--dry_run", action="store_true", help="Log what would be evicted")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    manager = CacheManager(
+        cache_dir=args.cache_dir,
+        hf_cache_dir=args.hf_cache_dir,
+        budget_gb=args.budget_gb,
+        min_free_gb=args.min_free_gb,
+        max_artifact_age_days=args.max_artifact_age_days,
+        pins=args.pin,
+    )
+
+    if args.action == "usage":
+        print(json.dumps({"usage": manager.usage(), "entries": [asdict(e) for e in manager.entries()]}, indent=2))
+        return
+
+    with span("cache_evict", dry_run=args.dry_run) as record:
+        before = manager.usage()
+        evicted = manager.evict(dry_run=args.dry_run)
+        after = manager.usage()
+        record.attrs.update(
+            before_gb=before["total_gb"],
+            after_gb=after["total_gb"],
+            evicted=len(evicted),
+            evicted_gb=sum(e.size for e in evicted) / 2**30,
+        )
+    logging.info(
+        f"Cache: {before['total_gb']:.1f}GB -> {after['total_gb']:.1f}GB (budget {manager.budget_gb or '-'}GB), "
+        f"evicted {len(evicted)} entries ({record.attrs['evicted_gb']:.1f}GB), pinned: {after['pinned_models']}"
+    )
+    os.makedirs(manager.cache_dir, exist_ok=True)
+    with open(os.path.join(manager.cache_dir, USAGE_FILE), "w") as fp:
+        json.dump({**after, "evicted": [asdict(e) for e in evicted], "time": time.time()}, fp, indent=2)
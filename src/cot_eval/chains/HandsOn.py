@@ -34,9 +34,9 @@ Use the closing tag </reasoning> to indicate when you're done.
     stop_words = ["</reasoning>", "\n###"]
 
     @classmethod
-    def build(cls, llm: VLLM) -> Runnable:
+    def build(cls, llm: VLLM, final_answer: bool = False) -> Runnable:
 
-        prompt = PromptTemplate.from_template(cls.prompt_template)
+        prompt = PromptTemplate.from_template(cls.get_prompt_template(final_answer))
         chain = (
             prompt
             | llm.bind(stop=cls.stop_words)
@@ -0,0 +1,264 @@
+"""Two-tier generation budgets: short first tier, continuation of truncated traces only
+
+usage:
+cot-eval budgets --traces_dir ./cot-eval-traces [--quantile 0.9] [--output ./cot-eval-cache/generation_budgets.json]
+
+`max_new_tokens` is set per config for the longest traces of all tasks,
+while most traces (e.g., LogiQA) end much earlier than the longest ones
+(e.g., LSAT-AR); engines reserve KV cache and schedule for the worst case.
+`learn_budgets` sets a per-task first-tier budget to a quantile of the
+lengths of previously generated traces (see trace_stats.py), and
+`TwoTierLLM` generates with it: all sequences get the first-tier budget,
+and only sequences truncated without a stop word (finish reason `length`)
+are continued from their partial output, up to the config's full
+`max_new_tokens`.
+
+Final traces are equivalent to single-tier generation: with vLLM,
+continuations start from the token ids of prompt and partial output
+(identical greedy traces); with other backends, from prompt and partial
+text (identical up to re-tokenization at the boundary). With sampling,
+the continuation is a draw from the same distribution. Configs generating
+several sequences per prompt (`n`, `best_of`, beam search) are generated
+single-tier.
+
+Tokens saved (KV cache reserved for sequences beyond their budget) and
+the time of both tiers are recorded in the `generate_<task>` spans.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.outputs import Generation, LLMResult
+
+from cot_eval.trace_stats import QUANTILES, LengthStats, file_stats
+from cot_eval.transformers_backend import truncate_at_stop
+
+BUDGETS_ENV = "COTEVAL_GENERATION_BUDGETS"
+QUANTILE = 0.9
+MIN_FIRST_TIER = 64
+TIER_ROUNDING = 32
+WHITESPACE_TOKEN_RATIO = 1.4  # model tokens per whitespace token (rough, English text)
+# backends that report finish reasons (besides vLLM, whose engine is called directly)
+FINISH_REASON_BACKENDS = ["transformers_cpu", "model_server"]
+
+
+def learn_budgets(paths: List[str], quantile: float = QUANTILE, tokenizer: str = "whitespace") -> Dict[str, dict]:
+    """First-tier budget per task: quantile of trace lengths in trace files, over all models and configs"""
+    if quantile not in QUANTILES:
+        raise ValueError(f"Quantile must be one of {QUANTILES}")
+    per_task: Dict[str, LengthStats] = {}
+    for path in paths:
+        (_, _, task), stats = file_stats(path, tokenizer=tokenizer)
+        if task:
+            per_task.setdefault(task, LengthStats()).merge(stats)
+
+    budgets = {}
+    for task, stats in sorted(per_task.items()):
+        summary = stats.summary()
+        tokens = summary[f"tokens_p{int(quantile * 100)}"]
+        if math.isnan(tokens):
+            continue
+        if tokenizer == "whitespace":
+            tokens *= WHITESPACE_TOKEN_RATIO
+        budgets[task] = {
+            "first_tier_tokens": max(MIN_FIRST_TIER, TIER_ROUNDING * math.ceil(tokens / TIER_ROUNDING)),
+            "quantile": quantile,
+            "n": summary["n"],
+            "tokenizer": tokenizer,
+            "truncation_rate": None if math.isnan(summary["truncation_rate"]) else summary["truncation_rate"],  # unknown
+        }
+    return budgets
+
+
+def load_budgets(path: Optional[str] = None) -> Dict[str, dict]:
+    """Budgets per task from path (default: $COTEVAL_GENERATION_BUDGETS), empty if not set or missing"""
+    path = path or os.environ.get(BUDGETS_ENV)
+    if not path:
+        return {}
+    if not os.path.isfile(path):
+        logging.warning(f"Generation budgets file {path} not found, generating with max_new_tokens only")
+        return {}
+    with open(path) as fp:
+        return json.load(fp)
+
+
+@dataclass
+class Completion:
+    text: str
+    finish_reason: Optional[str]
+    token_ids: Optional[List[int]] = None  # prompt and output token ids (vLLM)
+
+
+def _is_vllm(llm: BaseLLM) -> bool:
+    return llm._llm_type == "vllm"
+
+
+def multi_sequence(llm: BaseLLM) -> bool:
+    """Whether the backend generates several sequences per prompt"""
+    params = {**getattr(llm, "sampling_params", {}), **{k: getattr(llm, k) for k in ["n", "best_of", "use_beam_search"] if hasattr(llm, k)}}
+    return bool(params.get("use_beam_search")) or (params.get("n") or 1) > 1 or (params.get("best_of") or 1) > 1
+
+
+def generate_tier(llm: BaseLLM, inputs: List[Any], stop: Optional[List[str]], max_tokens: int) -> List[Completion]:
+    """Completions of prompts (or, with vLLM, token ids of prompt and partial output) with a token budget"""
+    if _is_vllm(llm):
+        from vllm import SamplingParams
+
+        # sampling params as in langchain's `VLLM._generate`, with the tier's budget
+        sampling_params = SamplingParams(**{**llm._default_params, "max_tokens": max_tokens, "stop": stop})
+        if all(isinstance(x, list) for x in inputs):
+            outputs = llm.client.generate(None, sampling_params, prompt_token_ids=inputs)
+        else:
+            outputs = llm.client.generate(inputs, sampling_params)
+        return [
+            Completion(o.outputs[0].text, o.outputs[0].finish_reason, list(o.prompt_token_ids) + list(o.outputs[0].token_ids))
+            for o in outputs
+        ]
+
+    full_budget = llm.max_new_tokens
+    llm.max_new_tokens = max_tokens
+    try:
+        result = llm._generate(inputs, stop=stop)
+    finally:
+        llm.max_new_tokens = full_budget
+    return [Completion(g[0].text, (g[0].generation_info or {}).get("finish_reason")) for g in result.generations]
+
+
+class TwoTierLLM(BaseLLM):
+    """Langchain LLM generating with a first-tier budget and continuing truncated sequences
+
+    `first_tier` is set per task (None: single tier). Counters of all
+    calls since the last `pop_stats` are kept in `stats`.
+    """
+
+    llm: BaseLLM
+    first_tier: Optional[int] = None
+    stats: Dict[str, float] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return f"two_tier_{self.llm._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {**self.llm._identifying_params, "first_tier": self.first_tier}
+
+    def applies(self) -> bool:
+        return (
+            bool(self.first_tier)
+            and self.first_tier < self.llm.max_new_tokens
+            and (_is_vllm(self.llm) or self.llm._llm_type in FINISH_REASON_BACKENDS)
+            and not multi_sequence(self.llm)
+        )
+
+    def pop_stats(self) -> Dict[str, float]:
+        stats, self.stats = self.stats, {}
+        return stats
+
+    def _count(self, **counts):
+        for key, value in counts.items():
+            self.stats[key] = self.stats.get(key, 0) + value
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        if not self.applies():
+            return self.llm._generate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+
+        full_budget = self.llm.max_new_tokens
+        start = time.perf_counter()
+        completions = generate_tier(self.llm, prompts, stop, self.first_tier)
+        first_tier_s = time.perf_counter() - start
+        if any(c.finish_reason is None for c in completions):
+            raise ValueError(f"Backend {self.llm._llm_type} reports no finish reasons, two-tier generation not possible")
+
+        truncated = [i for i, c in enumerate(completions) if c.finish_reason == "length"]
+        start = time.perf_counter()
+        if truncated:
+            inputs = [
+                completions[i].token_ids if completions[i].token_ids is not None else prompts[i] + completions[i].text
+                for i in truncated
+            ]
+            continuations = generate_tier(self.llm, inputs, stop, full_budget - self.first_tier)
+            for i, continuation in zip(truncated, continuations):
+                # stop words spanning the tier boundary are only seen in the joined text
+                text, stopped = truncate_at_stop(completions[i].text + continuation.text, stop)
+                completions[i] = Completion(text, "stop" if stopped else continuation.finish_reason)
+        second_tier_s = time.perf_counter() - start
+
+        # KV cache reserved for sequences beyond their budget: every sequence at full budget vs. tiers
+        reserved_single = len(prompts) * full_budget
+        reserved_tiers = len(prompts) * self.first_tier + len(truncated) * (full_budget - self.first_tier)
+        self._count(
+            sequences=len(prompts),
+            continued=len(truncated),
+            reserved_tokens_saved=reserved_single - reserved_tiers,
+            first_tier_s=first_tier_s,
+            second_tier_s=second_tier_s,
+        )
+        logging.info(
+            f"Two-tier generation: {len(truncated)} of {len(prompts)} sequences continued beyond {self.first_tier} tokens "
+            f"(first tier {first_tier_s:.1f}s, second tier {second_tier_s:.1f}s), "
+            f"{reserved_single - reserved_tiers} of {reserved_single} reserved tokens saved"
+        )
+        return LLMResult(
+            generations=[[Generation(text=c.text, generation_info={"finish_reason": c.finish_reason})] for c in completions]
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval budgets", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--traces_dir", default=None, help="Local dir with trace parquet files")
+    parser.add_argument("--traces_repo", default=None, help="HF dataset repo to download trace parquet files from")
+    parser.add_argument("--hftoken", default=None, help="HF Token to use for download")
+    parser.add_argument("--quantile", type=float, choices=QUANTILES, default=QUANTILE, help="Quantile of trace lengths as first-tier budget")
+    parser.add_argument(
+        "--tokenizer", choices=["whitespace", "model"], default="whitespace",
+        help="Count tokens by whitespace splitting (scaled) or with the model's tokenizer (requires transformers)",
+    )
+    parser.add_argument("--output", default=None, help=f"Budgets file (default: ${BUDGETS_ENV})")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    output = args.output or os.environ.get(BUDGETS_ENV)
+    if output is None:
+        raise ValueError(f"No output file specified (--output or ${BUDGETS_ENV})")
+    if args.traces_dir is None and args.traces_repo is None:
+        raise ValueError("Either --traces_dir or --traces_repo must be specified")
+    traces_dir = args.traces_dir
+    if args.traces_repo is not None:
+        from huggingface_hub import snapshot_download
+        traces_dir = snapshot_download(
+            repo_id=args.traces_repo,
+            repo_type="dataset",
+            local_dir=traces_dir,
+            allow_patterns=["**/*.parquet"],
+            token=args.hftoken or os.environ.get("HUGGINGFACEHUB_API_TOKEN"),
+        )
+
+    paths = sorted(glob.glob(f"{traces_dir}/**/*.parquet", recursive=True))
+    logging.info(f"Learning generation budgets from {len(paths)} trace files in {traces_dir}")
+    budgets = learn_budgets(paths, quantile=args.quantile, tokenizer=args.tokenizer)
+    for task, budget in budgets.items():
+        logging.info(
+            f"{task}: first tier {budget['first_tier_tokens']} tokens (p{int(args.quantile * 100)} of {budget['n']} traces)"
+        )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump(budgets, fp, indent=2)
+    logging.info(f"Wrote generation budgets to {output}")
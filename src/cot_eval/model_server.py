@@ -0,0 +1,419 @@
+"""Shared local inference server of a model, for trace generation and harness scoring
+
+usage:
+cot-eval serve start --model_args $lm_eval_model_args [--port 8000]
+cot-eval serve health --base_url http://127.0.0.1:8000
+
+Without a shared server, a pipeline loads the same model once per cot-eval
+config and once per lm-eval call. `ModelServer` starts vLLM's
+OpenAI-compatible server once per model instead (weights loaded once, with
+prefix caching if the installed vLLM supports it), waits until its `/health` endpoint responds, polls its
+load (`/metrics`: running and waiting requests, KV cache usage, tokens
+processed) in a background thread, and shuts it down on `stop()`.
+
+Clients:
+- trace generation: `ServerLLM`, a langchain LLM sending completion
+  requests (`/v1/completions`) with the sampling params of a cot-eval
+  config (`cot-eval --config ... --server_url $url`)
+- harness scoring: lm-eval's `local-completions` model, which scores
+  loglikelihood requests with prompt logprobs (`echo`) of the same
+  endpoint (see `local_completions_model_args`)
+
+Any server implementing these endpoints can stand in for vLLM, e.g.
+`scripts/stand_in_model_server.py` for CPU dry runs of the pipeline
+(`server_command`).
+"""
+
+import argparse
+import importlib.metadata
+import json
+import logging
+import os
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.outputs import Generation, LLMResult
+
+SERVER_ENV = "COTEVAL_MODEL_SERVER"
+STARTUP_TIMEOUT = 1800.0
+SHUTDOWN_TIMEOUT = 60.0
+POLL_INTERVAL = 30.0
+REQUEST_TIMEOUT = 3600.0
+MAX_RETRIES = 3
+PREFIX_CACHING_VLLM = (0, 4, 0)  # first vLLM release with automatic prefix caching (`enable_prefix_caching`)
+
+# Prometheus metrics of the vLLM server reported as load (gauges and counters, summed over labels)
+LOAD_METRICS = {
+    "vllm:num_requests_running": "running",
+    "vllm:num_requests_waiting": "waiting",
+    "vllm:gpu_cache_usage_perc": "kv_cache_usage",
+    "vllm:kv_cache_usage_perc": "kv_cache_usage",  # newer vLLM versions
+    "vllm:prompt_tokens_total": "prompt_tokens",
+    "vllm:generation_tokens_total": "generation_tokens",
+    "vllm:request_success_total": "requests",
+}
+# cot-eval modelkwargs sent as sampling params (vLLM accepts top_k, use_beam_search as extra params)
+SAMPLING_KWARGS = ["temperature", "top_p", "top_k", "n", "best_of", "use_beam_search", "presence_penalty", "frequency_penalty"]
+
+
+def parse_model_args(model_args: str) -> Dict[str, str]:
+    """lm-eval model_args string (`key=value,...`) as dict"""
+    return dict(kv.split("=", 1) for kv in model_args.split(",") if kv)
+
+
+def vllm_version() -> Optional[Tuple[int, ...]]:
+    """Version of the installed vLLM (major, minor, patch), None if not installed"""
+    try:
+        version = importlib.metadata.version("vllm")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+
+
+def vllm_supports_prefix_caching() -> bool:
+    version = vllm_version()
+    return version is not None and version >= PREFIX_CACHING_VLLM
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def vllm_server_command(model_args: Dict[str, str], host: str, port: int) -> List[str]:
+    """Command starting vLLM's OpenAI-compatible server with the model args of lm-eval's vllm model"""
+    command = [
+        sys.executable, "-m", "vllm.entrypoints.openai.api_server",
+        "--model", model_args["pretrained"],
+        "--host", host,
+        "--port", str(port),
+    ]
+    if vllm_supports_prefix_caching():
+        command.append("--enable-prefix-caching")  # shared instructions and passages across prompts and answer options
+    else:
+        logging.info(f"vLLM {vllm_version()} has no prefix caching, serving without it")
+    options = {
+        "revision": "--revision",
+        "dtype": "--dtype",
+        "tensor_parallel_size": "--tensor-parallel-size",
+        "gpu_memory_utilization": "--gpu-memory-utilization",
+        "max_length": "--max-model-len",
+    }
+    command += [arg for key, option in options.items() if key in model_args for arg in (option, model_args[key])]
+    if model_args.get("trust_remote_code", "false").lower() == "true":
+        command.append("--trust-remote-code")
+    return command
+
+
+def local_completions_model_args(model_args: Dict[str, str], base_url: str, num_concurrent: int = 16) -> str:
+    """model_args of lm-eval's `local-completions` model, scoring with the shared server"""
+    server_args = {
+        "model": model_args["pretrained"],
+        "base_url": f"{base_url}/v1/completions",
+        "tokenizer_backend": "huggingface",
+        "tokenized_requests": "False",
+        "num_concurrent": str(num_concurrent),
+        "max_retries": str(MAX_RETRIES),
+    }
+    for key in ["revision", "max_length", "trust_remote_code"]:
+        if key in model_args:
+            server_args[key] = model_args[key]
+    return ",".join(f"{k}={v}" for k, v in server_args.items())
+
+
+def health(base_url: str, timeout: float = 5.0) -> bool:
+    """Whether the server answers its health check"""
+    try:
+        with urllib.request.urlopen(f"{base_url}/health", timeout=timeout) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def load(base_url: str, timeout: float = 5.0) -> Dict[str, float]:
+    """Load metrics of the server (see LOAD_METRICS), empty if unavailable"""
+    try:
+        with urllib.request.urlopen(f"{base_url}/metrics", timeout=timeout) as response:
+            text = response.read().decode()
+    except (urllib.error.URLError, OSError):
+        return {}
+    metrics: Dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        name = name.split("{", 1)[0]
+        if name in LOAD_METRICS:
+            key = LOAD_METRICS[name]
+            metrics[key] = metrics.get(key, 0.0) + float(value)
+    return metrics
+
+
+class ModelServer:
+    """Inference server subprocess of a model, with health check and load monitoring"""
+
+    def __init__(
+        self,
+        command: List[str],
+        host: str,
+        port: int,
+        gpu_ids: Optional[List[str]] = None,
+        log_path: Optional[str] = None,
+        startup_timeout: float = STARTUP_TIMEOUT,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self.command = command
+        self.host = host
+        self.port = port
+        self.gpu_ids = gpu_ids
+        self.log_path = log_path
+        self.startup_timeout = startup_timeout
+        self.poll_interval = poll_interval
+        self.samples: List[Dict[str, float]] = []
+        self.process: Optional[subprocess.Popen] = None
+        self.started: Optional[float] = None
+        self.ready: Optional[float] = None
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    @classmethod
+    def for_model(
+        cls,
+        model_args: Dict[str, str],
+        server_command: Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: Optional[int] = None,
+        **kwargs,
+    ) -> "ModelServer":
+        """Server of the model in lm-eval `model_args`: vLLM, or `server_command` (with {host}, {port}, {model} placeholders)"""
+        port = port or free_port(host)
+        if server_command:
+            command = shlex.split(server_command.format(host=host, port=port, model=model_args.get("pretrained", "")))
+        else:
+            command = vllm_server_command(model_args, host, port)
+        return cls(command, host, port, **kwargs)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """Start the server and wait until it is healthy"""
+        env = dict(os.environ)
+        if self.gpu_ids is not None:
+            env["CUDA_VISIBLE_DEVICES"] = ",".join(self.gpu_ids)
+        log = open(self.log_path, "a") if self.log_path else subprocess.DEVNULL
+        logging.info(f"Starting model server at {self.base_url}: {shlex.join(self.command)}")
+        self.started = time.time()
+        self.process = subprocess.Popen(self.command, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if self.log_path:
+            log.close()
+        try:
+            self.wait_healthy()
+        except Exception:
+            self.stop()
+            raise
+        self.ready = time.time()
+        logging.info(f"Model server ready after {self.ready - self.started:.1f}s")
+        self._monitor = threading.Thread(target=self._poll_load, name="model-server-monitor", daemon=True)
+        self._monitor.start()
+
+    def wait_healthy(self):
+        deadline = time.time() + self.startup_timeout
+        while not health(self.base_url):
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Model server exited with code {self.process.returncode} (log: {self.log_path})")
+            if time.time() > deadline:
+                raise TimeoutError(f"Model server not healthy after {self.startup_timeout:.0f}s (log: {self.log_path})")
+            time.sleep(1.0)
+
+    def _poll_load(self):
+        while not self._stop.wait(self.poll_interval):
+            if self.process.poll() is not None:
+                logging.error(f"Model server exited with code {self.process.returncode} (log: {self.log_path})")
+                return
+            sample = load(self.base_url)
+            if sample:
+                self.samples.append(sample)
+                logging.info(
+                    "Model server load: " + ", ".join(f"{k} {v:g}" for k, v in sample.items())
+                )
+
+    def load_report(self) -> Dict[str, Any]:
+        """Startup time, peak load and tokens processed, for the run timeline"""
+        report: Dict[str, Any] = {"load_samples": len(self.samples)}
+        if self.started and self.ready:
+            report["startup_s"] = self.ready - self.started
+        for key in ["running", "waiting", "kv_cache_usage"]:
+            values = [s[key] for s in self.samples if key in s]
+            if values:
+                report[f"peak_{key}"] = max(values)
+        for key in ["prompt_tokens", "generation_tokens", "requests"]:
+            if self.samples and key in self.samples[-1]:
+                report[key] = self.samples[-1][key]
+        return report
+
+    def stop(self):
+        """Shut down the server (SIGTERM, SIGKILL after a timeout)"""
+        self._stop.set()
+        if self.process is None or self.process.poll() is not None:
+            return
+        if self.ready:
+            final = load(self.base_url)  # counters of requests since the last poll
+            if final:
+                self.samples.append(final)
+        logging.info(f"Stopping model server at {self.base_url}")
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=SHUTDOWN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logging.warning(f"Model server did not stop within {SHUTDOWN_TIMEOUT:.0f}s, killing it")
+            self.process.kill()
+            self.process.wait()
+
+    def __enter__(self) -> "ModelServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class ServerLLM(BaseLLM):
+    """Langchain LLM generating with the completions endpoint of a (shared) model server
+
+    Prompts are sent in requests of `batch_size` prompts, `num_concurrent`
+    requests at a time; the server batches them continuously.
+    """
+
+    base_url: str
+    model: str
+    max_new_tokens: int = 256
+    sampling_params: Dict[str, Any] = {}
+    seed: Optional[int] = None
+    batch_size: int = 64
+    num_concurrent: int = 8
+    timeout: float = REQUEST_TIMEOUT
+
+    @classmethod
+    def from_modelkwargs(cls, base_url: str, model: str, **modelkwargs) -> "ServerLLM":
+        """Client with the `modelkwargs` of a cot-eval config; engine kwargs are the server's business"""
+        vllm_kwargs = modelkwargs.get("vllm_kwargs") or {}
+        return cls(
+            base_url=base_url.rstrip("/"),
+            model=model,
+            max_new_tokens=modelkwargs.get("max_new_tokens", 256),
+            sampling_params={k: modelkwargs[k] for k in SAMPLING_KWARGS if k in modelkwargs},
+            seed=vllm_kwargs.get("seed"),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "model_server"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"base_url": self.base_url, "model": self.model, "max_new_tokens": self.max_new_tokens}
+
+    def _complete(self, prompts: List[str], stop: Optional[List[str]]) -> dict:
+        body = {
+            "model": self.model,
+            "prompt": prompts,
+            "max_tokens": self.max_new_tokens,
+            **self.sampling_params,
+        }
+        if stop:
+            body["stop"] = stop
+        if self.seed is not None:
+            body["seed"] = self.seed
+        request = urllib.request.Request(
+            f"{self.base_url}/v1/completions",
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        for attempt in range(MAX_RETRIES):
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.load(response)
+            except urllib.error.HTTPError as e:
+                if e.code < 500 or attempt == MAX_RETRIES - 1:
+                    raise RuntimeError(f"Model server error {e.code}: {e.read().decode(errors='replace')}") from e
+            except (urllib.error.URLError, OSError):
+                if attempt == MAX_RETRIES - 1:
+                    raise
+            time.sleep(2 ** attempt)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        n = self.sampling_params.get("n", 1)
+        batches = [prompts[i:i + self.batch_size] for i in range(0, len(prompts), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.num_concurrent) as executor:
+            responses = list(executor.map(lambda batch: self._complete(batch, stop), batches))
+
+        generations: List[List[Generation]] = []
+        completion_tokens = 0
+        for batch, response in zip(batches, responses):
+            choices = sorted(response["choices"], key=lambda c: c["index"])
+            for i in range(len(batch)):
+                generations.append([
+                    Generation(text=c["text"], generation_info={"finish_reason": c.get("finish_reason")})
+                    for c in choices[i * n:(i + 1) * n]
+                ])
+            completion_tokens += (response.get("usage") or {}).get("completion_tokens", 0)
+        return LLMResult(generations=generations, llm_output={"token_usage": {"completion_tokens": completion_tokens}})
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval serve", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("action", choices=["start", "health"])
+    parser.add_argument("--model_args", default="", help="lm-eval model_args of the model (pretrained=...,revision=...)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="Port of the server (default: a free port)")
+    parser.add_argument("--server_command", default=None, help="Command of a stand-in server ({host}, {port}, {model})")
+    parser.add_argument("--base_url", default=None, help=f"Server to check (default: ${SERVER_ENV})")
+    parser.add_argument("--poll_interval", type=float, default=POLL_INTERVAL, help="Interval of load polls (s)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+
+    if args.action == "health":
+        base_url = args.base_url or os.environ.get(SERVER_ENV)
+        if not base_url:
+            raise ValueError(f"No server specified (--base_url or ${SERVER_ENV})")
+        healthy = health(base_url)
+        print(json.dumps({"base_url": base_url, "healthy": healthy, "load": load(base_url)}, indent=2))
+        sys.exit(0 if healthy else 1)
+
+    server = ModelServer.for_model(
+        parse_model_args(args.model_args),
+        server_command=args.server_command,
+        host=args.host,
+        port=args.port,
+        poll_interval=args.poll_interval,
+    )
+    with server:
+        print(server.base_url, flush=True)
+        try:
+            server.process.wait()
+        except KeyboardInterrupt:
+            pass
+    logging.info(f"Model server load: {server.load_report()}")
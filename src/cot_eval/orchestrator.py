@@ -0,0 +1,221 @@
+"""Dependency graph of pipeline stages with resource requirements
+
+A pipeline is a list of `Stage`s, each with the names of the stages it
+depends on and the resources (GPUs, host memory) it needs while running.
+`Orchestrator.run` starts every stage as soon as its dependencies have
+finished and its resources are free, so independent stages (e.g., the orig
+evaluation and trace generation, or CoT evaluation of one config and trace
+generation of another) run side by side on a multi-GPU node.
+
+Stages run in threads; GPU stages typically run a subprocess (see
+`command_stage`) with `CUDA_VISIBLE_DEVICES` set to the GPUs assigned.
+Stages recorded as finished in the run manifest are skipped, and finished
+stages are recorded, so a failed pipeline resumes where it stopped. After
+a failure no new stages are started; running stages are waited for.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from cot_eval.run_manifest import RunManifest
+from cot_eval.timeline import span
+
+
+@dataclass
+class Resources:
+    """Resources a stage holds while running"""
+
+    gpus: int = 0
+    memory_gb: float = 0.0
+
+
+@dataclass
+class StageContext:
+    """What a running stage gets to know about its placement"""
+
+    name: str
+    gpu_ids: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Stage:
+    """A unit of the pipeline"""
+
+    name: str
+    run: Callable[[StageContext], None]
+    deps: List[str] = field(default_factory=list)
+    resources: Resources = field(default_factory=Resources)
+
+
+class ResourcePool:
+    """GPUs and host memory of a node
+
+    GPU ids handed out are the node's visible devices, i.e., entries of
+    `CUDA_VISIBLE_DEVICES` if that is set.
+    """
+
+    def __init__(self, num_gpus: int, memory_gb: float, visible_devices: Optional[List[str]] = None):
+        if visible_devices is None:
+            visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+            visible_devices = visible.split(",") if visible else [str(i) for i in range(num_gpus)]
+        self.num_gpus = num_gpus
+        self.memory_gb = memory_gb
+        self.free_gpus = visible_devices[:num_gpus]
+        self.free_memory_gb = memory_gb
+        self._lock = threading.Lock()
+
+    def fits(self, resources: Resources) -> bool:
+        """Whether the resources can be granted at all on this node"""
+        return resources.gpus <= self.num_gpus and resources.memory_gb <= self.memory_gb
+
+    def try_acquire(self, resources: Resources) -> Optional[List[str]]:
+        """GPU ids granted, None if the resources are not free right now"""
+        with self._lock:
+            if resources.gpus > len(self.free_gpus) or resources.memory_gb > self.free_memory_gb:
+                return None
+            gpu_ids, self.free_gpus = self.free_gpus[:resources.gpus], self.free_gpus[resources.gpus:]
+            self.free_memory_gb -= resources.memory_gb
+            return gpu_ids
+
+    def release(self, gpu_ids: List[str], resources: Resources):
+        with self._lock:
+            self.free_gpus = self.free_gpus + gpu_ids
+            self.free_memory_gb += resources.memory_gb
+
+
+def topological_order(stages: List[Stage]) -> List[Stage]:
+    """Stages in dependency order, ties broken by list order; raises on unknown deps and cycles"""
+    by_name = {s.name: s for s in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("Stage names must be unique")
+    for s in stages:
+        unknown = [d for d in s.deps if d not in by_name]
+        if unknown:
+            raise ValueError(f"Stage {s.name} depends on unknown stages {unknown}")
+    ordered: List[Stage] = []
+    placed = set()
+    while len(ordered) < len(stages):
+        ready = [s for s in stages if s.name not in placed and all(d in placed for d in s.deps)]
+        if not ready:
+            cyclic = [s.name for s in stages if s.name not in placed]
+            raise ValueError(f"Dependency cycle among stages {cyclic}")
+        ordered.extend(ready)
+        placed.update(s.name for s in ready)
+    return ordered
+
+
+class Orchestrator:
+    """Runs a stage graph, in parallel as far as dependencies and resources allow"""
+
+    def __init__(self, stages: List[Stage], pool: ResourcePool, manifest: Optional[RunManifest] = None):
+        self.stages = topological_order(stages)
+        self.pool = pool
+        self.manifest = manifest
+        too_big = [s.name for s in self.stages if not pool.fits(s.resources)]
+        if too_big:
+            raise ValueError(f"Stages {too_big} need more resources than the node has")
+
+    def run(self) -> Dict[str, str]:
+        """Run all stages
+
+        Returns:
+            Dict[str, str]: status of each stage (finished, skipped)
+
+        Raises:
+            RuntimeError: if a stage failed (after running stages have finished)
+        """
+        status: Dict[str, str] = {}
+        for stage in self.stages:
+            if self.manifest is not None and self.manifest.is_done(stage.name):
+                logging.info(f"Skipping {stage.name} (finished according to run manifest)")
+                status[stage.name] = "skipped"
+        pending = [s for s in self.stages if s.name not in status]
+        running: Dict[Future, tuple] = {}
+        failed: List[str] = []
+
+        with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as executor:
+            while pending or running:
+                if not failed:
+                    for stage in list(pending):
+                        if not all(status.get(d) in ("finished", "skipped") for d in stage.deps):
+                            continue
+                        gpu_ids = self.pool.try_acquire(stage.resources)
+                        if gpu_ids is None:
+                            continue  # later stages may still fit (backfill)
+                        pending.remove(stage)
+                        logging.info(f"Starting {stage.name}" + (f" on GPUs {gpu_ids}" if gpu_ids else ""))
+                        future = executor.submit(self._run_stage, stage, StageContext(stage.name, gpu_ids))
+                        running[future] = (stage, gpu_ids)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, gpu_ids = running.pop(future)
+                    self.pool.release(gpu_ids, stage.resources)
+                    try:
+                        future.result()
+                        status[stage.name] = "finished"
+                        logging.info(f"Finished {stage.name}")
+                    except Exception as e:
+                        status[stage.name] = "failed"
+                        failed.append(stage.name)
+                        logging.error(f"Stage {stage.name} failed: {e}")
+
+        if failed:
+            not_started = [s.name for s in pending]
+            raise RuntimeError(f"Stages {failed} failed, not started: {not_started}")
+        return status
+
+    def _run_stage(self, stage: Stage, context: StageContext):
+        with span(stage.name, kind="stage", gpu_ids=context.gpu_ids):
+            stage.run(context)
+        if self.manifest is not None:
+            self.manifest.mark_done(stage.name)
+
+
+def command_stage(
+    name: str,
+    command: List[str],
+    deps: Optional[List[str]] = None,
+    resources: Optional[Resources] = None,
+    log_dir: Optional[str] = None,
+) -> Stage:
+    """Stage that runs a command, on the GPUs assigned to it
+
+    Output goes to `<log_dir>/<name>.log` if `log_dir` is given (parallel
+    stages would interleave their output otherwise).
+    """
+
+    def run(context: StageContext):
+        env = dict(os.environ)
+        if context.gpu_ids:
+            env["CUDA_VISIBLE_DEVICES"] = ",".join(context.gpu_ids)
+        if log_dir is None:
+            subprocess.run(command, env=env, check=True)
+            return
+        os.makedirs(log_dir, exist_ok=True)
+        log_path = os.path.join(log_dir, f"{name}.log")
+        with open(log_path, "w") as log:
+            process = subprocess.run(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if process.returncode != 0:
+            with open(log_path) as log:
+                tail = log.readlines()[-20:]
+            raise RuntimeError(f"{command[0]} exited with {process.returncode}, see {log_path}:\n{''.join(tail)}")
+
+    return Stage(name=name, run=run, deps=deps or [], resources=resources or Resources())
+
+
+def fake_stage(stage: Stage, duration: float) -> Stage:
+    """Stage with the name, deps and resources of `stage` that sleeps instead of running (dry runs, tests)"""
+
+    def run(context: StageContext):
+        logging.info(f"[fake] {context.name} on GPUs {context.gpu_ids}")
+        time.sleep(duration)
+
+    return Stage(name=stage.name, run=run, deps=stage.deps, resources=stage.resources)
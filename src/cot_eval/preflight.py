@@ -0,0 +1,284 @@
+"""Preflight checks and cost estimate of a cot-eval run
+
+usage:
+cot-eval preflight --configs_dir ./cot-eval-cache/cot_eval_configs --configs config1,config2 \
+    [--upload_dataset cot-leaderboard/cot-eval-traces-2.0] [--tokenizer model] [--output preflight.json]
+
+Reads the configs created by `scripts/create_cot_configs.py` and, before any
+model is loaded:
+
+* checks that chains and tasks are registered, that a model revision is set,
+  that model (at revision) and traces repo are reachable on the Hub, and that
+  the longest rendered prompt fits the model length (if there is no room
+  for `max_new_tokens` after it, vLLM caps generation, which is logged as
+  a warning);
+* tokenizes the rendered prompts of all tasks and predicts prompt and
+  generated token volume, wall time and GPU hours from the throughput
+  calibration per model size (`configs/throughput_calibration.yaml`).
+
+All problems found are reported at once, and the command fails if there
+are any.
+"""
+
+import argparse
+import dataclasses
+import glob
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+from huggingface_hub import HfApi, hf_hub_download
+
+from cot_eval.COTEvalConfig import COTEvalConfig
+from cot_eval.chain_registry import CHAIN_REGISTRY
+from cot_eval.preprocessing import load_and_preprocess
+from cot_eval.tasks_registry import TASKS_REGISTRY
+
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(__file__), "configs", "throughput_calibration.yaml")
+# keys of model config.json that hold the maximum sequence length
+MAX_LENGTH_KEYS = ["max_position_embeddings", "n_positions", "max_seq_len", "seq_length"]
+DEFAULT_MAX_NEW_TOKENS = 256  # langchain VLLM default
+ANSWER_SHUFFLE_SEED = 42  # token counts do not depend on the order of options
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval preflight", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--configs_dir", required=True, help="Dir with cot-eval configs")
+    parser.add_argument("--configs", default=None, help="Comma-separated config names (default: all configs in dir)")
+    parser.add_argument("--upload_dataset", default=None, help="Traces repo to check for reachability")
+    parser.add_argument("--hftoken", default=None, help="HF Token to use")
+    parser.add_argument(
+        "--tokenizer", choices=["whitespace", "model"], default="model",
+        help="Count tokens with the model's tokenizer (requires transformers) or by whitespace splitting",
+    )
+    parser.add_argument("--params", type=float, default=None, help="Model size (B params), read from Hub if not set")
+    parser.add_argument("--calibration_file", default=CALIBRATION_FILE, help="Throughput calibration yaml file")
+    parser.add_argument("--offline", action="store_true", help="Skip Hub checks (requires --params)")
+    parser.add_argument("--output", default=None, help="Write estimates and problems to this json file")
+    return parser.parse_args(argv)
+
+
+@dataclass
+class TaskEstimate:
+    """Token volume and predicted generation time of one config on one task"""
+
+    config: str
+    task: str
+    n: int
+    prompt_tokens: int
+    max_prompt_tokens: int
+    sequences_per_prompt: int
+    generated_tokens_max: int
+    generated_tokens_expected: float
+    generation_s: float = 0.0
+
+
+def load_calibration(path: str) -> dict:
+    with open(path) as fp:
+        calibration = yaml.safe_load(fp)
+    calibration["buckets"] = sorted(calibration["buckets"], key=lambda b: b["max_params"])
+    return calibration
+
+
+def throughput_for(calibration: dict, params: float) -> dict:
+    """Calibration bucket of the smallest size class that holds a model with `params` B parameters"""
+    for bucket in calibration["buckets"]:
+        if params <= bucket["max_params"]:
+            return bucket
+    return calibration["buckets"][-1]
+
+
+def model_metadata(api: HfApi, model: str, revision: str, token: Optional[str]) -> Tuple[Optional[float], Optional[int]]:
+    """Model size (B params) and maximum sequence length, from the Hub; raises if model or revision are unreachable"""
+    info = api.model_info(model, revision=revision)
+    params = info.safetensors.total / 1e9 if info.safetensors is not None else None
+    with open(hf_hub_download(model, "config.json", revision=revision, token=token)) as fp:
+        model_config = json.load(fp)
+    max_length = next((model_config[k] for k in MAX_LENGTH_KEYS if isinstance(model_config.get(k), int)), None)
+    return params, max_length
+
+
+def token_counter(tokenizer: str, model: str, revision: Optional[str]) -> Callable[[List[str]], np.ndarray]:
+    if tokenizer == "whitespace":
+        return lambda texts: np.array([len(t.split()) for t in texts], dtype=np.int64)
+    from transformers import AutoTokenizer  # optional dependency
+    tok = AutoTokenizer.from_pretrained(model, revision=revision, trust_remote_code=True)
+    return lambda texts: np.array([len(ids) for ids in tok(list(texts))["input_ids"]], dtype=np.int64)
+
+
+def sequences_per_prompt(modelkwargs: dict) -> int:
+    """Number of sequences vLLM decodes per prompt (beams or samples)"""
+    return max(int(modelkwargs.get("n") or 1), int(modelkwargs.get("best_of") or 1))
+
+
+def check_config(config: COTEvalConfig) -> List[str]:
+    """Problems with a config that can be detected without any download"""
+    problems = []
+    if config.cot_chain not in CHAIN_REGISTRY:
+        problems.append(f"{config.name}: unknown chain {config.cot_chain}. Registered chains: {list(CHAIN_REGISTRY)}")
+    unknown_tasks = [t for t in config.tasks if t not in TASKS_REGISTRY]
+    if unknown_tasks:
+        problems.append(f"{config.name}: unknown tasks {unknown_tasks}. Registered tasks: {list(TASKS_REGISTRY)}")
+    if not (config.modelkwargs or {}).get("vllm_kwargs", {}).get("revision"):
+        problems.append(f"{config.name}: no model revision set in modelkwargs.vllm_kwargs")
+    return problems
+
+
+def preflight(
+    configs: List[COTEvalConfig],
+    calibration: dict,
+    tokenizer: str = "model",
+    upload_dataset: Optional[str] = None,
+    params: Optional[float] = None,
+    offline: bool = False,
+    token: Optional[str] = None,
+) -> Tuple[List[str], pd.DataFrame, dict]:
+    """Check configs and estimate token volume, wall time and GPU hours
+
+    Returns:
+        Tuple[List[str], pd.DataFrame, dict]: problems found, estimates per config and task, totals
+    """
+    problems = [p for config in configs for p in check_config(config)]
+    if problems:
+        # don't download anything for a broken run
+        return problems, pd.DataFrame(), {}
+
+    models = {(c.model, c.modelkwargs["vllm_kwargs"]["revision"]) for c in configs}
+    if len(models) != 1:
+        problems.append(f"Configs refer to several models/revisions: {sorted(models)}")
+        return problems, pd.DataFrame(), {}
+    model, revision = models.pop()
+
+    max_length = None
+    if not offline:
+        api = HfApi(token=token)
+        try:
+            hub_params, max_length = model_metadata(api, model, revision, token)
+            params = params or hub_params
+        except Exception as e:
+            problems.append(f"Model {model} at revision {revision} not reachable: {e}")
+        if upload_dataset is not None:
+            try:
+                api.dataset_info(upload_dataset)
+            except Exception as e:
+                problems.append(f"Traces repo {upload_dataset} not reachable: {e}")
+    if params is None:
+        problems.append(f"Size of {model} unknown (no safetensors metadata on Hub). Pass --params.")
+    if problems:
+        return problems, pd.DataFrame(), {}
+
+    bucket = throughput_for(calibration, params)
+    count_tokens = token_counter(tokenizer, model, revision)
+    task_data = {}
+    prompt_tokens: Dict[Tuple[str, bool, str], np.ndarray] = {}  # cache, as configs share chains and tasks
+    estimates: List[TaskEstimate] = []
+
+    for config in configs:
+        modelkwargs = config.modelkwargs or {}
+        max_new_tokens = int(modelkwargs.get("max_new_tokens") or DEFAULT_MAX_NEW_TOKENS)
+        max_model_len = modelkwargs["vllm_kwargs"].get("max_model_len") or max_length
+        sequences = sequences_per_prompt(modelkwargs)
+        for task in config.tasks:
+            key = (config.cot_chain, bool(config.final_answer), task)
+            if key not in prompt_tokens:
+                if task not in task_data:
+                    task_data[task] = load_and_preprocess(task, token=token, answer_shuffle_seed=ANSWER_SHUFFLE_SEED)
+                ds = task_data[task]
+                template = CHAIN_REGISTRY[config.cot_chain].get_prompt_template(bool(config.final_answer))
+                prompts = [
+                    template.format(passage=passage, question_options=question_options)
+                    for passage, question_options in zip(ds["passage"], ds["question_options"])
+                ]
+                prompt_tokens[key] = count_tokens(prompts)
+            n_tokens = prompt_tokens[key]
+            estimate = TaskEstimate(
+                config=config.name,
+                task=task,
+                n=len(n_tokens),
+                prompt_tokens=int(n_tokens.sum()),
+                max_prompt_tokens=int(n_tokens.max()) if len(n_tokens) else 0,
+                sequences_per_prompt=sequences,
+                generated_tokens_max=len(n_tokens) * sequences * max_new_tokens,
+                generated_tokens_expected=len(n_tokens) * sequences * max_new_tokens * calibration["generation_fraction"],
+            )
+            estimate.generation_s = (
+                estimate.prompt_tokens / bucket["prompt_tokens_per_s"]
+                + estimate.generated_tokens_expected / bucket["generated_tokens_per_s"]
+            )
+            estimates.append(estimate)
+            if max_model_len is not None and estimate.max_prompt_tokens >= max_model_len:
+                problems.append(
+                    f"{config.name}/{task}: longest prompt ({estimate.max_prompt_tokens} tokens) "
+                    f"leaves no room for generation within model length {max_model_len}"
+                )
+            elif max_model_len is not None and estimate.max_prompt_tokens + max_new_tokens > max_model_len:
+                logging.warning(
+                    f"{config.name}/{task}: longest prompt ({estimate.max_prompt_tokens} tokens) plus "
+                    f"max_new_tokens ({max_new_tokens}) exceeds model length {max_model_len}, "
+                    f"generation is capped at {max_model_len - estimate.max_prompt_tokens} tokens for it"
+                )
+
+    df = pd.DataFrame([dataclasses.asdict(e) for e in estimates])
+    tensor_parallel_size = max(int((c.modelkwargs or {}).get("tensor_parallel_size") or 1) for c in configs)
+    wall_s = float(df["generation_s"].sum()) + len(configs) * bucket["model_load_s"]
+    totals = {
+        "model": model,
+        "revision": revision,
+        "params": params,
+        "hardware": calibration.get("hardware"),
+        "configs": len(configs),
+        "prompt_tokens": int(df["prompt_tokens"].sum()),
+        "generated_tokens_max": int(df["generated_tokens_max"].sum()),
+        "generated_tokens_expected": float(df["generated_tokens_expected"].sum()),
+        "wall_hours": wall_s / 3600,
+        "gpu_hours": wall_s / 3600 * tensor_parallel_size,
+    }
+    return problems, df, totals
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.offline and args.params is None:
+        raise ValueError("--offline requires --params")
+
+    if args.configs:
+        paths = [os.path.join(args.configs_dir, f"{name}.yaml") for name in args.configs.split(",")]
+    else:
+        paths = sorted(p for p in glob.glob(f"{args.configs_dir}/*.yaml") if os.path.basename(p) != "template.yaml")
+    configs = [COTEvalConfig.from_yaml(path) for path in paths]
+    logging.info(f"Preflight of {len(configs)} configs in {args.configs_dir}")
+
+    problems, estimates, totals = preflight(
+        configs,
+        load_calibration(args.calibration_file),
+        tokenizer=args.tokenizer,
+        upload_dataset=args.upload_dataset,
+        params=args.params,
+        offline=args.offline,
+        token=args.hftoken or os.environ.get("HUGGINGFACEHUB_API_TOKEN"),
+    )
+
+    if not estimates.empty:
+        with pd.option_context("display.max_rows", None, "display.width", 200, "display.precision", 1):
+            print(estimates.to_string(index=False))
+        logging.info(
+            f"Predicted for {totals['model']} ({totals['params']:.1f}B params) on {totals['hardware']}: "
+            f"{totals['prompt_tokens']} prompt tokens, {totals['generated_tokens_expected']:.0f} generated tokens "
+            f"(at most {totals['generated_tokens_max']}), {totals['wall_hours']:.2f}h wall time, "
+            f"{totals['gpu_hours']:.2f} GPU hours"
+        )
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump({"problems": problems, "totals": totals, "estimates": estimates.to_dict(orient="records")}, fp, indent=2)
+        logging.info(f"Wrote preflight report to {args.output}")
+
+    for problem in problems:
+        logging.error(f"Preflight: {problem}")
+    if problems:
+        raise ValueError(f"Preflight failed with {len(problems)} problems")
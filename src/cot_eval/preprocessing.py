@@ -0,0 +1,126 @@
+"""Loading and preprocessing of task datasets"""
+
+import logging
+import random
+from typing import Callable, Dict, List
+
+from datasets import Dataset, interleave_datasets
+
+from cot_eval.tasks_mirror import load_task
+
+
+EXAMPLE_ID_COLUMN = "example_id"  # row index in the task's test split, stable across slices and harness runs
+PERMUTATION_COLUMN = "permutation_id"
+SEED_COLUMN = "answer_shuffle_seed"
+PREFIX_BLOCK_SIZE = 16  # tokens per KV cache block, prefixes are cached in full blocks (vLLM)
+
+
+def preprocess(ds: Dataset, answer_shuffle_seed: int) -> Dataset:
+    """Permutate the answer options and format question and options
+
+    Examples get their row index in the task dataset as column
+    `example_id`, which identifies them in traces and harness sample logs
+    (harness doc ids are row indices of the evaluated, possibly sliced,
+    dataset).
+    """
+
+    def permutate_options(example):
+        """Permutate the options in the example"""
+        gold_option = example["options"][example["answer"]]
+        options = example["options"]
+        random.Random(answer_shuffle_seed).shuffle(options)
+        example["options"] = options
+        example["labels"] = ["ABCDEF"[i] for i in range(len(options))]
+        example["answer"] = options.index(gold_option)
+        return example
+
+    def format_mcq(example):
+        """Format the question and options"""
+        question = example["question"]
+        options_block = "\n".join([
+            f"{label}) {option}" 
+            for label, option
+            in zip(example["labels"], example["options"])
+        ])
+        example["question_options"] = f"{question}\n{options_block}"
+        return example
+
+    if EXAMPLE_ID_COLUMN not in ds.column_names:
+        ds = ds.add_column(EXAMPLE_ID_COLUMN, list(range(len(ds))))
+    ds = ds.map(permutate_options, load_from_cache_file=False)
+    ds = ds.map(format_mcq, load_from_cache_file=False)
+    return ds
+
+
+def load_and_preprocess(task: str, token: str, answer_shuffle_seed: int) -> Dataset:
+    """Load and preprocess the task dataset"""
+    ds = load_task(task, token=token)
+    logging.info(f"Loaded {task} dataset with {len(ds)} examples")
+    ds = preprocess(ds, answer_shuffle_seed)
+    logging.info(f"Permutated options and formatted MC-Question-Block for {task} dataset")
+    return ds
+
+
+def load_and_preprocess_permutations(task: str, token: str, answer_shuffle_seeds: List[int]) -> Dataset:
+    """Load the task dataset and expand each example into one row per answer permutation
+
+    The permutations of an example are adjacent rows (example 0 with all
+    seeds, then example 1, ...), so they are scheduled together and share the
+    cached prefill of their prompt prefix (instructions and passage).
+    Columns `permutation_id` (index of seed) and `answer_shuffle_seed` tell
+    the permutations apart.
+    """
+    ds = load_task(task, token=token)
+    logging.info(f"Loaded {task} dataset with {len(ds)} examples")
+    permutations = []
+    for permutation_id, seed in enumerate(answer_shuffle_seeds):
+        permuted = preprocess(ds, seed)
+        permuted = permuted.add_column(PERMUTATION_COLUMN, [permutation_id] * len(permuted))
+        permuted = permuted.add_column(SEED_COLUMN, [seed] * len(permuted))
+        permutations.append(permuted)
+    ds = interleave_datasets(permutations)
+    logging.info(f"Expanded {task} dataset into {len(ds)} rows ({len(answer_shuffle_seeds)} answer permutations)")
+    return ds
+
+
+def split_permutations(ds: Dataset) -> Dict[int, Dataset]:
+    """Rows of each permutation, keyed by permutation id (single key 0 without permutation column)"""
+    if PERMUTATION_COLUMN not in ds.column_names:
+        return {0: ds}
+    ids = ds[PERMUTATION_COLUMN]
+    return {
+        permutation_id: ds.select([i for i, p in enumerate(ids) if p == permutation_id])
+        for permutation_id in sorted(set(ids))
+    }
+
+
+def prefill_reuse(ds: Dataset, prompt_template: str, count_tokens: Callable[[List[str]], List[int]]) -> dict:
+    """Prompt tokens whose prefill can be served from the prefix cache
+
+    Prompts with the same prefix (everything before the question, i.e.
+    instructions and passage) share the prefix's KV cache blocks. Compares
+    the permutations generated together with one run per permutation (where
+    only questions on the same passage share prefixes).
+    """
+    head = prompt_template[:prompt_template.index("{question_options}")]
+    prefixes = [head.replace("{passage}", passage) for passage in ds["passage"]]
+    prompts = [prefix + question_options for prefix, question_options in zip(prefixes, ds["question_options"])]
+    num_permutations = len(set(ds[PERMUTATION_COLUMN])) if PERMUTATION_COLUMN in ds.column_names else 1
+
+    unique_prefixes = sorted(set(prefixes))
+    prefix_tokens = dict(zip(unique_prefixes, count_tokens(unique_prefixes)))
+    counts: Dict[str, int] = {}
+    for prefix in prefixes:
+        counts[prefix] = counts.get(prefix, 0) + 1
+
+    cached = {prefix: n // PREFIX_BLOCK_SIZE * PREFIX_BLOCK_SIZE for prefix, n in prefix_tokens.items()}
+    total = int(sum(count_tokens(prompts)))
+    reused = sum((counts[p] - 1) * cached[p] for p in counts)
+    # separate runs: each run reuses prefixes among its own rows only
+    reused_separate = sum((counts[p] - num_permutations) * cached[p] for p in counts)
+    return {
+        "prompt_tokens": total,
+        "reused_tokens": int(reused),
+        "reused_tokens_separate_runs": int(reused_separate),
+        "reuse": reused / total if total else 0.0,
+    }
@@ -0,0 +1,279 @@
+"""Lease-based claiming of evaluation requests
+
+Several workers may drain the requests queue in parallel. A worker claims
+a request by committing a `RUNNING` status together with a lease (worker
+id and expiry) to the request file. Every such commit is a compare-and-set:
+it is created with `parent_commit` set to the repo head the worker has
+read, so the hub rejects it if anybody committed in between. The worker
+then re-syncs and retries.
+
+Leases are renewed by a heartbeat while the job runs. A `RUNNING` request
+whose lease has expired (e.g. because its worker crashed) is claimable
+again. `RUNNING` requests without a lease (set by workers before leases
+were introduced) count as expired `LEGACY_RUNNING_GRACE` after their
+submission time.
+
+Every claim increments the request's `attempts`. A request whose pipeline
+keeps failing (its lease expires without a final status) is set to
+`FAILED` once `max_attempts` claims have been used up, instead of being
+reclaimed forever.
+
+The protocol is tested against an in-memory hub stand-in that enforces
+`parent_commit`, with workers racing in threads (tests/test_request_leases.py).
+"""
+
+import copy
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from huggingface_hub import CommitOperationAdd
+from huggingface_hub.utils import HfHubHTTPError
+
+from cot_eval.requests_queue import EvalRequest, RequestsQueueIndex
+
+
+LEASE_TTL = 15 * 60  # seconds
+LEGACY_RUNNING_GRACE = 7 * 24 * 60 * 60  # seconds after submission
+MAX_ATTEMPTS = 3
+MAX_CAS_ATTEMPTS = 10
+CAS_BACKOFF = 2.0  # seconds, upper bound of random backoff after conflicts
+CAS_CONFLICT_STATUS_CODES = (409, 412)
+
+
+class LeaseConflict(Exception):
+    """Raised if a request cannot be claimed or its lease is held by another worker"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_time(timestamp: str) -> datetime:
+    parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def lease_expired(data: dict, now: Optional[datetime] = None) -> bool:
+    """Whether the lease has expired; without lease, whether the legacy grace period has passed"""
+    now = _now() if now is None else now
+    lease = data.get("lease")
+    if not lease:
+        try:
+            submitted = _parse_time(data["submitted_time"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return submitted + timedelta(seconds=LEGACY_RUNNING_GRACE) <= now
+    return _parse_time(lease["expires_at"]) <= now
+
+
+def is_claimable(data: dict, now: Optional[datetime] = None) -> bool:
+    """Pending requests and running requests with expired lease can be claimed"""
+    if data.get("status") == "PENDING":
+        return True
+    return data.get("status") == "RUNNING" and lease_expired(data, now)
+
+
+def claimable_requests(index: RequestsQueueIndex, max_params: Optional[float] = None) -> List[EvalRequest]:
+    """Claimable requests of the (synced) index, in claim order (oldest submission first)"""
+    candidates = index.get_eval_requests(["PENDING", "RUNNING"], max_params=max_params)
+    return [
+        r for r in candidates
+        if is_claimable(index.files[os.path.relpath(r.json_filepath, index.local_dir)]["data"])
+    ]
+
+
+class RequestClaimer:
+    """Claims, renews and releases request leases with compare-and-set commits
+
+    Args:
+        index: requests queue index, its `api` must support `create_commit`
+        worker_id: unique id of this worker
+        ttl: lease duration in seconds
+        max_attempts: number of claims of a request before it is set to FAILED
+    """
+
+    def __init__(
+        self,
+        index: RequestsQueueIndex,
+        worker_id: Optional[str] = None,
+        ttl: float = LEASE_TTL,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.index = index
+        self.worker_id = default_worker_id() if worker_id is None else worker_id
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+
+    def _lease(self, claimed_at: Optional[str] = None) -> dict:
+        now = _now()
+        return {
+            "worker_id": self.worker_id,
+            "claimed_at": claimed_at or now.isoformat(),
+            "expires_at": (now + timedelta(seconds=self.ttl)).isoformat(),
+        }
+
+    def _compare_and_set(self, path_in_repo: str, update: Callable[[dict], dict], commit_message: str) -> dict:
+        """Apply `update` to the request file, committing on top of the head that was read
+
+        `update` receives a copy of the current request data and returns the
+        new data, or raises LeaseConflict if the update is not applicable.
+        """
+        for attempt in range(MAX_CAS_ATTEMPTS):
+            self.index.sync()
+            if path_in_repo not in self.index.files:
+                raise LeaseConflict(f"Request {path_in_repo} does not exist.")
+            data = update(copy.deepcopy(self.index.files[path_in_repo]["data"]))
+            try:
+                self.index.api.create_commit(
+                    repo_id=self.index.repo_id,
+                    operations=[
+                        CommitOperationAdd(
+                            path_in_repo=path_in_repo,
+                            path_or_fileobj=json.dumps(data, indent=4).encode("utf-8"),
+                        )
+                    ],
+                    commit_message=commit_message,
+                    parent_commit=self.index.sha,
+                    repo_type="dataset",
+                )
+            except HfHubHTTPError as e:
+                status_code = getattr(e.response, "status_code", None)
+                if status_code not in CAS_CONFLICT_STATUS_CODES:
+                    raise
+                logging.info(f"Concurrent commit on {self.index.repo_id} (attempt {attempt + 1}). Retrying.")
+                time.sleep(random.uniform(0, CAS_BACKOFF))
+                continue
+
+            with open(os.path.join(self.index.local_dir, path_in_repo), "w") as fp:
+                json.dump(data, fp, indent=4)
+            return data
+
+        raise LeaseConflict(f"Could not update {path_in_repo} after {MAX_CAS_ATTEMPTS} attempts.")
+
+    def claim(self, max_params: Optional[float] = None, model_id: Optional[str] = None) -> Optional[EvalRequest]:
+        """Claim the oldest claimable request (optionally for a given model)
+
+        Returns:
+            Optional[EvalRequest]: the claimed request, None if nothing could be claimed
+        """
+        self.index.sync()
+        candidates = [
+            r for r in claimable_requests(self.index, max_params=max_params)
+            if model_id is None or r.model == model_id
+        ]
+
+        def update(data: dict) -> dict:
+            if not is_claimable(data) or data.get("attempts", 0) >= self.max_attempts:
+                raise LeaseConflict(f"Request for {data.get('model')} has been claimed by another worker.")
+            if data.get("status") == "RUNNING":
+                holder = (data.get("lease") or {}).get("worker_id", "legacy worker")
+                logging.info(f"Reclaiming {data.get('model')}: lease of {holder} expired.")
+            data["status"] = "RUNNING"
+            data["lease"] = self._lease()
+            data["attempts"] = data.get("attempts", 0) + 1
+            return data
+
+        def give_up(data: dict) -> dict:
+            if not is_claimable(data) or data.get("attempts", 0) < self.max_attempts:
+                raise LeaseConflict(f"Request for {data.get('model')} has been claimed by another worker.")
+            data["status"] = "FAILED"
+            data.pop("lease", None)
+            return data
+
+        for eval_request in candidates:
+            try:
+                if eval_request.attempts >= self.max_attempts:
+                    self._compare_and_set(
+                        self.path_in_repo(eval_request), give_up, f"Update status to FAILED ({eval_request.attempts} attempts)"
+                    )
+                    logging.warning(f"Set {eval_request.model} to FAILED after {eval_request.attempts} attempts.")
+                    continue
+                self._compare_and_set(
+                    self.path_in_repo(eval_request), update, f"Update status to RUNNING ({self.worker_id})"
+                )
+            except LeaseConflict as e:
+                logging.info(str(e))
+                continue
+            logging.info(f"Claimed {eval_request.model} as {self.worker_id}.")
+            return self.request(eval_request)
+
+        return None
+
+    def renew(self, eval_request: EvalRequest) -> EvalRequest:
+        """Extend the lease held by this worker"""
+        def update(data: dict) -> dict:
+            self._check_holder(data)
+            data["lease"] = self._lease(claimed_at=data["lease"]["claimed_at"])
+            return data
+
+        self._compare_and_set(self.path_in_repo(eval_request), update, f"Renew lease ({self.worker_id})")
+        return self.request(eval_request)
+
+    def release(self, eval_request: EvalRequest, set_to_status: str) -> EvalRequest:
+        """Set final status and drop the lease held by this worker"""
+        def update(data: dict) -> dict:
+            self._check_holder(data)
+            data["status"] = set_to_status
+            data.pop("lease", None)
+            return data
+
+        self._compare_and_set(self.path_in_repo(eval_request), update, f"Update status to {set_to_status}")
+        return self.request(eval_request)
+
+    def _check_holder(self, data: dict):
+        lease = data.get("lease") or {}
+        if data.get("status") != "RUNNING" or lease.get("worker_id") != self.worker_id:
+            raise LeaseConflict(f"Lease for {data.get('model')} is not held by {self.worker_id}.")
+
+    def path_in_repo(self, eval_request: EvalRequest) -> str:
+        return os.path.relpath(eval_request.json_filepath, self.index.local_dir)
+
+    def request(self, eval_request: EvalRequest) -> EvalRequest:
+        """Re-read a request from the local request file"""
+        with open(eval_request.json_filepath) as fp:
+            data = json.load(fp)
+        return EvalRequest(**{**data, "json_filepath": eval_request.json_filepath})
+
+
+class LeaseHeartbeat(threading.Thread):
+    """Background thread that renews a lease until stopped
+
+    `lost` is set if the lease could not be renewed, e.g. because it
+    expired and was reclaimed by another worker.
+    """
+
+    def __init__(self, claimer: RequestClaimer, eval_request: EvalRequest, interval: Optional[float] = None):
+        super().__init__(daemon=True)
+        self.claimer = claimer
+        self.eval_request = eval_request
+        self.interval = claimer.ttl / 3 if interval is None else interval
+        self.lost = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.eval_request = self.claimer.renew(self.eval_request)
+                logging.debug(f"Renewed lease for {self.eval_request.model}.")
+            except LeaseConflict as e:
+                logging.error(f"Lost lease for {self.eval_request.model}: {e}")
+                self.lost.set()
+                return
+            except Exception as e:
+                # transient hub errors: keep trying until the lease expires
+                logging.warning(f"Failed to renew lease for {self.eval_request.model}: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
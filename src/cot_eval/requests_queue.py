@@ -0,0 +1,149 @@
+"""Local index of the evaluation requests queue
+
+The requests repo (`cot-leaderboard/cot-leaderboard-requests`) holds one JSON
+file per evaluation request. Instead of downloading and parsing the whole
+repo on every lookup, the index persists the parsed requests together with
+the repo commit SHA and the blob id of every file. A sync fetches the
+current SHA, and -- only if it changed -- lists the repo tree and downloads
+those request files whose blob id differs from the indexed one.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from huggingface_hub import HfApi
+
+
+INDEX_FILENAME = ".queue_index.json"
+MAX_WORKERS_DOWNLOAD = 16
+
+
+@dataclass
+class EvalRequest:
+    model: str
+    status: str
+    json_filepath: str
+    private: bool = False
+    weight_type: str = "Original"
+    model_type: str = ""  # pretrained, finetuned, with RL
+    precision: str = ""  # float16, bfloat16
+    base_model: Optional[str] = None # for adapter models
+    revision: str = "main" # commit
+    submitted_time: Optional[str] = "2022-05-18T11:40:22.519222"  # random date just so that we can still order requests by date
+    model_type: Optional[str] = None
+    likes: Optional[int] = 0
+    params: Optional[int] = None
+    license: Optional[str] = ""
+    lease: Optional[dict] = None  # worker_id, claimed_at, expires_at; see request_leases.py
+    attempts: int = 0  # number of claims; see request_leases.py
+
+    def get_model_args(self):
+        model_args = f"pretrained={self.model},revision={self.revision}"
+
+        if self.precision in ["float16", "bfloat16", "float32"]:
+            model_args += f",dtype={self.precision}"
+            pass
+        else:
+            raise Exception(f"Unknown precision {self.precision}.")
+
+        return model_args
+
+
+class RequestsQueueIndex:
+    """Persistent, incrementally synced index of eval requests
+
+    Args:
+        repo_id: requests dataset repo
+        local_dir: local mirror of request files, also holds the index file
+        api: HfApi client (or a stand-in implementing `repo_info`,
+            `list_repo_tree` and `hf_hub_download`)
+    """
+
+    def __init__(self, repo_id: str, local_dir: str, api: HfApi):
+        self.repo_id = repo_id
+        self.local_dir = local_dir
+        self.api = api
+        self.index_path = os.path.join(local_dir, INDEX_FILENAME)
+        self.sha: Optional[str] = None
+        self.files: Dict[str, dict] = {}  # path_in_repo -> {"blob_id": ..., "data": ...}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path) as fp:
+                index = json.load(fp)
+            if index.get("repo_id") == repo_id:
+                self.sha = index.get("sha")
+                self.files = index.get("files", {})
+
+    def _download(self, path_in_repo: str, revision: str) -> dict:
+        local_path = self.api.hf_hub_download(
+            repo_id=self.repo_id,
+            filename=path_in_repo,
+            revision=revision,
+            repo_type="dataset",
+            local_dir=self.local_dir,
+        )
+        with open(local_path) as fp:
+            return json.load(fp)
+
+    def sync(self) -> int:
+        """Bring the index up to date with the head of the requests repo
+
+        Returns:
+            int: Number of request files downloaded
+        """
+        sha = self.api.repo_info(repo_id=self.repo_id, repo_type="dataset").sha
+        if sha == self.sha:
+            logging.info(f"Requests queue index is up to date ({sha}).")
+            return 0
+
+        remote = {
+            entry.path: entry.blob_id
+            for entry in self.api.list_repo_tree(
+                repo_id=self.repo_id, revision=sha, repo_type="dataset", recursive=True
+            )
+            if entry.path.endswith(".json") and hasattr(entry, "blob_id")
+        }
+        changed = [
+            path for path, blob_id in remote.items()
+            if path not in self.files or self.files[path]["blob_id"] != blob_id
+            or not os.path.isfile(os.path.join(self.local_dir, path))
+        ]
+        removed = [path for path in self.files if path not in remote]
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS_DOWNLOAD) as executor:
+            downloaded = dict(zip(changed, executor.map(lambda p: self._download(p, sha), changed)))
+
+        for path in removed:
+            self.files.pop(path)
+            local_path = os.path.join(self.local_dir, path)
+            if os.path.isfile(local_path):
+                os.remove(local_path)
+        for path, data in downloaded.items():
+            self.files[path] = {"blob_id": remote[path], "data": data}
+        self.sha = sha
+        self.save()
+
+        logging.info(f"Synced requests queue index to {sha}: {len(changed)} changed, {len(removed)} removed.")
+        return len(changed)
+
+    def save(self):
+        os.makedirs(self.local_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump({"repo_id": self.repo_id, "sha": self.sha, "files": self.files}, fp)
+        os.replace(tmp_path, self.index_path)
+
+    def get_eval_requests(self, job_status: list, max_params: Optional[float] = None) -> List[EvalRequest]:
+        """Query indexed requests by status (and max_params), oldest submission first"""
+        eval_requests = []
+        for path, entry in self.files.items():
+            data = entry["data"]
+            if data.get("status", "") not in job_status:
+                continue
+            if max_params is not None and not (data.get("params") and data["params"] <= max_params):
+                continue
+            eval_requests.append(EvalRequest(**{**data, "json_filepath": os.path.join(self.local_dir, path)}))
+        return sorted(eval_requests, key=lambda x: x.submitted_time)
@@ -0,0 +1,238 @@
+"""Columnar warehouse of normalized lm-eval-harness results
+
+Every numeric metric of every results JSON is stored as one row
+(model, revision, precision, config, task, subtype, metric, value, source)
+in a single parquet file. The warehouse is updated incrementally: only
+results JSONs that are new or changed since the last update are parsed.
+Leaderboard records for all models are then computed in one vectorized pass.
+"""
+
+import glob
+import json
+import logging
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+try:
+    import ijson  # streaming JSON parser, optional
+except ImportError:  # no cov
+    ijson = None
+
+
+SUBTYPES = ["orig", "base", "cot"]
+ACC_METRIC = "acc"
+SOURCES_METADATA_KEY = b"cot_eval.sources"
+
+SCHEMA = pa.schema([
+    ("model", pa.string()),
+    ("revision", pa.string()),
+    ("precision", pa.string()),
+    ("config", pa.string()),
+    ("task", pa.string()),
+    ("subtype", pa.string()),
+    ("metric", pa.string()),
+    ("value", pa.float64()),
+    ("source", pa.string()),
+])
+
+
+def parse_result_key(key: str) -> Tuple[str, str, str]:
+    """Split a harness task key into (config, task, subtype)
+
+    Keys have the form `<config>_<task>_<subtype>` (see
+    `scripts/create_lm_eval_harness_tasks.py`), except for the original
+    logikon-bench tasks, which are named `<task>_base` and have no config.
+    """
+    parts = key.rsplit("_", 2)
+    if len(parts) == 3:
+        return parts[0], parts[1], parts[2]
+    if len(parts) == 2:
+        return "", parts[0], "orig"
+    return "", key, ""
+
+
+def parse_model_args(model_args) -> Dict[str, str]:
+    """Parse lm-eval model_args, given either as dict or as `k1=v1,k2=v2` string"""
+    if isinstance(model_args, dict):
+        return {k: str(v) for k, v in model_args.items()}
+    if not model_args:
+        return {}
+    return dict(
+        item.split("=", 1) for item in str(model_args).split(",") if "=" in item
+    )
+
+
+def _iter_results_json(json_filepath: str) -> Tuple[Iterator[Tuple[str, dict]], dict]:
+    """Return (results items, model_args) of a results JSON, streaming if ijson is available"""
+    if ijson is None:
+        with open(json_filepath) as fp:
+            data = json.load(fp)
+        model_args = data.get("config", {}).get("model_args", {})
+        return iter(data.get("results", {}).items()), parse_model_args(model_args)
+
+    with open(json_filepath, "rb") as fp:
+        model_args = next(ijson.items(fp, "config.model_args", use_float=True), {})
+
+    def results_items():
+        with open(json_filepath, "rb") as fp:
+            yield from ijson.kvitems(fp, "results", use_float=True)
+
+    return results_items(), parse_model_args(model_args)
+
+
+def result_rows(json_filepath: str, model: str, source: str) -> List[tuple]:
+    """Normalize one results JSON into warehouse rows"""
+    results, model_args = _iter_results_json(json_filepath)
+    revision = model_args.get("revision", "")
+    precision = model_args.get("dtype", "")
+    rows = []
+    for key, record in results:
+        config, task, subtype = parse_result_key(key)
+        for metric_key, value in record.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric = metric_key.split(",", 1)[0]
+            rows.append((model, revision, precision, config, task, subtype, metric, float(value), source))
+    return rows
+
+
+def _model_from_path(path_in_dataset: str) -> Optional[str]:
+    """Extract model id from `data/<org>/<model>/<subtype>/...` paths"""
+    parts = path_in_dataset.split("/")
+    for i, part in enumerate(parts):
+        if part in SUBTYPES and i >= 2 and parts[0] == "data":
+            return "/".join(parts[1:i])
+    return None
+
+
+class ResultsWarehouse:
+    """Local parquet store of normalized results rows"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.table = SCHEMA.empty_table()
+        self.sources: Dict[str, List[float]] = {}
+        if path is not None and os.path.isfile(path):
+            self.table = pq.read_table(path)
+            metadata = self.table.schema.metadata or {}
+            self.sources = json.loads(metadata.get(SOURCES_METADATA_KEY, b"{}"))
+
+    def update(self, local_dir_results_dataset: str) -> int:
+        """Ingest new or changed results JSONs from a local copy of the results dataset
+
+        Returns:
+            int: Number of parsed files
+        """
+        result_files = glob.glob(f"{local_dir_results_dataset}/data/**/results*.json", recursive=True)
+        current = {}
+        for json_filepath in result_files:
+            source = os.path.relpath(json_filepath, local_dir_results_dataset)
+            stat = os.stat(json_filepath)
+            current[source] = (json_filepath, [stat.st_mtime, stat.st_size])
+
+        changed = [s for s, (_, sig) in current.items() if self.sources.get(s) != sig]
+        removed = [s for s in self.sources if s not in current]
+        if not changed and not removed:
+            return 0
+
+        rows = []
+        for source in changed:
+            model = _model_from_path(source)
+            if model is None:
+                logging.debug(f"Cannot infer model from {source}. Skipping.")
+                continue
+            rows.extend(result_rows(current[source][0], model, source))
+
+        stale = pa.array(changed + removed, type=pa.string())
+        keep = pc.invert(pc.is_in(self.table["source"], value_set=stale))
+        new_table = pa.Table.from_pylist(
+            [dict(zip(SCHEMA.names, row)) for row in rows], schema=SCHEMA
+        )
+        self.table = pa.concat_tables([self.table.filter(keep).select(SCHEMA.names).cast(SCHEMA), new_table])
+
+        for source in removed:
+            self.sources.pop(source)
+        for source in changed:
+            self.sources[source] = current[source][1]
+        logging.info(f"Ingested {len(changed)} results files ({len(rows)} rows), dropped {len(removed)}.")
+        return len(changed)
+
+    def save(self):
+        """Write warehouse to disk"""
+        if self.path is None:
+            raise ValueError("Cannot save in-memory warehouse")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        table = self.table.replace_schema_metadata({SOURCES_METADATA_KEY: json.dumps(self.sources)})
+        pq.write_table(table, self.path)
+
+    def to_pandas(self) -> pd.DataFrame:
+        return self.table.to_pandas()
+
+
+def leaderboard_records(
+        results: pd.DataFrame,
+        tasks: list,
+        precision: Optional[Dict[str, str]] = None,
+        revision: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, dict]:
+    """Aggregate normalized results rows into leaderboard records for all models at once
+
+    For every cot record, the delta is taken w.r.t. the base record of the
+    same model and task (the base record need not share the cot config,
+    see `scripts/create_lm_eval_harness_tasks.py`). Per model and task,
+    the maximum delta over all configs is reported.
+
+    Args:
+        results: warehouse rows
+        tasks: tasks that have to be present in each record
+        precision: optional override of model dtype per model
+        revision: optional override of model revision per model
+
+    Returns:
+        Dict[str, dict]: leaderboard record per model
+    """
+    acc = results[(results["metric"] == ACC_METRIC) & results["task"].isin(tasks)]
+    base = (
+        acc[acc["subtype"] == "base"]
+        .groupby(["model", "task"], as_index=False)["value"].first()
+        .rename(columns={"value": "acc_base"})
+    )
+    cot = acc[acc["subtype"] == "cot"][["model", "task", "config", "value"]].rename(columns={"value": "acc_cot"})
+    merged = cot.merge(base, on=["model", "task"], how="left")
+    missing = merged[merged["acc_base"].isna()]
+    for row in missing.itertuples():
+        logging.warning(f"Could not find corresponding base record for {row.config}_{row.task}_cot ({row.model}). Skipping.")
+    merged = merged.dropna(subset=["acc_base"])
+    merged["delta_abs"] = merged["acc_cot"] - merged["acc_base"]
+    merged["delta_rel"] = merged["delta_abs"] / merged["acc_base"]
+    deltas = merged.groupby(["model", "task"])[["delta_abs", "delta_rel"]].max()
+
+    meta = results.groupby("model")[["revision", "precision"]].first()
+
+    records = {}
+    for model, model_deltas in deltas.groupby(level="model"):
+        model_deltas = model_deltas.droplevel("model")
+        missing_tasks = [t for t in tasks if t not in model_deltas.index]
+        if missing_tasks:
+            logging.warning(f"No cot results for model {model} on tasks {missing_tasks}. Skipping model.")
+            continue
+        records[model] = {
+            "config": {
+                "model_dtype": (precision or {}).get(model, meta.loc[model, "precision"]),
+                "model_sha": (revision or {}).get(model, meta.loc[model, "revision"]),
+                "model_name": model,
+            },
+            "results": {
+                task: {
+                    "delta_abs": float(model_deltas.loc[task, "delta_abs"]),
+                    "delta_rel": float(model_deltas.loc[task, "delta_rel"]),
+                }
+                for task in tasks
+            },
+        }
+    return records
@@ -0,0 +1,190 @@
+"""Persistent run manifest for resuming failed pipeline runs
+
+usage (from run.sh):
+python -m cot_eval.run_manifest start --model $model --revision $revision --inputs "$CHAINS|$TASKS|..."
+python -m cot_eval.run_manifest done --model $model --revision $revision --unit base_eval  # exit code 0 if done
+python -m cot_eval.run_manifest mark --model $model --revision $revision --unit base_eval [--artifact key=value]
+python -m cot_eval.run_manifest get --model $model --revision $revision --key timestamp
+python -m cot_eval.run_manifest set --model $model --revision $revision --key timestamp --value 24-03-01-12:00:00
+python -m cot_eval.run_manifest finish --model $model --revision $revision
+
+The manifest of a model and revision (`$COTEVAL_CACHE_DIR/manifests/<model>@<revision>.json`)
+records which units of work (pipeline stages, configs, tasks) have finished,
+together with their artifacts, and values that must be stable across a
+resumed run (config names, timestamp of harness outputs). A rerun after a
+failure skips finished units and picks up at the first incomplete one,
+instead of creating new configs and regenerating traces under new names.
+
+A manifest is started afresh if the previous run finished, or if the run
+inputs (chains, model kwargs, tasks, ...) changed.
+"""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import List, Optional
+
+
+MANIFEST_ENV = "COTEVAL_RUN_MANIFEST"
+MANIFESTS_DIR = "manifests"
+
+
+def manifest_path(model: str, revision: str, cache_dir: Optional[str] = None) -> str:
+    cache_dir = cache_dir or os.environ.get("COTEVAL_CACHE_DIR") or "./cot-eval-cache"
+    filename = f"{model.replace('/', '__')}@{revision}.json"
+    return os.path.join(cache_dir, MANIFESTS_DIR, filename)
+
+
+def inputs_fingerprint(inputs: str) -> str:
+    return hashlib.sha256(inputs.encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    """Finished units and stable values of a pipeline run, persisted as json file
+
+    Every update is a locked read-modify-write followed by an atomic
+    replace of the file, so concurrent writers (e.g., `run.sh` and
+    `cot-eval`) do not lose updates and readers never see partial files.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def for_model(cls, model: str, revision: str, cache_dir: Optional[str] = None) -> "RunManifest":
+        return cls(manifest_path(model, revision, cache_dir))
+
+    @classmethod
+    def from_env(cls) -> Optional["RunManifest"]:
+        """Manifest of the current run, as set by run.sh, None if not set"""
+        path = os.environ.get(MANIFEST_ENV)
+        return cls(path) if path else None
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as fp:
+            return json.load(fp)
+
+    def _write(self, data: dict):
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as fp:
+            json.dump(data, fp, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @contextlib.contextmanager
+    def _update(self):
+        with self._locked():
+            data = self._read()
+            yield data
+            self._write(data)
+
+    def read(self) -> dict:
+        return self._read()
+
+    def start(self, model: str, revision: str, inputs: str) -> bool:
+        """Start or resume a run
+
+        Returns:
+            bool: whether an unfinished run with the same inputs is resumed
+        """
+        fingerprint = inputs_fingerprint(inputs)
+        with self._update() as data:
+            resume = bool(data) and data.get("status") != "finished" and data.get("inputs") == fingerprint
+            if data and not resume:
+                # keep the manifest of the previous run for reference
+                os.replace(self.path, f"{self.path}.{data.get('created', 0):.0f}")
+            if not resume:
+                data.clear()
+                data.update({
+                    "model": model,
+                    "revision": revision,
+                    "inputs": fingerprint,
+                    "created": time.time(),
+                    "status": "running",
+                    "values": {},
+                    "units": {},
+                })
+        return resume
+
+    def is_done(self, unit: str) -> bool:
+        return unit in self._read().get("units", {})
+
+    def mark_done(self, unit: str, **artifacts):
+        with self._update() as data:
+            data.setdefault("units", {})[unit] = {"finished": time.time(), "artifacts": artifacts}
+
+    def get(self, key: str) -> Optional[str]:
+        return self._read().get("values", {}).get(key)
+
+    def set(self, key: str, value: str):
+        with self._update() as data:
+            data.setdefault("values", {})[key] = value
+
+    def finish(self):
+        with self._update() as data:
+            data["status"] = "finished"
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval manifest", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("action", choices=["start", "done", "mark", "get", "set", "finish", "show"])
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--revision", required=True)
+    parser.add_argument("--inputs", default="", help="Run inputs, a changed value starts a new run (start)")
+    parser.add_argument("--unit", default=None, help="Unit of work (done, mark)")
+    parser.add_argument("--artifact", action="append", default=[], help="Artifact of unit as key=value (mark)")
+    parser.add_argument("--key", default=None, help="Key of value (get, set)")
+    parser.add_argument("--value", default=None, help="Value (set)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    manifest = RunManifest.for_model(args.model, args.revision)
+
+    if args.action == "start":
+        resume = manifest.start(args.model, args.revision, args.inputs)
+        if resume:
+            done = list(manifest.read()["units"])
+            logging.info(f"Resuming run of {args.model}@{args.revision}, finished units: {done}")
+        else:
+            logging.info(f"Starting new run of {args.model}@{args.revision}")
+        print(manifest.path)
+    elif args.action == "done":
+        if args.unit is None:
+            raise ValueError("--unit must be specified")
+        sys.exit(0 if manifest.is_done(args.unit) else 1)
+    elif args.action == "mark":
+        if args.unit is None:
+            raise ValueError("--unit must be specified")
+        manifest.mark_done(args.unit, **dict(a.split("=", 1) for a in args.artifact))
+    elif args.action == "get":
+        print(manifest.get(args.key) or "")
+    elif args.action == "set":
+        manifest.set(args.key, args.value)
+    elif args.action == "finish":
+        manifest.finish()
+    elif args.action == "show":
+        print(json.dumps(manifest.read(), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,108 @@
+"""Capacity-aware placement of queued models on the GPUs of a node
+
+The planner estimates each request's GPU memory footprint from `params`
+(in billions) and `precision`, picks the smallest tensor parallel size
+that fits, and packs several requests onto one node so that they can be
+evaluated side by side.
+
+Fairness: requests are placed in order of submission. A request that could
+run on this node, but not on the GPUs that are still free, blocks all
+younger requests (no overtaking). Requests that can never run on this node
+(too large) are skipped and left to bigger nodes.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from cot_eval.requests_queue import EvalRequest
+
+
+BYTES_PER_PARAM = {
+    "float32": 4.0,
+    "float16": 2.0,
+    "bfloat16": 2.0,
+    "8bit": 1.0,
+    "4bit": 0.5,
+}
+DEFAULT_BYTES_PER_PARAM = 2.0
+KV_CACHE_OVERHEAD = 0.3  # fraction of weight memory reserved for kv cache and activations
+FIXED_OVERHEAD_GB = 2.0  # cuda context, graphs, etc. per GPU
+TENSOR_PARALLEL_SIZES = [1, 2, 4, 8]
+
+
+@dataclass
+class GpuInventory:
+    """GPUs available on a node"""
+
+    num_gpus: int
+    """Number of GPUs"""
+    memory_gb: float
+    """Memory per GPU (GB)"""
+    gpu_memory_utilization: float = 0.9
+    """Fraction of GPU memory vLLM may use"""
+
+    @property
+    def usable_memory_gb(self) -> float:
+        return self.memory_gb * self.gpu_memory_utilization
+
+
+@dataclass
+class Job:
+    """A request placed on a set of GPUs"""
+
+    eval_request: EvalRequest
+    tensor_parallel_size: int
+    gpu_ids: List[int] = field(default_factory=list)
+    memory_gb: float = 0.0
+
+
+def estimate_memory_gb(params: Optional[float], precision: str) -> Optional[float]:
+    """Estimate total GPU memory (GB) needed to serve a model with `params` billion parameters"""
+    if not params:
+        return None
+    weights_gb = params * BYTES_PER_PARAM.get(precision, DEFAULT_BYTES_PER_PARAM)
+    return weights_gb * (1 + KV_CACHE_OVERHEAD)
+
+
+def tensor_parallel_size_for(memory_gb: float, inventory: GpuInventory) -> Optional[int]:
+    """Smallest tensor parallel size such that the per-GPU share fits, None if no size fits"""
+    for tp in TENSOR_PARALLEL_SIZES:
+        if tp > inventory.num_gpus:
+            break
+        if memory_gb / tp + FIXED_OVERHEAD_GB <= inventory.usable_memory_gb:
+            return tp
+    return None
+
+
+def plan_jobs(eval_requests: List[EvalRequest], inventory: GpuInventory, max_jobs: Optional[int] = None) -> List[Job]:
+    """Pack queued requests onto the GPUs of a node
+
+    Args:
+        eval_requests: claimable requests
+        inventory: GPUs of this node
+        max_jobs: maximum number of jobs to place
+
+    Returns:
+        List[Job]: placed jobs with disjoint GPU ids
+    """
+    free_gpus = list(range(inventory.num_gpus))
+    jobs: List[Job] = []
+    for eval_request in sorted(eval_requests, key=lambda x: x.submitted_time):
+        if max_jobs is not None and len(jobs) >= max_jobs:
+            break
+        memory_gb = estimate_memory_gb(eval_request.params, eval_request.precision)
+        if memory_gb is None:
+            logging.info(f"No params for {eval_request.model}. Skipping.")
+            continue
+        tp = tensor_parallel_size_for(memory_gb, inventory)
+        if tp is None:
+            logging.info(f"{eval_request.model} ({memory_gb:.0f}GB) does not fit on this node. Skipping.")
+            continue
+        if tp > len(free_gpus):
+            # oldest request that fits this node waits for GPUs: don't let younger requests overtake it
+            logging.info(f"{eval_request.model} needs {tp} GPUs, {len(free_gpus)} free. Stop packing.")
+            break
+        gpu_ids, free_gpus = free_gpus[:tp], free_gpus[tp:]
+        jobs.append(Job(eval_request=eval_request, tensor_parallel_size=tp, gpu_ids=gpu_ids, memory_gb=memory_gb))
+    return jobs
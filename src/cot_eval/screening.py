@@ -0,0 +1,349 @@
+"""Screening mode: CoT effectiveness on stratified subsets, grown in rounds
+
+Instead of generating traces and evaluating on the full test split of every
+task, screening evaluates base and CoT accuracy on stratified subsets of
+each task, and grows a task's subset in rounds (`first_round` examples,
+then `growth` times more per round) only as long as the result is unclear.
+After every round, the paired bootstrap CI of the leaderboard statistic
+on all examples screened so far decides per task. The statistic,
+`delta_abs`, is the maximum over configs of the accuracy delta over base
+(see bootstrap.py), not the delta of a fixed config; its CI accounts for
+the selection of the best config in every resample.
+
+- `no_gain`: the CI's upper bound is at most `min_gain` (CoT clearly
+  does not help)
+- `tight`: the CI's half width is at most `max_halfwidth`
+- `full`: the whole test split has been screened
+
+Looking at the CI after every round and stopping as soon as it decides is
+optional stopping: with a CI at level 1 - alpha in every round, the
+chance that some round's CI misses the true delta exceeds alpha. The
+error rate is spent across rounds instead (Bonferroni): every round's CI
+is at level 1 - alpha / K, where K is the number of rounds planned until
+every task is fully screened, so the decisions of all rounds jointly hold
+at level 1 - alpha. The correction is recorded in the summary settings
+and the leaderboard record's `screening` flag.
+
+Subsets are prefixes of a per-task order that interleaves the answer
+labels, so every subset is stratified by gold answer position, and a
+round's slice extends the previous subsets. Rounds are planned here and
+run by `scripts/run_pipeline.py --screening` (traces of round k are
+uploaded as `<config>-<task>-screen<k>.parquet`). The summary
+(`screening.json`: accuracies, deltas, CIs, decisions, GPU hours spent
+and saved vs. full evaluation) is flagged in the leaderboard record by
+`scripts/upload_results.py --screening_file`.
+"""
+
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cot_eval.bootstrap import ALPHA, N_RESAMPLES, SEED, paired_bootstrap
+
+SCREENING_DIR = "screening"
+SUMMARY_FILE = "screening.json"
+FIRST_ROUND = 100
+GROWTH = 2.0
+MAX_HALFWIDTH = 0.05
+MIN_GAIN = 0.0
+
+
+def screening_dir(output_dir: str, model: str, timestamp: str) -> str:
+    """Dir of screening state, round plans and harness outputs of a run"""
+    return os.path.join(output_dir, model, SCREENING_DIR, timestamp)
+
+
+def round_suffix(k: int) -> str:
+    """Suffix of trace files, stage names and manifest units of screening round k"""
+    return f"-screen{k}"
+
+
+def stratified_order(labels: Sequence, seed: int = SEED) -> List[int]:
+    """Order of examples whose every prefix is stratified by label
+
+    Examples are shuffled within their stratum and spread evenly over the
+    order (the j-th of n examples of a stratum at position (j + 0.5) / n).
+    """
+    rng = random.Random(seed)
+    strata: Dict = defaultdict(list)
+    for i, label in enumerate(labels):
+        strata[label].append(i)
+    keyed = []
+    for label, indices in strata.items():
+        rng.shuffle(indices)
+        offset = rng.random() * 1e-6  # break ties between strata of equal size at random
+        keyed.extend(((j + 0.5) / len(indices) + offset, i) for j, i in enumerate(indices))
+    return [i for _, i in sorted(keyed)]
+
+
+def select_screening_slice(ds, start: int, end: int, seed: int = SEED):
+    """Rows [start, end) of the stratified order of a preprocessed task dataset"""
+    order = stratified_order(ds["answer"], seed)
+    return ds.select(order[start:end])
+
+
+def decide(ci: List[float], max_halfwidth: float = MAX_HALFWIDTH, min_gain: float = MIN_GAIN) -> Optional[str]:
+    """Stopping decision for a delta CI, None to continue screening"""
+    if ci[1] <= min_gain:
+        return "no_gain"
+    if (ci[1] - ci[0]) / 2 <= max_halfwidth:
+        return "tight"
+    return None
+
+
+class Screening:
+    """State of a screening run: rounds planned, correctness per example, decisions per task
+
+    Correctness of base and cot runs is pooled across rounds under keys
+    `<round>:<id>`, where ids are the example ids of harness samples (see
+    `bootstrap.sample_id`), so base and cot are paired on the same examples
+    even if a run's samples are ordered differently. Traces without example
+    ids fall back to doc ids, which restart in every round's slice.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        task_sizes: Dict[str, int],
+        first_round: int = FIRST_ROUND,
+        growth: float = GROWTH,
+        max_halfwidth: float = MAX_HALFWIDTH,
+        min_gain: float = MIN_GAIN,
+        alpha: float = ALPHA,
+        seed: int = SEED,
+    ):
+        self.path = path
+        self.task_sizes = task_sizes
+        self.first_round = first_round
+        self.growth = growth
+        self.max_halfwidth = max_halfwidth
+        self.min_gain = min_gain
+        self.alpha = alpha
+        self.seed = seed
+        self.rounds: List[dict] = []
+        self.screened: Dict[str, int] = {task: 0 for task in task_sizes}
+        self.decisions: Dict[str, Optional[str]] = {task: None for task in task_sizes}
+        self.correctness: Dict[str, Dict[str, Dict[str, float]]] = {task: {} for task in task_sizes}
+        self.gpu_seconds = 0.0
+
+    @classmethod
+    def load_or_create(cls, path: str, task_sizes: Dict[str, int], **kwargs) -> "Screening":
+        """Resume the screening state at path (e.g., after a failed round), or start a new one"""
+        screening = cls(path, task_sizes, **kwargs)
+        if os.path.isfile(path):
+            with open(path) as fp:
+                state = json.load(fp)
+            screening.rounds = state["rounds"]
+            screening.screened = state["screened"]
+            screening.decisions = state["decisions"]
+            screening.correctness = state["correctness"]
+            screening.gpu_seconds = state["gpu_seconds"]
+            logging.info(f"Resuming screening after {len(screening.rounds)} rounds: {screening.decisions}")
+        return screening
+
+    @property
+    def done(self) -> bool:
+        return all(decision is not None for decision in self.decisions.values())
+
+    @property
+    def planned_rounds(self) -> int:
+        """Rounds until every task is fully screened, if no task is decided earlier"""
+        largest = max(self.task_sizes.values(), default=0)
+        screened, rounds = 0, 0
+        while screened < largest:
+            screened = min(max(int(round(self.first_round * self.growth ** rounds)), screened + 1), largest)
+            rounds += 1
+        return max(rounds, 1)
+
+    @property
+    def alpha_per_round(self) -> float:
+        """Alpha of every round's CI, spending `alpha` over the planned rounds"""
+        return self.alpha / self.planned_rounds
+
+    def next_round(self) -> dict:
+        """Plan the next round: slice [start, end) of the stratified order per undecided task"""
+        k = len(self.rounds)
+        target = int(round(self.first_round * self.growth ** k))
+        slices = {
+            task: [self.screened[task], min(max(target, self.screened[task] + 1), self.task_sizes[task])]
+            for task, decision in self.decisions.items()
+            if decision is None
+        }
+        return {"round": k, "seed": self.seed, "slices": slices}
+
+    def update(self, plan: dict, correctness: Dict[str, Dict[str, Dict[int, float]]], gpu_seconds: float):
+        """Add the correctness of a round (per task: base and cot configs, per doc id) and decide"""
+        k = plan["round"]
+        for task, (start, end) in plan["slices"].items():
+            for run, docs in correctness.get(task, {}).items():
+                pooled = self.correctness[task].setdefault(run, {})
+                pooled.update({f"{k}:{doc_id}": value for doc_id, value in docs.items()})
+            self.screened[task] = end
+        self.gpu_seconds += gpu_seconds
+        stats = self.task_stats()
+        for task in plan["slices"]:
+            if task not in stats:
+                raise RuntimeError(f"No sample logs of base and cot runs for {task} in screening round {k}")
+            self.decisions[task] = decide(stats[task]["delta_abs_ci"], self.max_halfwidth, self.min_gain)
+            if self.decisions[task] is None and self.screened[task] >= self.task_sizes[task]:
+                self.decisions[task] = "full"
+        self.rounds.append({**plan, "gpu_seconds": gpu_seconds, "decisions": dict(self.decisions)})
+        logging.info(
+            f"Screening round {k}: "
+            + ", ".join(
+                f"{task} n={self.screened[task]} delta {stats[task]['delta_abs']:+.3f} "
+                f"CI [{stats[task]['delta_abs_ci'][0]:+.3f}, {stats[task]['delta_abs_ci'][1]:+.3f}] "
+                f"-> {self.decisions[task] or 'continue'}"
+                for task in plan["slices"] if task in stats
+            )
+        )
+
+    def task_stats(self) -> Dict[str, dict]:
+        """Pooled accuracies, best config's delta and its paired bootstrap CI (at level 1 - alpha_per_round) per task"""
+        rng = np.random.default_rng(self.seed)
+        stats = {}
+        for task, runs in self.correctness.items():
+            base = runs.get("base")
+            configs = sorted(k for k in runs if k != "base")
+            if not base or not configs:
+                continue
+            doc_ids = sorted(set(base).intersection(*(runs[c] for c in configs)))
+            if not doc_ids:
+                continue
+            base_arr = np.array([base[i] for i in doc_ids])
+            cot_arr = np.array([[runs[c][i] for i in doc_ids] for c in configs])
+            acc_base = float(base_arr.mean())
+            acc_cot = {c: float(a) for c, a in zip(configs, cot_arr.mean(axis=1))}
+            delta_abs = max(acc_cot.values()) - acc_base
+            stats[task] = {
+                "n": len(doc_ids),
+                "acc_base": acc_base,
+                "acc_cot": acc_cot,
+                "delta_abs": delta_abs,
+                "delta_rel": delta_abs / acc_base if acc_base else None,  # json has no nan
+                **paired_bootstrap(base_arr, cot_arr, n_resamples=N_RESAMPLES, alpha=self.alpha_per_round, rng=rng),
+            }
+        return stats
+
+    def gpu_cost_model(self) -> Tuple[float, float, str]:
+        """Fixed GPU seconds per round, GPU seconds per example, and how they were estimated
+
+        Every round pays fixed costs (model loading or server startup,
+        harness setup) on top of the GPU time per example. With rounds of
+        at least two sizes, a least-squares line through the rounds'
+        examples and GPU seconds separates the two (`linear_fit`).
+        Otherwise, or if the fit is degenerate, all GPU time is attributed
+        to examples (`proportional`), which overestimates the cost of full
+        evaluation, and hence the GPU hours saved, by the fixed costs of
+        the rounds.
+        """
+        sizes = [sum(end - start for start, end in r["slices"].values()) for r in self.rounds]
+        seconds = [r["gpu_seconds"] for r in self.rounds]
+        if len(set(sizes)) >= 2:
+            per_example, fixed = np.polyfit(sizes, seconds, 1)
+            if per_example > 0 and fixed >= 0:
+                return float(fixed), float(per_example), "linear_fit"
+        screened = sum(sizes)
+        return 0.0, sum(seconds) / screened if screened else 0.0, "proportional"
+
+    def summary(self) -> dict:
+        """Results per task and GPU hours spent vs. an estimate for full evaluation
+
+        Full evaluation runs once on all test examples: it pays the fixed
+        costs of a round once, and the GPU time per example of screening
+        for every example (see `gpu_cost_model`).
+        """
+        screened = sum(self.screened.values())
+        total = sum(self.task_sizes.values())
+        gpu_hours = self.gpu_seconds / 3600
+        fixed_seconds, example_seconds, estimate_method = self.gpu_cost_model()
+        gpu_hours_full = (fixed_seconds + example_seconds * total) / 3600 if screened else 0.0
+        return {
+            "tasks": {
+                task: {
+                    **stats,
+                    "n_total": self.task_sizes[task],
+                    "decision": self.decisions[task],
+                }
+                for task, stats in self.task_stats().items()
+            },
+            "rounds": len(self.rounds),
+            "examples_screened": screened,
+            "examples_total": total,
+            "gpu_hours": gpu_hours,
+            "gpu_hours_full_estimate": gpu_hours_full,
+            "gpu_hours_full_estimate_method": estimate_method,
+            "gpu_fixed_seconds_per_round": fixed_seconds,
+            "gpu_seconds_per_example": example_seconds,
+            "gpu_hours_saved": gpu_hours_full - gpu_hours,
+            "settings": {
+                "first_round": self.first_round,
+                "growth": self.growth,
+                "max_halfwidth": self.max_halfwidth,
+                "min_gain": self.min_gain,
+                "alpha": self.alpha,
+                "alpha_spending": "bonferroni",
+                "planned_rounds": self.planned_rounds,
+                "alpha_per_round": self.alpha_per_round,
+                "seed": self.seed,
+            },
+        }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        state = {
+            "rounds": self.rounds,
+            "screened": self.screened,
+            "decisions": self.decisions,
+            "correctness": self.correctness,
+            "gpu_seconds": self.gpu_seconds,
+            "summary": self.summary(),
+            "time": time.time(),
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(state, fp, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def screening_record(summary: dict, model: str, revision: str, precision: str, tasks: List[str]) -> dict:
+    """Leaderboard record from a screening summary, flagged with the screening metadata"""
+    missing = [t for t in tasks if t not in summary["tasks"]]
+    if missing:
+        raise ValueError(f"No screening results for model {model} on tasks {missing}.")
+    return {
+        "config": {
+            "model_dtype": precision,
+            "model_sha": revision,
+            "model_name": model,
+        },
+        "results": {
+            task: {
+                "delta_abs": summary["tasks"][task]["delta_abs"],
+                "delta_rel": summary["tasks"][task]["delta_rel"],
+                "delta_abs_ci": summary["tasks"][task]["delta_abs_ci"],
+                "delta_rel_ci": summary["tasks"][task]["delta_rel_ci"],
+            }
+            for task in tasks
+        },
+        "screening": {
+            "screened": True,
+            "statistic": "max_over_configs",
+            "alpha": summary["settings"]["alpha"],
+            "alpha_spending": summary["settings"]["alpha_spending"],
+            "alpha_per_round": summary["settings"]["alpha_per_round"],
+            "n": {task: summary["tasks"][task]["n"] for task in tasks},
+            "n_total": {task: summary["tasks"][task]["n_total"] for task in tasks},
+            "decision": {task: summary["tasks"][task]["decision"] for task in tasks},
+            "gpu_hours": summary["gpu_hours"],
+            "gpu_hours_full_estimate": summary["gpu_hours_full_estimate"],
+            "gpu_hours_full_estimate_method": summary["gpu_hours_full_estimate_method"],
+            "gpu_hours_saved": summary["gpu_hours_saved"],
+        },
+    }
@@ -0,0 +1,192 @@
+"""Local mirror of the registered tasks
+
+usage:
+cot-eval mirror --mirror_dir ./cot-eval-cache/tasks [--tasks logiqa,lsat-ar] [--hftoken ...] [--force] [--verify]
+
+Each task in `TASKS_REGISTRY` is stored as an uncompressed Arrow file
+(`<task>.arrow`), next to a `manifest.json` that records the task's
+registry entry, row count and the sha256 content hash of the file.
+`load_task` resolves a task to its mirrored file if the mirror holds it for
+the same registry entry, and falls back to the Hub otherwise. Mirrored
+tasks are memory-mapped: loading is instant, needs no network access, and
+concurrent cot-eval processes share the pages of the OS page cache.
+
+The mirror dir defaults to the env var `COTEVAL_TASKS_MIRROR`.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+from datasets import Dataset, load_dataset
+
+from cot_eval.tasks_registry import TASKS_REGISTRY
+
+
+MIRROR_DIR_ENV = "COTEVAL_TASKS_MIRROR"
+MANIFEST_FILE = "manifest.json"
+HASH_CHUNK_SIZE = 2**20
+
+
+def default_mirror_dir() -> Optional[str]:
+    return os.environ.get(MIRROR_DIR_ENV) or None
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def read_manifest(mirror_dir: str) -> Dict[str, dict]:
+    """Mirrored tasks, keyed by task name"""
+    path = os.path.join(mirror_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def _atomic_write(path: str, write_fn):
+    """Write to a temp file in the target dir and move it into place (readers never see partial files)"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            write_fn(fp)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_manifest(mirror_dir: str, manifest: Dict[str, dict]):
+    _atomic_write(
+        os.path.join(mirror_dir, MANIFEST_FILE),
+        lambda fp: fp.write(json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")),
+    )
+
+
+def mirror_task(task: str, mirror_dir: str, token: Optional[str] = None) -> dict:
+    """Download a registered task and store it as memory-mappable Arrow file
+
+    Args:
+        task: name of task in `TASKS_REGISTRY`
+        mirror_dir: local mirror dir
+        token: HF token
+
+    Returns:
+        dict: manifest entry of the task
+    """
+    ds = load_dataset(**TASKS_REGISTRY[task], token=token)
+    if ds._indices is not None:
+        ds = ds.flatten_indices()
+    table = ds.data.table  # schema metadata holds the dataset features
+
+    def write_stream(fp):
+        # arrow stream format, as expected by `Dataset.from_file`
+        with pa.ipc.new_stream(fp, table.schema) as writer:
+            writer.write_table(table)
+
+    filename = f"{task}.arrow"
+    path = os.path.join(mirror_dir, filename)
+    _atomic_write(path, write_stream)
+    entry = {
+        "source": TASKS_REGISTRY[task],
+        "file": filename,
+        "num_rows": table.num_rows,
+        "size": os.path.getsize(path),
+        "sha256": file_sha256(path),
+    }
+    logging.info(f"Mirrored {task} ({entry['num_rows']} examples) to {path}, sha256 {entry['sha256'][:12]}")
+    return entry
+
+
+def mirror_tasks(
+    mirror_dir: str,
+    tasks: Optional[List[str]] = None,
+    token: Optional[str] = None,
+    force: bool = False,
+) -> Dict[str, dict]:
+    """Mirror tasks that are missing or outdated (registry entry changed) in the mirror
+
+    Returns:
+        Dict[str, dict]: updated manifest
+    """
+    os.makedirs(mirror_dir, exist_ok=True)
+    manifest = read_manifest(mirror_dir)
+    for task in tasks or list(TASKS_REGISTRY):
+        if task not in TASKS_REGISTRY:
+            raise ValueError(f"Unknown task {task}. Registered tasks: {list(TASKS_REGISTRY)}")
+        entry = manifest.get(task)
+        if not force and entry is not None and _is_current(entry, task, mirror_dir):
+            logging.info(f"{task} is up to date in mirror {mirror_dir}")
+            continue
+        manifest[task] = mirror_task(task, mirror_dir, token=token)
+        write_manifest(mirror_dir, manifest)
+    return manifest
+
+
+def _is_current(entry: dict, task: str, mirror_dir: str) -> bool:
+    """Cheap check: same registry entry, and file present with recorded size"""
+    path = os.path.join(mirror_dir, entry["file"])
+    return (
+        entry.get("source") == TASKS_REGISTRY.get(task)
+        and os.path.exists(path)
+        and os.path.getsize(path) == entry.get("size")
+    )
+
+
+def verify_mirror(mirror_dir: str) -> List[str]:
+    """Tasks whose mirrored file does not match its content hash"""
+    corrupt = []
+    for task, entry in read_manifest(mirror_dir).items():
+        path = os.path.join(mirror_dir, entry["file"])
+        if not os.path.exists(path) or file_sha256(path) != entry["sha256"]:
+            corrupt.append(task)
+    return corrupt
+
+
+def load_task(task: str, token: Optional[str] = None, mirror_dir: Optional[str] = None) -> Dataset:
+    """Load a registered task, from the local mirror if available, else from the Hub"""
+    mirror_dir = mirror_dir or default_mirror_dir()
+    if mirror_dir is not None:
+        entry = read_manifest(mirror_dir).get(task)
+        if entry is not None and _is_current(entry, task, mirror_dir):
+            logging.info(f"Loading {task} from mirror {mirror_dir} (sha256 {entry['sha256'][:12]})")
+            return Dataset.from_file(os.path.join(mirror_dir, entry["file"]), in_memory=False)
+        logging.warning(f"{task} not (up to date) in mirror {mirror_dir}, loading from Hub. Run `cot-eval mirror`.")
+    return load_dataset(**TASKS_REGISTRY[task], token=token)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval mirror", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--mirror_dir", default=default_mirror_dir(), help=f"Local mirror dir (default: ${MIRROR_DIR_ENV})")
+    parser.add_argument("--tasks", default=None, help="Comma-separated tasks to mirror (default: all registered tasks)")
+    parser.add_argument("--hftoken", default=None, help="HF Token to use for download")
+    parser.add_argument("--force", action="store_true", help="Re-download tasks that are already mirrored")
+    parser.add_argument("--verify", action="store_true", help="Check content hashes of mirrored files")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.mirror_dir is None:
+        raise ValueError(f"Either --mirror_dir or ${MIRROR_DIR_ENV} must be specified")
+
+    tasks = args.tasks.split(",") if args.tasks else None
+    token = args.hftoken or os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+    manifest = mirror_tasks(args.mirror_dir, tasks=tasks, token=token, force=args.force)
+    logging.info(f"Mirror {args.mirror_dir} holds tasks: {sorted(manifest)}")
+
+    if args.verify:
+        corrupt = verify_mirror(args.mirror_dir)
+        if corrupt:
+            raise RuntimeError(f"Content hash mismatch for mirrored tasks {corrupt}. Re-run with --force.")
+        logging.info("Verified content hashes of all mirrored tasks")
@@ -0,0 +1,166 @@
+"""Run timeline: structured timing spans of pipeline stages and entry points
+
+Every stage of `run.sh` and every Python entry point (`cot-eval`, the
+scripts) appends one json line per span to the run timeline file,
+`$COTEVAL_CACHE_DIR/timeline.jsonl` by default. Spans carry the run id
+(`$COTEVAL_RUN_ID`, set by `run.sh`), so the timeline of a run can be told
+apart from earlier runs with the same cache dir.
+
+Profile mode (`--profile` on any entry point, or `COTEVAL_PROFILE=true`)
+additionally captures, per span, a cProfile dump (`<name>-<pid>.prof`) and
+a tracemalloc snapshot of the top allocation sites (`<name>-<pid>.tracemalloc.txt`)
+in `$COTEVAL_CACHE_DIR/profiles`.
+"""
+
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Callable, List, Optional
+
+
+TIMELINE_ENV = "COTEVAL_TIMELINE"
+RUN_ID_ENV = "COTEVAL_RUN_ID"
+PROFILE_ENV = "COTEVAL_PROFILE"
+TIMELINE_FILE = "timeline.jsonl"
+PROFILES_DIR = "profiles"
+TRACEMALLOC_TOP = 25
+
+_profiler_active = False  # cProfile allows a single active profiler per process
+
+
+def cache_dir() -> str:
+    return os.environ.get("COTEVAL_CACHE_DIR") or "./cot-eval-cache"
+
+
+def timeline_path() -> str:
+    return os.environ.get(TIMELINE_ENV) or os.path.join(cache_dir(), TIMELINE_FILE)
+
+
+def profile_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "").lower() in ("1", "true")
+
+
+@dataclass
+class Span:
+    """A timed section of the pipeline"""
+
+    name: str
+    kind: str = "python"
+    attrs: dict = field(default_factory=dict)
+    run_id: Optional[str] = None
+    pid: int = 0
+    start: float = 0.0
+    end: float = 0.0
+    duration_s: float = 0.0
+    status: str = "ok"
+    max_rss_mb: Optional[float] = None
+
+
+def write_span(span: Span, path: Optional[str] = None):
+    """Append span to timeline (single write of a short line, safe for concurrent processes)"""
+    path = path or timeline_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as fp:
+        fp.write(json.dumps(asdict(span)) + "\n")
+
+
+def read_timeline(path: Optional[str] = None, run_id: Optional[str] = None) -> List[dict]:
+    """Spans in timeline, optionally of a single run"""
+    path = path or timeline_path()
+    if not os.path.exists(path):
+        return []
+    with open(path) as fp:
+        spans = [json.loads(line) for line in fp if line.strip()]
+    if run_id is not None:
+        spans = [s for s in spans if s.get("run_id") == run_id]
+    return spans
+
+
+def _dump_profile(name: str, profiler: Optional[cProfile.Profile], snapshot: tracemalloc.Snapshot):
+    profiles_dir = os.path.join(cache_dir(), PROFILES_DIR)
+    os.makedirs(profiles_dir, exist_ok=True)
+    stem = os.path.join(profiles_dir, f"{name.replace('/', '_').replace(' ', '_')}-{os.getpid()}")
+    if profiler is not None:
+        profiler.dump_stats(f"{stem}.prof")
+    with open(f"{stem}.tracemalloc.txt", "w") as fp:
+        for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+            fp.write(f"{stat}\n")
+    logging.info(f"Wrote profile of {name} to {stem}.*")
+
+
+def redacted_argv(argv: List[str]) -> List[str]:
+    """Command line args without the values of token args"""
+    redacted = []
+    for i, arg in enumerate(argv):
+        if i > 0 and "token" in argv[i - 1].lower() and not arg.startswith("--"):
+            arg = "***"
+        elif arg.startswith("--") and "token" in arg.lower() and "=" in arg:
+            arg = arg.split("=", 1)[0] + "=***"
+        redacted.append(arg)
+    return redacted
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = "python", **attrs):
+    """Time the enclosed block and append it to the run timeline
+
+    Yields the span; `start`, `end` and `duration_s` are set on exit.
+    """
+    global _profiler_active
+    record = Span(name=name, kind=kind, attrs=attrs, run_id=os.environ.get(RUN_ID_ENV), pid=os.getpid())
+    profiler = None
+    profiling = profile_enabled()
+    if profiling:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if not _profiler_active:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            _profiler_active = True
+    record.start = time.time()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record.status = "error"
+        raise
+    finally:
+        record.duration_s = time.perf_counter() - start
+        record.end = record.start + record.duration_s
+        record.max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if profiler is not None:
+            profiler.disable()
+            _profiler_active = False
+        if profiling:
+            _dump_profile(name, profiler, tracemalloc.take_snapshot())
+        try:
+            write_span(record)
+        except OSError as e:
+            logging.warning(f"Could not write span {name} to timeline: {e}")
+
+
+def entry_point(name: str) -> Callable:
+    """Decorator for `main` functions: record a span of the whole entry point
+
+    Strips `--profile` from `sys.argv` and turns on profile mode.
+    """
+
+    def decorator(main: Callable) -> Callable:
+        @functools.wraps(main)
+        def wrapper(*args, **kwargs):
+            if "--profile" in sys.argv:
+                sys.argv.remove("--profile")
+                os.environ[PROFILE_ENV] = "true"
+            with span(name, kind="entry_point", argv=redacted_argv(sys.argv[1:])):
+                return main(*args, **kwargs)
+        return wrapper
+
+    return decorator
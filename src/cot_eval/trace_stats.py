@@ -0,0 +1,214 @@
+"""Streaming statistics of reasoning traces
+
+usage:
+cot-eval stats --traces_dir ./cot-eval-traces [--num_workers 8] [--tokenizer model] [--output stats.csv]
+
+Trace parquet files are read row group by row group from memory-mapped
+files, and only the columns needed are decoded. Length distributions are
+accumulated in fixed-size histograms, so memory use does not grow with
+the size of the corpus. Files can be processed in parallel worker
+processes; per-file accumulators are merged afterwards.
+"""
+
+import argparse
+import functools
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from cot_eval.traces_io import read_config_data
+
+
+TRACE_COLUMN = "reasoning_trace"
+STOP_REASON_COLUMN = "stop_reason"
+HIST_BINS = np.concatenate([np.arange(0, 8192, 8), [np.inf]])  # 8-unit bins, overflow bin
+TRUNCATION_TOLERANCE = 0.98  # traces with >= 98% of max_new_tokens tokens count as truncated
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval stats", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--traces_dir", default=None, help="Local dir with trace parquet files")
+    parser.add_argument("--traces_repo", default=None, help="HF dataset repo to download trace parquet files from")
+    parser.add_argument("--hftoken", default=None, help="HF Token to use for download")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument(
+        "--tokenizer", choices=["whitespace", "model"], default="whitespace",
+        help="Count tokens by whitespace splitting or with the model's tokenizer (requires transformers)",
+    )
+    parser.add_argument("--output", default=None, help="Write summary table to this csv file")
+    return parser.parse_args(argv)
+
+
+@dataclass
+class LengthStats:
+    """Streaming accumulator for length distributions and stop reasons"""
+
+    count: int = 0
+    empty: int = 0
+    truncated: int = 0
+    chars_sum: float = 0.0
+    tokens_sum: float = 0.0
+    chars_hist: np.ndarray = field(default_factory=lambda: np.zeros(len(HIST_BINS) - 1, dtype=np.int64))
+    tokens_hist: np.ndarray = field(default_factory=lambda: np.zeros(len(HIST_BINS) - 1, dtype=np.int64))
+    stop_reasons: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, n_chars: np.ndarray, n_tokens: np.ndarray, stop_reasons: np.ndarray):
+        self.count += len(n_chars)
+        self.empty += int((n_chars == 0).sum())
+        self.truncated += int((stop_reasons == "length").sum())
+        self.chars_sum += float(n_chars.sum())
+        self.tokens_sum += float(n_tokens.sum())
+        self.chars_hist += np.histogram(n_chars / 8, bins=HIST_BINS)[0]  # chars in units of 8
+        self.tokens_hist += np.histogram(n_tokens, bins=HIST_BINS)[0]
+        reasons, counts = np.unique(stop_reasons, return_counts=True)
+        for reason, n in zip(reasons, counts):
+            self.stop_reasons[str(reason)] = self.stop_reasons.get(str(reason), 0) + int(n)
+
+    def merge(self, other: "LengthStats"):
+        self.count += other.count
+        self.empty += other.empty
+        self.truncated += other.truncated
+        self.chars_sum += other.chars_sum
+        self.tokens_sum += other.tokens_sum
+        self.chars_hist += other.chars_hist
+        self.tokens_hist += other.tokens_hist
+        for reason, n in other.stop_reasons.items():
+            self.stop_reasons[reason] = self.stop_reasons.get(reason, 0) + n
+
+    @staticmethod
+    def _quantile(hist: np.ndarray, q: float) -> float:
+        """Approximate quantile (upper bin edge) from histogram"""
+        cum = np.cumsum(hist)
+        if cum[-1] == 0:
+            return float("nan")
+        idx = int(np.searchsorted(cum, q * cum[-1]))
+        return float(HIST_BINS[min(idx + 1, len(HIST_BINS) - 2)])
+
+    def summary(self) -> dict:
+        row = {
+            "n": self.count,
+            "tokens_mean": self.tokens_sum / self.count if self.count else float("nan"),
+            "chars_mean": self.chars_sum / self.count if self.count else float("nan"),
+        }
+        for q in QUANTILES:
+            row[f"tokens_p{int(q * 100)}"] = self._quantile(self.tokens_hist, q)
+        for q in QUANTILES:
+            row[f"chars_p{int(q * 100)}"] = 8 * self._quantile(self.chars_hist, q)
+        # traces of unknown stop reason (no stop_reason column, whitespace tokens) may or may not be truncated:
+        # rate over traces of known stop reason, nan if no non-empty trace has one
+        known = self.count - self.stop_reasons.get("unknown", 0)
+        row["truncation_rate"] = self.truncated / known if known > self.empty else float("nan")
+        row["empty_rate"] = self.empty / self.count if self.count else float("nan")
+        row["stop_reasons"] = ", ".join(f"{k}: {v}" for k, v in sorted(self.stop_reasons.items()))
+        return row
+
+
+def _model_from_path(path: str) -> str:
+    """`.../data/<org>/<model>/<config>-<task>.parquet` -> `<org>/<model>`"""
+    parts = path.split(os.sep)
+    if "data" in parts:
+        idx = len(parts) - 1 - parts[::-1].index("data")
+        return "/".join(parts[idx + 1:-1])
+    return os.path.basename(os.path.dirname(path))
+
+
+@functools.lru_cache(maxsize=8)
+def _token_counter(tokenizer: str, model: str):
+    if tokenizer == "whitespace":
+        return lambda texts: np.array([len(t.split()) for t in texts], dtype=np.int64)
+    from transformers import AutoTokenizer  # optional dependency
+    tok = AutoTokenizer.from_pretrained(model)
+    return lambda texts: np.array(
+        [len(ids) for ids in tok(list(texts), add_special_tokens=False)["input_ids"]], dtype=np.int64
+    )
+
+
+def file_stats(path: str, tokenizer: str = "whitespace") -> Tuple[Tuple[str, str, str], LengthStats]:
+    """Accumulate statistics of a single trace file, one row group at a time"""
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    config = read_config_data(parquet_file)
+    model = config.get("model") or _model_from_path(path)
+    key = (model, config.get("name", ""), config.get("task", ""))
+    max_new_tokens = int(config["max_new_tokens"]) if config.get("max_new_tokens") else None
+    count_tokens = _token_counter(tokenizer, model)
+    columns = [TRACE_COLUMN]
+    has_stop_reason = STOP_REASON_COLUMN in parquet_file.schema_arrow.names
+    if has_stop_reason:
+        columns.append(STOP_REASON_COLUMN)
+
+    stats = LengthStats()
+    for i in range(parquet_file.num_row_groups):
+        batch = parquet_file.read_row_group(i, columns=columns)
+        traces = batch.column(TRACE_COLUMN).to_pylist()
+        traces = [t if t is not None else "" for t in traces]
+        n_chars = np.array([len(t) for t in traces], dtype=np.int64)
+        n_tokens = count_tokens(traces)
+        if has_stop_reason:
+            stop_reasons = np.array([str(r) for r in batch.column(STOP_REASON_COLUMN).to_pylist()])
+        elif max_new_tokens is not None and tokenizer == "model":
+            stop_reasons = np.where(n_tokens >= TRUNCATION_TOLERANCE * max_new_tokens, "length", "stop")
+        else:
+            stop_reasons = np.full(len(traces), "unknown")
+        stop_reasons = np.where(n_chars == 0, "empty", stop_reasons)
+        stats.add(n_chars, n_tokens, stop_reasons)
+    return key, stats
+
+
+def _file_stats_star(args):
+    return file_stats(*args)
+
+
+def corpus_stats(paths: List[str], tokenizer: str = "whitespace", num_workers: int = 1) -> pd.DataFrame:
+    """Summary table per model, config and task"""
+    groups: Dict[Tuple[str, str, str], LengthStats] = {}
+    tasks = [(path, tokenizer) for path in paths]
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = executor.map(_file_stats_star, tasks, chunksize=4)
+            for key, stats in results:
+                groups.setdefault(key, LengthStats()).merge(stats)
+    else:
+        for task in tasks:
+            key, stats = _file_stats_star(task)
+            groups.setdefault(key, LengthStats()).merge(stats)
+
+    rows = [
+        {"model": model, "config": config, "task": task, **stats.summary()}
+        for (model, config, task), stats in sorted(groups.items())
+    ]
+    return pd.DataFrame(rows)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+
+    if args.traces_dir is None and args.traces_repo is None:
+        raise ValueError("Either --traces_dir or --traces_repo must be specified")
+    traces_dir = args.traces_dir
+    if args.traces_repo is not None:
+        from huggingface_hub import snapshot_download
+        traces_dir = snapshot_download(
+            repo_id=args.traces_repo,
+            repo_type="dataset",
+            local_dir=traces_dir,
+            allow_patterns=["**/*.parquet"],
+            token=args.hftoken or os.environ.get("HUGGINGFACEHUB_API_TOKEN"),
+        )
+
+    paths = sorted(glob.glob(f"{traces_dir}/**/*.parquet", recursive=True))
+    logging.info(f"Computing statistics of {len(paths)} trace files in {traces_dir}")
+    summary = corpus_stats(paths, tokenizer=args.tokenizer, num_workers=args.num_workers)
+
+    with pd.option_context("display.max_rows", None, "display.width", 200, "display.precision", 3):
+        print(summary.to_string(index=False))
+    if args.output is not None:
+        summary.to_csv(args.output, index=False)
+        logging.info(f"Wrote summary table to {args.output}")
@@ -0,0 +1,79 @@
+"""Reading and writing reasoning trace parquet files
+
+Traces are written straight from the Arrow table of the dataset (no pandas
+copy). The config data, identical for all rows of a file, is stored once as
+parquet key-value metadata instead of a per-row `config_data` column.
+Earlier files, which do have a `config_data` column, are read transparently.
+"""
+
+import json
+from typing import BinaryIO, Dict, List, Optional, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+CONFIG_COLUMN = "config_data"
+CONFIG_METADATA_KEY = b"cot_eval.config_data"
+
+# long text columns that repeat across rows (e.g. several questions per passage)
+DICTIONARY_COLUMNS = ["passage", "question", "options", "labels"]
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 1
+ROW_GROUP_SIZE = 1024
+
+
+def write_traces(table: pa.Table, config_data: Dict[str, str], where: Union[str, BinaryIO]):
+    """Write traces with config data as file metadata
+
+    Args:
+        table: traces, e.g. `Dataset.with_format("arrow")[:]`
+        config_data: config of the cot-eval run that produced the traces (incl. task)
+        where: path or file object
+    """
+    metadata = dict(table.schema.metadata or {})
+    metadata[CONFIG_METADATA_KEY] = json.dumps(config_data).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+    pq.write_table(
+        table,
+        where,
+        compression=COMPRESSION,
+        compression_level=COMPRESSION_LEVEL,
+        use_dictionary=[c for c in DICTIONARY_COLUMNS if c in table.column_names],
+        row_group_size=ROW_GROUP_SIZE,
+    )
+
+
+def read_config_data(parquet_file: pq.ParquetFile) -> Dict[str, str]:
+    """Config data of a trace file, from file metadata or (earlier layout) the first row of `config_data`"""
+    metadata = parquet_file.schema_arrow.metadata or {}
+    if CONFIG_METADATA_KEY in metadata:
+        return json.loads(metadata[CONFIG_METADATA_KEY])
+    if CONFIG_COLUMN not in parquet_file.schema_arrow.names or parquet_file.metadata.num_rows == 0:
+        return {}
+    first = parquet_file.read_row_group(0, columns=[CONFIG_COLUMN]).column(0)[0].as_py()
+    return {k: v for k, v in first}
+
+
+def read_traces(path: str, columns: Optional[List[str]] = None, with_config_column: bool = True) -> pa.Table:
+    """Read a trace file of either layout
+
+    Args:
+        path: trace parquet file
+        columns: columns to read, all if None
+        with_config_column: whether to (re)construct the per-row `config_data` column
+
+    Returns:
+        pa.Table: traces, with `config_data` column in the earlier layout if requested
+    """
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    config_data = read_config_data(parquet_file)
+    file_columns = [c for c in parquet_file.schema_arrow.names if c != CONFIG_COLUMN]
+    if columns is not None:
+        file_columns = [c for c in file_columns if c in columns]
+    table = parquet_file.read(columns=file_columns)
+    if with_config_column and (columns is None or CONFIG_COLUMN in columns):
+        items = [[k, str(v)] for k, v in config_data.items()]
+        config_column = pa.array([items] * table.num_rows, type=pa.list_(pa.list_(pa.string())))
+        table = table.append_column(CONFIG_COLUMN, config_column)
+    return table
@@ -0,0 +1,163 @@
+"""Batched transformers backend for small causal LMs on CPU
+
+Selected with `backend: transformers` in a cot-eval config. Takes the same
+`modelkwargs` as the vLLM backend (`max_new_tokens`, `temperature`,
+`top_k`, `top_p`, `use_beam_search`, `best_of`, `dtype`, `trust_remote_code`,
+`vllm_kwargs.revision`, `vllm_kwargs.seed`); GPU-specific kwargs are ignored.
+Backend-specific kwargs: `batch_size` (default 16), `num_threads`
+(default: all cores) and `bucket_by_length` (default true).
+
+Prompts are tokenized once and sorted by length, so that each generation
+batch holds prompts of similar length (little padding, left-padded). Every
+batch is generated with the KV cache, with torch running ops across
+`num_threads` threads, and stops at the chain's stop words like vLLM
+(stop word not included in the output).
+
+Requires `torch` and `transformers` (`pip install cot-eval[cpu]`).
+"""
+
+import logging
+import os
+import time
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.outputs import Generation, LLMResult
+from pydantic import ConfigDict
+
+
+DEFAULT_BATCH_SIZE = 16
+# vLLM kwargs without effect on CPU
+IGNORED_KWARGS = ["tensor_parallel_size", "download_dir", "gpu_memory_utilization", "swap_space", "max_model_len"]
+
+
+def length_buckets(lengths: List[int], batch_size: int, sort: bool = True) -> List[List[int]]:
+    """Indices of prompts in batches of similar length (in input order, if not sort)"""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i]) if sort else list(range(len(lengths)))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def truncate_at_stop(text: str, stop: Optional[List[str]]) -> tuple:
+    """Text up to the first stop word, and whether a stop word was found"""
+    positions = [text.find(s) for s in stop or [] if s in text]
+    if not positions:
+        return text, False
+    return text[:min(positions)], True
+
+
+class TransformersCPU(BaseLLM):
+    """Langchain LLM generating with a transformers causal LM on CPU"""
+
+    model: str
+    revision: Optional[str] = None
+    max_new_tokens: int = 256
+    temperature: float = 1.0
+    top_k: int = -1
+    top_p: float = 1.0
+    use_beam_search: bool = False
+    best_of: int = 1
+    n: int = 1
+    dtype: str = "auto"
+    trust_remote_code: bool = False
+    seed: Optional[int] = None
+    batch_size: int = DEFAULT_BATCH_SIZE
+    bucket_by_length: bool = True
+    num_threads: Optional[int] = None
+    hf_model: Any = None
+    tokenizer: Any = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @classmethod
+    def from_modelkwargs(cls, model: str, **modelkwargs) -> "TransformersCPU":
+        """Load model with the `modelkwargs` of a cot-eval config"""
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        modelkwargs = dict(modelkwargs)
+        vllm_kwargs = modelkwargs.pop("vllm_kwargs", None) or {}
+        for key in IGNORED_KWARGS:
+            modelkwargs.pop(key, None)
+        if modelkwargs.get("n", 1) != 1:
+            raise ValueError("transformers backend supports n=1 only")
+        llm = cls(model=model, revision=vllm_kwargs.get("revision"), seed=vllm_kwargs.get("seed"), **modelkwargs)
+
+        torch.set_num_threads(llm.num_threads or os.cpu_count())
+        # half precision is slow on most CPUs: auto means float32 unless bfloat16 is requested
+        torch_dtype = torch.bfloat16 if llm.dtype == "bfloat16" else torch.float32
+        start = time.perf_counter()
+        llm.tokenizer = AutoTokenizer.from_pretrained(model, revision=llm.revision, trust_remote_code=llm.trust_remote_code)
+        llm.tokenizer.padding_side = "left"
+        if llm.tokenizer.pad_token is None:
+            llm.tokenizer.pad_token = llm.tokenizer.eos_token
+        llm.hf_model = AutoModelForCausalLM.from_pretrained(
+            model, revision=llm.revision, torch_dtype=torch_dtype, trust_remote_code=llm.trust_remote_code
+        )
+        llm.hf_model.eval()
+        logging.info(
+            f"Loaded {model} on CPU in {time.perf_counter() - start:.1f}s "
+            f"({torch.get_num_threads()} threads, {torch_dtype}, batch size {llm.batch_size})"
+        )
+        return llm
+
+    @property
+    def _llm_type(self) -> str:
+        return "transformers_cpu"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model, "revision": self.revision, "max_new_tokens": self.max_new_tokens}
+
+    def _generation_kwargs(self) -> dict:
+        if self.use_beam_search:
+            return {"do_sample": False, "num_beams": self.best_of}
+        if self.temperature == 0:
+            return {"do_sample": False}
+        kwargs = {"do_sample": True, "temperature": self.temperature, "top_p": self.top_p}
+        kwargs["top_k"] = self.top_k if self.top_k > 0 else 0  # -1 (vLLM) means no top-k
+        return kwargs
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        import torch
+
+        if self.seed is not None:
+            torch.manual_seed(self.seed)
+        lengths = [len(ids) for ids in self.tokenizer(prompts)["input_ids"]]
+        texts: List[Optional[str]] = [None] * len(prompts)
+        stop_reasons: List[Optional[str]] = [None] * len(prompts)
+        num_tokens = 0
+        start = time.perf_counter()
+        for bucket in length_buckets(lengths, self.batch_size, sort=self.bucket_by_length):
+            inputs = self.tokenizer([prompts[i] for i in bucket], return_tensors="pt", padding=True)
+            with torch.inference_mode():
+                output_ids = self.hf_model.generate(
+                    **inputs,
+                    max_new_tokens=self.max_new_tokens,
+                    use_cache=True,
+                    stop_strings=stop or None,
+                    tokenizer=self.tokenizer,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    **self._generation_kwargs(),
+                )
+            new_ids = output_ids[:, inputs["input_ids"].shape[1]:]
+            for i, ids, text in zip(bucket, new_ids, self.tokenizer.batch_decode(new_ids, skip_special_tokens=True)):
+                texts[i], stopped = truncate_at_stop(text, stop)
+                n_new = int((ids != self.tokenizer.pad_token_id).sum())
+                stop_reasons[i] = "stop" if stopped or n_new < self.max_new_tokens else "length"
+                num_tokens += n_new
+        duration = time.perf_counter() - start
+        logging.info(
+            f"Generated {num_tokens} tokens for {len(prompts)} prompts in {duration:.1f}s "
+            f"({num_tokens / max(duration, 1e-9):.1f} tokens/s)"
+        )
+        return LLMResult(
+            generations=[[Generation(text=t, generation_info={"finish_reason": r})] for t, r in zip(texts, stop_reasons)],
+            llm_output={"token_usage": {"completion_tokens": num_tokens}},
+        )
@@ -0,0 +1,369 @@
+"""Prefetch model weights of the next pending requests into the local HF cache
+
+usage:
+cot-eval prefetch --requests_repo cot-leaderboard/cot-leaderboard-requests --num_models 2 [--max_params 10] \
+    [--exclude_model $model] [--max_mbps 200] [--max_workers 4]
+
+While a model is evaluated, the prefetcher resolves the next `num_models`
+claimable requests of the queue (oldest first, honoring `max_params`, as
+`lookup_pending_model.py` and `RequestClaimer.claim` do) and downloads
+their weights, configs and tokenizer files at the requested revisions.
+
+Files are written to the standard HF cache layout (`blobs/`, `snapshots/`,
+`refs/` below `models--<org>--<name>`), so the next run, whether in this
+process (`cot-eval worker`) or in the next container on the same node (same
+`HF_HOME`), finds them without any download. Downloads hold the same
+per-file lock as `huggingface_hub`, so a model that is claimed while its
+weights are still being prefetched waits for files in flight instead of
+downloading them twice. Bandwidth (shared by all download threads) and
+concurrency are bounded so as not to slow down the running evaluation.
+
+Prefetched models are recorded in `cot-eval-prefetch.json` in the HF cache dir.
+"""
+
+import argparse
+import contextlib
+import fcntl
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from filelock import FileLock
+from huggingface_hub import HfApi, constants
+
+from cot_eval.request_leases import claimable_requests
+from cot_eval.requests_queue import EvalRequest, RequestsQueueIndex
+
+
+STATE_FILE = "cot-eval-prefetch.json"
+CHUNK_SIZE = 2**20
+DOWNLOAD_TIMEOUT = 60  # seconds
+# files vLLM needs besides the weights (configs, tokenizer, remote code)
+ALLOW_PATTERNS = ["*.json", "*.model", "*.tiktoken", "*.txt", "*.py"]
+# weight formats in order of preference; only the first one present is fetched (as vLLM loads it)
+WEIGHT_PATTERNS = [["*.safetensors"], ["*.bin", "*.pt"]]
+WEIGHT_INDEX_FILES = ["model.safetensors.index.json", "pytorch_model.bin.index.json"]
+
+
+@dataclass
+class RemoteFile:
+    """File of a model repo at a commit"""
+
+    path: str
+    size: int
+    etag: str  # name of blob in HF cache: sha256 of LFS files, git blob id otherwise
+    sha256: Optional[str] = None
+
+
+class RateLimiter:
+    """Caps the throughput of all threads that report bytes to it"""
+
+    def __init__(self, bytes_per_s: Optional[float] = None):
+        self.bytes_per_s = bytes_per_s
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, num_bytes: int):
+        """Block until `num_bytes` more are within the rate"""
+        if not self.bytes_per_s:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + num_bytes / self.bytes_per_s
+            delay = self._next - now
+        time.sleep(delay)
+
+
+def repo_folder(cache_dir: str, repo_id: str) -> str:
+    return os.path.join(cache_dir, f"models--{repo_id.replace('/', '--')}")
+
+
+def list_model_files(api: HfApi, repo_id: str, revision: str) -> Tuple[str, List[RemoteFile]]:
+    """Commit of revision and files of the repo at that commit"""
+    info = api.model_info(repo_id, revision=revision, files_metadata=True)
+    files = []
+    for sibling in info.siblings or []:
+        lfs = sibling.lfs
+        sha256 = (lfs["sha256"] if isinstance(lfs, dict) else lfs.sha256) if lfs else None
+        files.append(RemoteFile(
+            path=sibling.rfilename,
+            size=sibling.size or 0,
+            etag=sha256 or sibling.blob_id,
+            sha256=sha256,
+        ))
+    return info.sha, files
+
+
+def _matches(path: str, patterns: List[str]) -> bool:
+    return "/" not in path and any(fnmatch.fnmatch(path, p) for p in patterns)
+
+
+def select_files(files: List[RemoteFile]) -> Tuple[List[RemoteFile], List[RemoteFile]]:
+    """Files needed to load the model with vLLM: (configs and tokenizer, weights)"""
+    aux = [f for f in files if _matches(f.path, ALLOW_PATTERNS)]
+    for patterns in WEIGHT_PATTERNS:
+        weights = [f for f in files if _matches(f.path, patterns)]
+        if weights:
+            return aux, weights
+    return aux, []
+
+
+class WeightPrefetcher:
+    """Downloads model repos into the HF cache with bounded bandwidth and concurrency
+
+    Args:
+        api: HfApi client (or a stand-in implementing `model_info`)
+        cache_dir: HF hub cache dir, default: `$HF_HUB_CACHE`
+        endpoint: base url files are downloaded from (`<endpoint>/<repo>/resolve/<commit>/<path>`)
+        token: HF token
+        max_mbps: bandwidth cap in MB/s, shared by all downloads (None: unbounded)
+        max_workers: number of files downloaded concurrently
+        min_free_gb: models are skipped if they would leave less disk space
+        cache_manager: makes room for a model before it is downloaded (see cache_manager.py)
+    """
+
+    def __init__(
+        self,
+        api: HfApi,
+        cache_dir: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        token: Optional[str] = None,
+        max_mbps: Optional[float] = None,
+        max_workers: int = 4,
+        min_free_gb: float = 50.0,
+        cache_manager=None,
+    ):
+        self.api = api
+        self.cache_dir = cache_dir or constants.HF_HUB_CACHE
+        self.endpoint = (endpoint or constants.ENDPOINT).rstrip("/")
+        self.token = token
+        self.limiter = RateLimiter(max_mbps * 2**20 if max_mbps else None)
+        self.max_workers = max_workers
+        self.min_free_gb = min_free_gb
+        self.cache_manager = cache_manager
+        self.state_path = os.path.join(self.cache_dir, STATE_FILE)
+
+    @contextlib.contextmanager
+    def _update_state(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(f"{self.state_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = read_state(self.cache_dir)
+            yield state
+            tmp_path = f"{self.state_path}.tmp-{os.getpid()}"
+            with open(tmp_path, "w") as fp:
+                json.dump(state, fp, indent=2)
+            os.replace(tmp_path, self.state_path)
+
+    def _download(self, url: str, dest: str, sha256: Optional[str]):
+        """Stream url to dest, resuming a partial download"""
+        offset = os.path.getsize(dest) if os.path.exists(dest) else 0
+        request = urllib.request.Request(url)
+        if self.token:
+            request.add_unredirected_header("Authorization", f"Bearer {self.token}")  # not sent to CDN
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+            if offset and response.status != 206:
+                offset = 0  # server ignored range
+            sha = hashlib.sha256() if sha256 else None
+            if sha is not None and offset:
+                with open(dest, "rb") as fp:
+                    for chunk in iter(lambda: fp.read(CHUNK_SIZE), b""):
+                        sha.update(chunk)
+            with open(dest, "ab" if offset else "wb") as fp:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    fp.write(chunk)
+                    if sha is not None:
+                        sha.update(chunk)
+                    self.limiter.consume(len(chunk))
+        if sha is not None and sha.hexdigest() != sha256:
+            os.remove(dest)
+            raise ValueError(f"Checksum mismatch for {url}")
+
+    def fetch_file(self, repo_id: str, commit: str, remote: RemoteFile) -> int:
+        """Download file into the HF cache, unless cached
+
+        Returns:
+            int: number of bytes downloaded
+        """
+        storage = repo_folder(self.cache_dir, repo_id)
+        blob_path = os.path.join(storage, "blobs", remote.etag)
+        pointer_path = os.path.join(storage, "snapshots", commit, *remote.path.split("/"))
+        lock_path = os.path.join(self.cache_dir, ".locks", os.path.basename(storage), f"{remote.etag}.lock")
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.makedirs(os.path.dirname(pointer_path), exist_ok=True)
+
+        downloaded = 0
+        with FileLock(lock_path):
+            if not os.path.exists(blob_path):
+                url = f"{self.endpoint}/{repo_id}/resolve/{commit}/{quote(remote.path)}"
+                incomplete_path = f"{blob_path}.incomplete"
+                self._download(url, incomplete_path, remote.sha256)
+                downloaded = os.path.getsize(incomplete_path)
+                os.replace(incomplete_path, blob_path)
+            if not os.path.lexists(pointer_path):
+                os.symlink(os.path.relpath(blob_path, os.path.dirname(pointer_path)), pointer_path)
+        return downloaded
+
+    def prefetch_model(self, repo_id: str, revision: str = "main") -> dict:
+        """Download the files vLLM loads for a model at revision
+
+        Returns:
+            dict: state entry of the model
+        """
+        start = time.perf_counter()
+        commit, files = list_model_files(self.api, repo_id, revision)
+        aux, weights = select_files(files)
+        entry = {"model": repo_id, "revision": revision, "commit": commit, "status": "running", "started": time.time()}
+
+        # configs and tokenizer first; the weight index (if any) limits weights to those referenced
+        downloaded = sum(self.fetch_file(repo_id, commit, f) for f in aux)
+        for index_file in WEIGHT_INDEX_FILES:
+            index_path = os.path.join(repo_folder(self.cache_dir, repo_id), "snapshots", commit, index_file)
+            if any(f.path == index_file for f in aux) and os.path.exists(index_path):
+                with open(index_path) as fp:
+                    referenced = set(json.load(fp).get("weight_map", {}).values())
+                weights = [f for f in weights if f.path in referenced] or weights
+                break
+
+        size = sum(f.size for f in aux + weights)
+        if self.cache_manager is not None:
+            has_room = self.cache_manager.make_room(size, pin=[repo_id])
+        else:
+            has_room = shutil.disk_usage(self.cache_dir).free - size >= self.min_free_gb * 2**30
+        if not has_room:
+            logging.warning(
+                f"Not prefetching {repo_id}: no room for {size / 2**30:.1f}GB in cache (disk space or budget)"
+            )
+            entry.update(status="skipped", size=size)
+            return entry
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            downloaded += sum(executor.map(lambda f: self.fetch_file(repo_id, commit, f), weights))
+
+        # like hf_hub_download: revision resolves to the commit offline
+        if revision != commit:
+            ref_path = os.path.join(repo_folder(self.cache_dir, repo_id), "refs", revision)
+            os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+            with open(ref_path, "w") as fp:
+                fp.write(commit)
+
+        duration = time.perf_counter() - start
+        entry.update(
+            status="complete", files=len(aux) + len(weights), size=size, downloaded=downloaded,
+            duration_s=duration, finished=time.time(),
+        )
+        logging.info(
+            f"Prefetched {repo_id}@{revision} ({entry['files']} files, {size / 2**30:.1f}GB, "
+            f"{downloaded / 2**30:.1f}GB downloaded in {duration:.0f}s)"
+        )
+        return entry
+
+    def prefetch(self, eval_requests: List[EvalRequest]) -> List[dict]:
+        """Prefetch the models of requests, one after the other (files of a model in parallel)"""
+        entries = []
+        for eval_request in eval_requests:
+            key = f"{eval_request.model}@{eval_request.revision}"
+            with self._update_state() as state:
+                # pins the model in the cache while it is downloaded
+                state[key] = {"model": eval_request.model, "revision": eval_request.revision, "status": "running", "started": time.time()}
+            try:
+                entry = self.prefetch_model(eval_request.model, eval_request.revision)
+            except Exception as e:
+                logging.warning(f"Failed to prefetch {key}: {e}")
+                entry = {"model": eval_request.model, "revision": eval_request.revision, "status": "failed", "error": str(e)}
+            with self._update_state() as state:
+                state[key] = entry
+            entries.append(entry)
+        return entries
+
+    def prefetch_in_background(self, eval_requests: List[EvalRequest]) -> threading.Thread:
+        thread = threading.Thread(target=self.prefetch, args=(eval_requests,), name="prefetch", daemon=True)
+        thread.start()
+        return thread
+
+
+def read_state(cache_dir: Optional[str] = None) -> Dict[str, dict]:
+    """Prefetched models, keyed by `<model>@<revision>`"""
+    path = os.path.join(cache_dir or constants.HF_HUB_CACHE, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def prefetch_status(model: str, revision: str, cache_dir: Optional[str] = None) -> Optional[str]:
+    """Status of model in prefetch state (complete, running, skipped, failed), None if never prefetched"""
+    return read_state(cache_dir).get(f"{model}@{revision}", {}).get("status")
+
+
+def next_requests(
+    index: RequestsQueueIndex,
+    num_models: int,
+    max_params: Optional[float] = None,
+    exclude_models: Optional[List[str]] = None,
+) -> List[EvalRequest]:
+    """Next claimable requests of the (synced) index, in claim order"""
+    exclude_models = exclude_models or []
+    candidates = [r for r in claimable_requests(index, max_params=max_params) if r.model not in exclude_models]
+    return candidates[:num_models]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="cot-eval prefetch", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--requests_repo", default="cot-leaderboard/cot-leaderboard-requests")
+    parser.add_argument("--tmp_dir", default="./TMP", help="Dir of local requests index")
+    parser.add_argument("--num_models", type=int, default=1, help="Number of pending requests to prefetch")
+    parser.add_argument("--max_params", type=float, default=None, help="Only prefetch models with at most this many params (B)")
+    parser.add_argument("--exclude_model", action="append", default=[], help="Model not to prefetch (e.g., the one being evaluated)")
+    parser.add_argument("--model", default=None, help="Prefetch this model instead of pending requests")
+    parser.add_argument("--revision", default="main", help="Revision of --model")
+    parser.add_argument("--cache_dir", default=None, help="HF hub cache dir (default: $HF_HUB_CACHE)")
+    parser.add_argument("--endpoint", default=None, help="Base url of file downloads (default: HF endpoint)")
+    parser.add_argument("--max_mbps", type=float, default=None, help="Bandwidth cap in MB/s")
+    parser.add_argument("--max_workers", type=int, default=4, help="Number of concurrent file downloads")
+    parser.add_argument("--min_free_gb", type=float, default=50.0, help="Free disk space to keep (GB)")
+    parser.add_argument("--hftoken", default=None, help="HF Token")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    from cot_eval.cache_manager import CacheManager
+
+    args = parse_args(argv)
+    token = args.hftoken or os.environ.get("HUGGINGFACEHUB_API_TOKEN")
+    api = HfApi(token=token)
+    prefetcher = WeightPrefetcher(
+        api,
+        cache_dir=args.cache_dir,
+        endpoint=args.endpoint,
+        token=token,
+        max_mbps=args.max_mbps,
+        max_workers=args.max_workers,
+        min_free_gb=args.min_free_gb,
+        cache_manager=CacheManager(hf_cache_dir=args.cache_dir, min_free_gb=args.min_free_gb, pins=args.exclude_model),
+    )
+
+    if args.model is not None:
+        eval_requests = [EvalRequest(model=args.model, status="PENDING", json_filepath="", revision=args.revision)]
+    else:
+        index = RequestsQueueIndex(args.requests_repo, os.path.join(args.tmp_dir, "cot-leaderboard-requests"), api)
+        index.sync()
+        eval_requests = next_requests(index, args.num_models, args.max_params, args.exclude_model)
+    if not eval_requests:
+        logging.info("No pending requests to prefetch.")
+        return
+    logging.info(f"Prefetching weights of {[r.model for r in eval_requests]} to {prefetcher.cache_dir}")
+    prefetcher.prefetch(eval_requests)
@@ -0,0 +1,380 @@
+"""Long-running worker that evaluates one pending model after the other
+
+usage:
+cot-eval worker --requests_repo cot-leaderboard/cot-leaderboard-requests [--max_models 10] [--exit_when_idle]
+
+Pipeline settings are read from the same environment variables as `run.sh`
+(`CHAINS`, `MODELKWARGS`, `TASKS`, `NUM_GPUS`, ..., see `config.env`).
+
+In contrast to `bash run.sh`, which evaluates a single model per
+container, the worker stays up: it claims the next request, runs the
+pipeline for it and claims the next one. As with `run.sh`, the preflight
+checks (`cot-eval preflight`) run before a model is loaded. Imports, CUDA
+initialization and HF login happen once per worker, and preprocessed task
+data stays in memory. Reasoning traces are generated in-process with a single vLLM
+engine per model, shared by all configs (configs differ in sampling
+params only); `cot-eval` loads the engine once per config. The engine is
+released, with its GPU memory, before the harness evaluation (which runs
+in subprocesses via `scripts/run_pipeline.py`) and the next model.
+
+Per model, the worker logs its overhead (claiming, config creation, engine
+load and release) next to an estimate of the overhead of the one-shot
+container for the same model (process startup, CUDA init and login, one
+engine load per config), and records both in the run timeline.
+
+With `SCREENING=true` (`--screening true`), traces are not generated
+in-process: the pipeline generates them per screening round, on the
+round's slices only (see src/cot_eval/screening.py), and the screening
+summary is flagged in the leaderboard record, as with `bash run.sh`.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import huggingface_hub
+from huggingface_hub import HfApi
+
+from cot_eval.COTEvalConfig import COTEvalConfig
+from cot_eval.cache_manager import CacheManager
+from cot_eval.request_leases import LEASE_TTL, MAX_ATTEMPTS, LeaseConflict, LeaseHeartbeat, RequestClaimer, default_worker_id
+from cot_eval.requests_queue import EvalRequest, RequestsQueueIndex
+from cot_eval.run_manifest import MANIFEST_ENV, RunManifest
+from cot_eval.screening import SUMMARY_FILE, screening_dir
+from cot_eval.timeline import span
+from cot_eval.weight_prefetch import WeightPrefetcher, next_requests, prefetch_status
+
+
+# VLLM fields that determine the engine; all other model kwargs are sampling params
+ENGINE_KEYS = ["tensor_parallel_size", "trust_remote_code", "dtype", "download_dir", "vllm_kwargs"]
+SCRIPTS_DIR = "scripts"
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    env = os.environ.get
+    parser = argparse.ArgumentParser(prog="cot-eval worker", formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--requests_repo", default=env("REQUESTS_REPO", "cot-leaderboard/cot-leaderboard-requests"))
+    parser.add_argument("--traces_repo", default=env("TRACES_REPO", "cot-leaderboard/cot-eval-traces-2.0"))
+    parser.add_argument("--results_repo", default=env("RESULTS_REPO", "cot-leaderboard/cot-eval-results"))
+    parser.add_argument("--leaderboard_results_repo", default=env("LEADERBOARD_RESULTS_REPO", "cot-leaderboard/cot-leaderboard-results"))
+    parser.add_argument("--create_pr", default=env("CREATE_PULLREQUESTS", "false"))
+    parser.add_argument("--max_params", type=float, default=env("MAX_MODEL_PARAMS"))
+    parser.add_argument("--chains", default=env("CHAINS"))
+    parser.add_argument("--model_kwargs", default=env("MODELKWARGS"))
+    parser.add_argument("--tasks", default=env("TASKS"))
+    parser.add_argument("--num_gpus", type=int, default=int(env("NUM_GPUS", "1")))
+    parser.add_argument("--node_gpus", type=int, default=int(env("NODE_GPUS") or env("NUM_GPUS", "1")))
+    parser.add_argument("--gpu_memory_utilization", type=float, default=float(env("GPU_MEMORY_UTILIZATION", "0.9")))
+    parser.add_argument("--swap_space", type=int, default=int(env("VLLM_SWAP_SPACE", "4")))
+    parser.add_argument("--max_length", type=int, default=env("MAX_LENGTH"))
+    parser.add_argument("--trust_remote_code", default=env("TRUST_REMOTE_CODE", "true"))
+    parser.add_argument("--do_baseeval", default=env("DO_BASEEVAL", "true"))
+    parser.add_argument("--final_answer", default=env("FINAL_ANSWER", "false"))
+    parser.add_argument("--model_server", default=env("MODEL_SERVER", "false"), help="Harness evaluation against one shared model server")
+    parser.add_argument("--screening", default=env("SCREENING", "false"), help="Screen on stratified subsets of the tasks, grown in rounds")
+    parser.add_argument("--cache_dir", default=env("COTEVAL_CACHE_DIR", "./cot-eval-cache"))
+    parser.add_argument("--hftoken", default=env("HUGGINGFACEHUB_API_TOKEN"))
+    parser.add_argument("--worker_id", default=None, help="Id of this worker in leases (default: host and pid)")
+    parser.add_argument("--lease_ttl", type=float, default=LEASE_TTL, help="Lease time-to-live in seconds")
+    parser.add_argument("--max_attempts", type=int, default=MAX_ATTEMPTS, help="Claims of a request before it is set to FAILED")
+    parser.add_argument("--prefetch_models", type=int, default=int(env("PREFETCH_MODELS", "0")), help="Prefetch weights of this many next pending models")
+    parser.add_argument("--prefetch_max_mbps", type=float, default=env("PREFETCH_MAX_MBPS"), help="Bandwidth cap of prefetching (MB/s)")
+    parser.add_argument("--cache_budget_gb", type=float, default=env("COTEVAL_CACHE_BUDGET_GB"), help="Disk budget of HF cache and cache dir (GB)")
+    parser.add_argument("--max_models", type=int, default=None, help="Exit after evaluating this many models (failed runs do not count)")
+    parser.add_argument("--poll_interval", type=float, default=300, help="Seconds to wait if no request is pending")
+    parser.add_argument("--exit_when_idle", action="store_true", help="Exit if no request is pending")
+    return parser.parse_args(argv)
+
+
+def engine_key(config: COTEvalConfig) -> str:
+    """Configs with equal keys can share a vLLM engine"""
+    modelkwargs = config.modelkwargs or {}
+    return repr((config.model, sorted((k, repr(modelkwargs.get(k))) for k in ENGINE_KEYS)))
+
+
+def release_engine(llm):
+    """Free the GPU memory held by a vLLM engine"""
+    import torch
+    try:
+        from vllm.distributed.parallel_state import destroy_model_parallel
+    except ImportError:  # older vllm
+        from vllm.model_executor.parallel_utils.parallel_state import destroy_model_parallel
+
+    llm.client = None
+    destroy_model_parallel()
+    gc.collect()
+    torch.cuda.empty_cache()
+    logging.info(f"Released engine, {torch.cuda.memory_allocated() / 2**30:.1f}GB GPU memory still allocated")
+
+
+class Worker:
+    """Claims requests and runs the pipeline for each of them, with warm state across models"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.api = HfApi(token=args.hftoken)
+        self.tmp_dir = os.path.join(args.cache_dir, "TMP")
+        self.index = RequestsQueueIndex(args.requests_repo, os.path.join(self.tmp_dir, "cot-leaderboard-requests"), self.api)
+        self.claimer = RequestClaimer(
+            self.index, worker_id=args.worker_id or default_worker_id(), ttl=args.lease_ttl, max_attempts=args.max_attempts
+        )
+        self.task_data: Dict = {}  # preprocessed task data, reused across models
+        self.startup_s = 0.0
+        self.prefetcher = WeightPrefetcher(self.api, token=args.hftoken, max_mbps=args.prefetch_max_mbps)
+        self.prefetch_thread = None
+
+    def warm_up(self):
+        """One-time costs, paid per model by the one-shot container: imports, CUDA init, HF login"""
+        start = time.perf_counter()
+        with span("worker_warm_up"):
+            import torch
+            import vllm  # noqa: F401
+            from langchain_community.llms import VLLM  # noqa: F401
+            if torch.cuda.is_available():
+                torch.cuda.init()
+            if self.args.hftoken:
+                huggingface_hub.login(token=self.args.hftoken)
+        self.startup_s = time.perf_counter() - start
+        logging.info(f"Worker {self.claimer.worker_id} warmed up in {self.startup_s:.1f}s")
+
+    def run(self):
+        self.warm_up()
+        evaluated = 0
+        while self.args.max_models is None or evaluated < self.args.max_models:
+            start = time.perf_counter()
+            eval_request = self.claimer.claim(max_params=self.args.max_params)
+            claim_s = time.perf_counter() - start
+            if eval_request is None:
+                if self.args.exit_when_idle:
+                    logging.info("No pending requests. Exiting.")
+                    break
+                logging.info(f"No pending requests. Waiting {self.args.poll_interval:.0f}s.")
+                time.sleep(self.args.poll_interval)
+                continue
+            # make room for this model, keeping it and prefetched ones
+            CacheManager(self.args.cache_dir, budget_gb=self.args.cache_budget_gb, pins=[eval_request.model]).evict()
+            self.prefetch_next(exclude_model=eval_request.model)
+            try:
+                self.run_model(eval_request, claim_s)
+            except Exception as e:
+                logging.error(
+                    f"Evaluation of {eval_request.model} failed (attempt {eval_request.attempts} of "
+                    f"{self.claimer.max_attempts}): {e}"
+                )
+                self.give_up_if_exhausted(eval_request)
+                continue
+            evaluated += 1
+
+    def give_up_if_exhausted(self, eval_request: EvalRequest):
+        """Set a failed request to FAILED after its last attempt
+
+        Otherwise its lease expires and the request is reclaimed (resuming
+        from the run manifest), possibly by another worker.
+        """
+        if eval_request.attempts < self.claimer.max_attempts:
+            return
+        try:
+            self.claimer.release(eval_request, "FAILED")
+            logging.warning(f"Set {eval_request.model} to FAILED after {eval_request.attempts} attempts.")
+        except LeaseConflict as e:
+            logging.error(f"Could not set {eval_request.model} to FAILED: {e}")
+
+    def prefetch_next(self, exclude_model: str):
+        """Download weights of the next pending models in the background, while the current one is evaluated"""
+        if self.args.prefetch_models <= 0 or (self.prefetch_thread is not None and self.prefetch_thread.is_alive()):
+            return
+        # index has just been synced by the claim
+        eval_requests = next_requests(self.index, self.args.prefetch_models, self.args.max_params, [exclude_model])
+        if eval_requests:
+            logging.info(f"Prefetching weights of {[r.model for r in eval_requests]}")
+            self.prefetcher.cache_manager = CacheManager(self.args.cache_dir, budget_gb=self.args.cache_budget_gb, pins=[exclude_model])
+            self.prefetch_thread = self.prefetcher.prefetch_in_background(eval_requests)
+
+    def _script(self, script: str, *script_args: str, check: bool = True):
+        subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, script), *script_args], check=check)
+
+    def run_model(self, eval_request: EvalRequest, claim_s: float = 0.0):
+        args = self.args
+        model, revision, precision = eval_request.model, eval_request.revision, eval_request.precision
+        logging.info(f"Model to evaluate: {model} : {revision}. Precision: {precision}")
+        logging.info(f"Prefetched weights: {prefetch_status(model, revision) or 'none'}")
+        paths = {
+            "configs": os.path.join(args.cache_dir, "cot_eval_configs"),
+            "config_keys": os.path.join(args.cache_dir, "config_keys.txt"),
+            "harness_tasks": os.path.join(args.cache_dir, "eleuther", "tasks", "logikon"),
+            "harness_keys": os.path.join(args.cache_dir, "lm_eval_harness_tasks.json"),
+            "output": os.path.join(args.cache_dir, "eleuther", "output"),
+            "preflight": os.path.join(args.cache_dir, "preflight.json"),
+        }
+        # fresh mtimes: copies are artifacts of this run
+        shutil.copytree(
+            os.path.join("eleuther", "tasks", "logikon"), paths["harness_tasks"], dirs_exist_ok=True, copy_function=shutil.copy,
+        )
+
+        lm_eval_model_args = (
+            f"pretrained={model},revision={revision},dtype={precision},tensor_parallel_size={args.num_gpus},"
+            f"gpu_memory_utilization={args.gpu_memory_utilization},trust_remote_code={args.trust_remote_code}"
+        )
+        config_extra_args = []
+        if args.max_length:
+            lm_eval_model_args += f",max_length={args.max_length}"
+            config_extra_args += ["--max_model_len", str(args.max_length)]
+        if args.final_answer == "true":
+            config_extra_args.append("--final_answer")
+
+        heartbeat = LeaseHeartbeat(self.claimer, eval_request)
+        heartbeat.start()
+        timings = {"claim": claim_s, "configs": 0.0, "engine_load": 0.0, "engine_release": 0.0}
+        try:
+            with span("worker_model", model=model, revision=revision) as model_span:
+                manifest = RunManifest.for_model(model, revision, args.cache_dir)
+                run_inputs = "|".join([
+                    precision, args.chains, args.model_kwargs, args.tasks, str(args.num_gpus), args.do_baseeval,
+                    " ".join(config_extra_args), lm_eval_model_args, args.screening,
+                ])
+                manifest.start(model, revision, run_inputs)
+                os.environ[MANIFEST_ENV] = manifest.path
+
+                start = time.perf_counter()
+                if manifest.is_done("create_configs"):
+                    config_keys = manifest.get("config_keys")
+                else:
+                    self._script(
+                        "create_cot_configs.py", *config_extra_args,
+                        "--model", model, "--revision", revision, "--precision", precision,
+                        "--chains", args.chains, "--model_kwargs", args.model_kwargs, "--tasks", args.tasks,
+                        "--output_dir", paths["configs"], "--template_path", "./src/cot_eval/configs/template.yaml",
+                        "--keys_file", paths["config_keys"], "--num_gpus", str(args.num_gpus),
+                        "--gpu_memory_utilization", str(args.gpu_memory_utilization), "--swap_space", str(args.swap_space),
+                    )
+                    with open(paths["config_keys"]) as fp:
+                        config_keys = fp.read().strip()
+                    manifest.set("config_keys", config_keys)
+                    manifest.mark_done("create_configs")
+                timings["configs"] = time.perf_counter() - start
+
+                # fail fast, as run.sh does, before the engine is loaded
+                from cot_eval.preflight import main as preflight
+
+                with span("preflight", model=model):
+                    preflight([
+                        "--configs_dir", paths["configs"], "--configs", config_keys, "--upload_dataset", args.traces_repo,
+                        "--output", paths["preflight"], *(["--hftoken", args.hftoken] if args.hftoken else []),
+                    ])
+
+                configs = [COTEvalConfig.from_yaml(os.path.join(paths["configs"], f"{k}.yaml")) for k in config_keys.split(",")]
+                screening = args.screening == "true"
+                if not screening:  # screening rounds generate traces of their slices in the pipeline
+                    self.generate(configs, manifest, timings)
+
+                timestamp = manifest.get("timestamp")
+                if not timestamp:
+                    timestamp = time.strftime("%y-%m-%d-%H:%M:%S")
+                    manifest.set("timestamp", timestamp)
+                screening_file = os.path.join(screening_dir(paths["output"], model, timestamp), SUMMARY_FILE)
+                self._script(
+                    "run_pipeline.py",
+                    "--model", model, "--configs", config_keys, "--configs_dir", paths["configs"],
+                    "--tasks", args.tasks, "--timestamp", timestamp, "--lm_eval_model_args", lm_eval_model_args,
+                    "--harness_tasks_dir", paths["harness_tasks"], "--harness_keys_file", paths["harness_keys"],
+                    "--output_dir", paths["output"], "--traces_repo", args.traces_repo, "--hftoken", args.hftoken,
+                    "--do_baseeval", args.do_baseeval, "--num_gpus", str(args.node_gpus),
+                    "--gpus_per_model", str(args.num_gpus), "--log_dir", os.path.join(args.cache_dir, "logs"),
+                    *(["--model_server"] if args.model_server == "true" else []),
+                    *(["--screening"] if screening else []),
+                )
+
+                # upload_results.py sets the request status to FINISHED and drops the lease
+                heartbeat.stop()
+                if not manifest.is_done("upload"):
+                    self._script(
+                        "upload_results.py",
+                        "--model", model, "--revision", revision, "--precision", precision, "--tasks", args.tasks,
+                        "--timestamp", timestamp, "--output_dir", paths["output"], "--tmp_dir", self.tmp_dir,
+                        "--results_repo", args.results_repo, "--requests_repo", args.requests_repo,
+                        "--leaderboard_results_repo", args.leaderboard_results_repo, "--create_pr", args.create_pr,
+                        "--timeline_file", os.path.join(args.cache_dir, "timeline.jsonl"),
+                        *(["--screening_file", screening_file] if screening else []),
+                    )
+                    manifest.mark_done("upload")
+                manifest.finish()
+
+                overhead_s = sum(timings.values())
+                one_shot_s = (
+                    self.startup_s + timings["claim"] + timings["configs"]
+                    + len(configs) * timings["engine_load"]
+                )
+                model_span.attrs.update(overhead_s=overhead_s, one_shot_overhead_s=one_shot_s, **timings)
+                logging.info(
+                    f"Overhead for {model}: {overhead_s:.1f}s in worker ({', '.join(f'{k} {v:.1f}s' for k, v in timings.items())}) "
+                    f"vs. ~{one_shot_s:.1f}s in one-shot container (startup {self.startup_s:.1f}s, "
+                    f"{len(configs)} engine loads, not counting container start)"
+                )
+        finally:
+            if heartbeat.is_alive():
+                heartbeat.stop()
+            os.environ.pop(MANIFEST_ENV, None)
+
+    def generate(self, configs: List[COTEvalConfig], manifest: RunManifest, timings: Dict[str, float]):
+        """Generate and upload traces for all configs, loading one engine per engine key"""
+        from langchain_community.llms import VLLM
+
+        from cot_eval.__main__ import generate_traces, load_llm, upload_traces
+        from cot_eval.generation_budgets import load_budgets
+
+        engines: Dict[str, VLLM] = {}
+        try:
+            for config in configs:
+                unit = f"generate_{config.name}"
+                if manifest.is_done(unit):
+                    continue
+                tasks = [t for t in config.tasks if not manifest.is_done(f"generate/{config.name}/{t}")]
+                if not tasks:
+                    manifest.mark_done(unit)
+                    continue
+                if config.backend != "vllm":
+                    with span("load_model", config=config.name, model=config.model, backend=config.backend):
+                        llm = load_llm(config)
+                    cot_data = generate_traces(
+                        config, tasks, self.args.hftoken, answer_shuffle_seed=42, llm=llm, task_data=self.task_data,
+                        generation_budgets=load_budgets(),
+                    )
+                    upload_traces(config, cot_data, self.args.traces_repo, self.args.hftoken, manifest=manifest)
+                    manifest.mark_done(unit)
+                    continue
+                key = engine_key(config)
+                if key not in engines:
+                    for engine in engines.values():
+                        release_engine(engine)
+                    engines.clear()
+                    start = time.perf_counter()
+                    with span("load_model", config=config.name, model=config.model):
+                        engines[key] = VLLM(model=config.model, **config.modelkwargs)
+                    timings["engine_load"] += time.perf_counter() - start
+                # same engine, sampling params of this config
+                llm = VLLM.construct(client=engines[key].client, model=config.model, **config.modelkwargs)
+                cot_data = generate_traces(
+                    config, tasks, self.args.hftoken, answer_shuffle_seed=42, llm=llm, task_data=self.task_data,
+                    generation_budgets=load_budgets(),
+                )
+                upload_traces(config, cot_data, self.args.traces_repo, self.args.hftoken, manifest=manifest)
+                manifest.mark_done(unit)
+        finally:
+            start = time.perf_counter()
+            for engine in engines.values():
+                release_engine(engine)
+            timings["engine_release"] += time.perf_counter() - start
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    for name in ["chains", "model_kwargs", "tasks", "hftoken"]:
+        if not getattr(args, name):
+            raise ValueError(f"--{name} (or the corresponding env var of config.env) must be specified")
+    Worker(args).run()
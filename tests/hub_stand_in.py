@@ -0,0 +1,77 @@
+"""In-memory stand-in for the hub API calls of the requests queue
+
+Implements `repo_info`, `list_repo_tree`, `hf_hub_download` and
+`create_commit` for a single dataset repo. Every commit is kept as a
+snapshot; like on the hub, a commit whose `parent_commit` is not the
+current head is rejected with HTTP 412, so compare-and-set claims (see
+request_leases.py) can race against each other in threads.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from huggingface_hub.utils import HfHubHTTPError
+
+
+def _blob_id(content: bytes) -> str:
+    return hashlib.sha1(content).hexdigest()
+
+
+class StandInHfApi:
+
+    def __init__(self, files: Optional[Dict[str, dict]] = None):
+        self.snapshots: Dict[str, Dict[str, bytes]] = {}
+        self.head = ""
+        self.num_commits = 0
+        self.num_rejected = 0
+        self._lock = threading.Lock()
+        self._add_snapshot(
+            {path: json.dumps(data, indent=4).encode("utf-8") for path, data in (files or {}).items()}, "initial commit"
+        )
+
+    def _add_snapshot(self, files: Dict[str, bytes], commit_message: str):
+        sha = hashlib.sha1(f"{self.head}:{self.num_commits}:{commit_message}".encode("utf-8")).hexdigest()
+        self.snapshots[sha] = files
+        self.head = sha
+        self.num_commits += 1
+
+    def data(self, path_in_repo: str) -> dict:
+        """Request data at the head"""
+        return json.loads(self.snapshots[self.head][path_in_repo])
+
+    def repo_info(self, repo_id: str, repo_type: Optional[str] = None, **kwargs):
+        return SimpleNamespace(sha=self.head)
+
+    def list_repo_tree(self, repo_id: str, revision: Optional[str] = None, repo_type: Optional[str] = None, **kwargs):
+        files = self.snapshots[revision or self.head]
+        return [SimpleNamespace(path=path, blob_id=_blob_id(content)) for path, content in files.items()]
+
+    def hf_hub_download(
+        self, repo_id: str, filename: str, revision: Optional[str] = None, repo_type: Optional[str] = None,
+        local_dir: str = ".", **kwargs,
+    ) -> str:
+        local_path = os.path.join(local_dir, filename)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, "wb") as fp:
+            fp.write(self.snapshots[revision or self.head][filename])
+        return local_path
+
+    def create_commit(
+        self, repo_id: str, operations: list, commit_message: str, parent_commit: Optional[str] = None,
+        repo_type: Optional[str] = None, **kwargs,
+    ):
+        with self._lock:
+            if parent_commit is not None and parent_commit != self.head:
+                self.num_rejected += 1
+                response = SimpleNamespace(status_code=412, headers={}, request=None)
+                raise HfHubHTTPError(f"412: parent commit {parent_commit} is not the head {self.head}", response=response)
+            files = dict(self.snapshots[self.head])
+            for operation in operations:
+                with operation.as_file() as fp:
+                    files[operation.path_in_repo] = fp.read()
+            self._add_snapshot(files, commit_message)
+            return SimpleNamespace(oid=self.head)
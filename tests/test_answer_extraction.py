@@ -0,0 +1,31 @@
+import pytest
+
+from cot_eval.answer_extraction import NOT_PARSED, extract_answer
+
+LABELS = list("ABCDE")
+
+
+@pytest.mark.parametrize("trace,expected", [
+    ("The passage rules out A and C.\nFinal answer: B", 1),
+    ("... so the final answer is (D).", 3),
+    ("Final Answer: **C**", 2),
+    ("The correct answer is option E.", 4),
+    ("Answer: A\n", 0),
+    ("Therefore, (B) is consistent with all facts.", 1),
+    ("Final answer: A. On second thought, final answer: C.", 2),
+])
+def test_stated_answers_are_parsed(trace, expected):
+    assert extract_answer(trace, LABELS) == expected
+
+
+@pytest.mark.parametrize("trace", [
+    "I think the best option is a compromise",
+    "The best option is A compromise between both views",
+    "final answer: a",
+    "The answer: Either way, nothing follows.",
+    "Final answer: F",  # not a label of the item
+    "",
+    None,
+])
+def test_prose_is_not_parsed(trace):
+    assert extract_answer(trace, LABELS) == NOT_PARSED
@@ -0,0 +1,34 @@
+import json
+
+import numpy as np
+
+from cot_eval.bootstrap import load_sample_correctness, paired_bootstrap
+
+
+def test_samples_are_keyed_by_example_id(tmp_path):
+    samples = [
+        {"doc_id": 0, "doc": {"example_id": 17}, "acc": 1.0},
+        {"doc_id": 1, "doc": {"example_id": 3}, "acc": 0.0},
+    ]
+    path = tmp_path / "samples_a_cot.jsonl"
+    path.write_text("\n".join(json.dumps(s) for s in samples))
+
+    assert load_sample_correctness(str(path)) == {17: 1.0, 3: 0.0}
+
+
+def test_legacy_samples_are_keyed_by_doc_id(tmp_path):
+    path = tmp_path / "samples_a_cot.jsonl"
+    path.write_text(json.dumps([{"doc_id": 0, "doc": {"passage": "p"}, "acc": 1.0}, {"doc_id": 1, "acc": 0.0}]))
+
+    assert load_sample_correctness(str(path)) == {0: 1.0, 1: 0.0}
+
+
+def test_unbounded_relative_ci_is_json_safe():
+    base = np.array([1.0] + [0.0] * 9)  # base accuracy 0 in about a third of the resamples
+    cot = np.ones((1, 10))
+
+    cis = paired_bootstrap(base, cot)
+
+    assert cis["delta_rel_ci"][0] is not None and np.isfinite(cis["delta_rel_ci"][0])
+    assert cis["delta_rel_ci"][1] is None
+    json.dumps(cis, allow_nan=False)
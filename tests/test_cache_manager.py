@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+from cot_eval.cache_manager import CacheManager
+from cot_eval.run_manifest import RunManifest
+
+
+def packed_node(tmp_path):
+    """Node cache dir with two packed jobs: job_0 runs, job_1 is planned but has not started its run yet"""
+    node = tmp_path / "cache"
+    os.makedirs(node / "jobs")
+    for i, model in enumerate(["org/model-0", "org/model-1"]):
+        with open(node / "jobs" / f"job_{i}.json", "w") as fp:
+            json.dump({"model": model, "revision": "main", "gpu_ids": [i]}, fp)
+    RunManifest.for_model("org/model-0", "main", cache_dir=str(node / "job_0")).start("org/model-0", "main", "inputs")
+    return node
+
+
+def test_packed_job_pins_models_of_sibling_jobs(tmp_path, monkeypatch):
+    node = packed_node(tmp_path)
+    monkeypatch.setenv("COTEVAL_NODE_CACHE_DIR", str(node))
+
+    manager = CacheManager(cache_dir=str(node / "job_1"), hf_cache_dir=str(tmp_path / "hub"))
+
+    assert manager.pinned_models() == ["org/model-0", "org/model-1"]
+
+
+def test_finished_runs_do_not_pin(tmp_path):
+    node = packed_node(tmp_path)
+    os.remove(node / "jobs" / "job_1.json")
+    RunManifest.for_model("org/model-0", "main", cache_dir=str(node / "job_0")).finish()
+
+    manager = CacheManager(cache_dir=str(node), hf_cache_dir=str(tmp_path / "hub"))
+
+    assert manager.pinned_models() == ["org/model-0"]  # still a planned packed job
+    os.remove(node / "jobs" / "job_0.json")
+    assert manager.pinned_models() == []
+
+
+def artifact(cache_dir, name, size_mb=1, age_days=0.0):
+    path = cache_dir / name
+    os.makedirs(path.parent, exist_ok=True)
+    path.write_bytes(b"x" * size_mb * 2**20)
+    mtime = time.time() - age_days * 86400
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def manager(tmp_path, budget_mb=None, **kwargs):
+    return CacheManager(
+        cache_dir=str(tmp_path / "cache"),
+        hf_cache_dir=str(tmp_path / "hub"),
+        budget_gb=budget_mb / 1024 if budget_mb is not None else None,
+        min_free_gb=0,
+        **kwargs,
+    )
+
+
+def test_least_recently_used_artifacts_are_evicted_until_within_budget(tmp_path):
+    cache_dir = tmp_path / "cache"
+    for i, name in enumerate(["logs/a.log", "TMP/b", "profiles/c.json", "logs/d.log"]):
+        artifact(cache_dir, name, age_days=4 - i)
+
+    evicted = manager(tmp_path, budget_mb=2.5).evict()
+
+    assert [e.name for e in evicted] == ["logs/a.log", "TMP/b"]
+    assert sorted(os.listdir(cache_dir / "logs")) == ["d.log"]
+
+
+def test_stale_artifacts_are_evicted_within_budget(tmp_path):
+    cache_dir = tmp_path / "cache"
+    artifact(cache_dir, "logs/old.log", age_days=10)
+    artifact(cache_dir, "logs/new.log", age_days=1)
+
+    evicted = manager(tmp_path, budget_mb=100, max_artifact_age_days=7).evict()
+
+    assert [e.name for e in evicted] == ["logs/old.log"]
+
+
+def test_active_run_artifacts_and_shipped_harness_templates_are_kept(tmp_path):
+    cache_dir = tmp_path / "cache"
+    RunManifest.for_model("org/model-0", "main", cache_dir=str(cache_dir)).start("org/model-0", "main", "inputs")
+    artifact(cache_dir, "logs/run.log")  # written during the active run
+    artifact(cache_dir, "logs/earlier.log", age_days=1)
+    for name in ["utils_logikon.py", "_logikon_cot_template_yaml", "logiqa_base.yaml"]:
+        artifact(cache_dir, f"eleuther/tasks/logikon/{name}", age_days=30)  # copied with the checkout's mtimes
+    artifact(cache_dir, "eleuther/tasks/logikon/HandsOn_0_logiqa_cot.yaml", age_days=30)
+
+    evicted = manager(tmp_path, budget_mb=0, max_artifact_age_days=7).evict()
+
+    assert sorted(e.name for e in evicted) == ["eleuther/tasks/logikon/HandsOn_0_logiqa_cot.yaml", "logs/earlier.log"]
+    assert sorted(os.listdir(cache_dir / "eleuther/tasks/logikon")) == [
+        "_logikon_cot_template_yaml", "logiqa_base.yaml", "utils_logikon.py",
+    ]
@@ -0,0 +1,61 @@
+import importlib.util
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def cleanup():
+    spec = importlib.util.spec_from_file_location(
+        "cleanup_traces_hf", os.path.join(os.path.dirname(__file__), os.pardir, "scripts", "cleanup_traces_hf.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reconcile(cleanup, cot_configs, trace_files):
+    unit_files = cleanup.trace_units(trace_files)
+    return cleanup.Reconciliation(
+        cot_configs={name: f"data/org/model/{name}.json" for name in cot_configs},
+        unknown_aliases=[],
+        traces_configs=set(unit_files),
+        traces_datadirs=set(unit_files),
+        unit_files=unit_files,
+    )
+
+
+def test_units_of_2_0_trace_files(cleanup):
+    units = cleanup.trace_units([
+        "data/org/model/brave-owl-1234-logiqa2.parquet",
+        "data/org/model/brave-owl-1234-logiqa.parquet",
+        "data/org/model/brave-owl-1234-lsat-ar-perm1.parquet",
+        "data/org/model/brave-owl-1234-lsat-ar-screen0.parquet",
+    ])
+
+    assert units == {
+        "brave-owl-1234_logiqa2": ["data/org/model/brave-owl-1234-logiqa2.parquet"],
+        "brave-owl-1234_logiqa": ["data/org/model/brave-owl-1234-logiqa.parquet"],
+        "brave-owl-1234_lsat-ar": ["data/org/model/brave-owl-1234-lsat-ar-perm1.parquet"],
+    }
+
+
+def test_legacy_results_do_not_block_cleanup(cleanup):
+    diff = reconcile(
+        cleanup,
+        ["brave-owl-1234_logiqa", "old-cat-42_logiqa"],
+        ["data/org/model/brave-owl-1234-logiqa.parquet", "data/org/model/failed-run-7-logiqa.parquet"],
+    )
+
+    assert diff.missing == []
+    assert diff.legacy == ["old-cat-42_logiqa"]
+    assert diff.planned_deletions() == ["data/org/model/failed-run-7-logiqa.parquet"]
+    assert diff.report()["legacy_cot_configs"] == [{"name": "old-cat-42_logiqa", "path": "data/org/model/old-cat-42_logiqa.json"}]
+
+
+def test_traces_missing_for_a_task_of_a_2_0_config(cleanup):
+    diff = reconcile(cleanup, ["brave-owl-1234_logiqa", "brave-owl-1234_lsat-ar"], ["data/org/model/brave-owl-1234-logiqa.parquet"])
+
+    assert diff.missing == ["brave-owl-1234_lsat-ar"]
+    assert diff.legacy == []
+    assert not diff.all_clear
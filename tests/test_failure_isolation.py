@@ -0,0 +1,65 @@
+import importlib.util
+import os
+
+import pytest
+
+
+class FlakyChain:
+    """Chain stand-in: batches with an input in `failing` fail (only `failures` times, if set)"""
+
+    def __init__(self, failing=(), failures=None):
+        self.failing = set(failing)
+        self.failures = failures
+
+    def batch(self, inputs):
+        bad = [i for i in inputs if i["passage"] in self.failing]
+        if bad and self.failures != 0:
+            if self.failures is not None:
+                self.failures -= 1
+            raise ValueError(f"prompt too long: {bad[0]['passage']}")
+        return [f"reasoning on {i['passage']}" for i in inputs]
+
+
+def inputs(n):
+    return [{"passage": f"p{i}", "question_options": "q"} for i in range(n)]
+
+
+def test_failing_example_is_isolated():
+    main = pytest.importorskip("cot_eval.__main__")
+    stats = {"failed": 0, "discarded": 0}
+
+    traces, errors = main.batch_isolating_failures(FlakyChain(failing=["p5"]), inputs(8), stats)
+
+    assert traces == [f"reasoning on p{i}" if i != 5 else "" for i in range(8)]
+    assert [e is not None for e in errors] == [i == 5 for i in range(8)]
+    assert errors[5].startswith("ValueError: prompt too long")
+    assert stats["failed"] == 1
+    assert stats["discarded"] == 8 + 4 + 2 + 1 + 1  # bisected batches, then the retry of p5
+
+
+def test_transient_failure_is_retried():
+    main = pytest.importorskip("cot_eval.__main__")
+    stats = {"failed": 0, "discarded": 0}
+
+    traces, errors = main.batch_isolating_failures(FlakyChain(failing=["p0"], failures=1), inputs(1), stats)
+
+    assert traces == ["reasoning on p0"] and errors == [None]
+    assert stats == {"failed": 0, "discarded": 1}
+
+
+def load_harness_utils():
+    spec = importlib.util.spec_from_file_location(
+        "utils_logikon", os.path.join(os.path.dirname(__file__), os.pardir, "eleuther", "tasks", "logikon", "utils_logikon.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_failed_examples_are_scored_as_wrong():
+    utils = load_harness_utils()
+    results = [(-3.0, False), (-1.0, True), (-2.0, False)]
+
+    assert utils.process_results_cot({"answer": 1, "reasoning_error": None}, results) == {"acc": 1.0}
+    assert utils.process_results_cot({"answer": 1, "reasoning_error": "ValueError: boom"}, results) == {"acc": 0.0}
+    assert utils.process_results_cot({"answer": 0}, results) == {"acc": 0.0}
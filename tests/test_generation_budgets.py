@@ -0,0 +1,145 @@
+import importlib.util
+import os
+import sys
+import threading
+from argparse import Namespace
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, List, Optional
+
+import pytest
+from langchain_core.language_models.llms import BaseLLM
+
+from cot_eval.generation_budgets import TwoTierLLM
+from cot_eval.model_server import ServerLLM
+
+PROMPTS = [f"Passage {'x' * k}\nReasoning:" for k in range(0, 30, 3)]
+STOP = ["relevant facts"]  # words 9 and 10 of the stand-in's completion, spans a first tier of 10 tokens
+
+
+def load_stand_in_server():
+    spec = importlib.util.spec_from_file_location(
+        "stand_in_model_server", os.path.join(os.path.dirname(__file__), os.pardir, "scripts", "stand_in_model_server.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def server_llm():
+    stand_in = load_stand_in_server()
+    args = Namespace(model="stand-in", startup_delay=0.0, latency=0.0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), stand_in.make_handler(stand_in.StandInState(args)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield ServerLLM(base_url=f"http://127.0.0.1:{server.server_port}", model="stand-in", max_new_tokens=24)
+    server.shutdown()
+
+
+def generations(result):
+    return [(g[0].text, g[0].generation_info["finish_reason"]) for g in result.generations]
+
+
+@pytest.mark.parametrize("stop", [None, STOP])
+def test_two_tier_output_equals_single_tier(server_llm, stop):
+    single = generations(server_llm._generate(PROMPTS, stop=stop))
+    two_tier = TwoTierLLM(llm=server_llm, first_tier=10)
+
+    assert generations(two_tier._generate(PROMPTS, stop=stop)) == single
+    stats = two_tier.pop_stats()
+    assert 0 < stats["continued"] < len(PROMPTS)
+    assert stats["reserved_tokens_saved"] == len(PROMPTS) * 24 - (len(PROMPTS) * 10 + stats["continued"] * 14)
+    assert {reason for _, reason in single} == ({"stop", "length"} if stop is None else {"stop"})
+
+
+class SamplingParams:
+    """vLLM 0.3.2 SamplingParams: a plain class (no annotations), defaults of 16 tokens and no stop words"""
+
+    FIELDS = {
+        "n", "best_of", "presence_penalty", "frequency_penalty", "repetition_penalty", "temperature", "top_p", "top_k",
+        "min_p", "use_beam_search", "length_penalty", "early_stopping", "stop", "stop_token_ids", "ignore_eos",
+        "max_tokens", "logprobs", "prompt_logprobs", "skip_special_tokens", "spaces_between_special_tokens",
+    }
+
+    def __init__(self, **kwargs):
+        unknown = set(kwargs) - self.FIELDS
+        if unknown:
+            raise TypeError(f"unexpected keyword arguments {unknown}")
+        self.max_tokens = kwargs.get("max_tokens", 16)
+        self.stop = kwargs.get("stop") or []
+
+
+class StandInEngine:
+    """Greedy engine: completes prompts with tokens 1000, 1001, ... (text " t1000 t1001 ..."), 5 to 30 per prompt
+
+    Prompts are tokenized by character; prompt token ids ending in a partial
+    completion are continued where it stopped.
+    """
+
+    def generate(self, prompts=None, sampling_params=None, prompt_token_ids=None, use_tqdm=True):
+        if prompt_token_ids is None:
+            if not all(isinstance(p, str) for p in prompts):
+                raise TypeError("prompts must be strings")
+            prompt_token_ids = [[ord(c) for c in p] for p in prompts]
+        return [self._complete(ids, sampling_params) for ids in prompt_token_ids]
+
+    @staticmethod
+    def _complete(ids, params):
+        base = [i for i in ids if i < 1000]
+        done = len(ids) - len(base)
+        length = 5 + len(base) % 26
+        tokens = list(range(1000 + done, 1000 + length))
+        finish_reason = "stop"
+        if len(tokens) > params.max_tokens:
+            tokens, finish_reason = tokens[:params.max_tokens], "length"
+        text = "".join(f" t{t}" for t in tokens)
+        for stop in params.stop:
+            if stop in text:
+                text, finish_reason = text[:text.index(stop)], "stop"
+                tokens = tokens[:text.count(" t")]
+        output = SimpleNamespace(text=text, finish_reason=finish_reason, token_ids=tokens)
+        return SimpleNamespace(prompt_token_ids=ids, outputs=[output])
+
+
+class StandInVLLM(BaseLLM):
+    """langchain's VLLM with a stand-in engine as client"""
+
+    client: Any = None
+    max_new_tokens: int = 24
+    temperature: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "vllm"
+
+    @property
+    def _default_params(self) -> dict:
+        return {
+            "n": 1, "best_of": None, "max_tokens": self.max_new_tokens, "top_k": -1, "top_p": 1.0,
+            "temperature": self.temperature, "presence_penalty": 0.0, "frequency_penalty": 0.0, "stop": None,
+            "ignore_eos": False, "use_beam_search": False, "logprobs": None,
+        }
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        from langchain_core.outputs import Generation, LLMResult
+        from vllm import SamplingParams
+
+        params = SamplingParams(**{**self._default_params, **kwargs, "stop": stop})
+        outputs = self.client.generate(prompts, params)
+        return LLMResult(generations=[
+            [Generation(text=o.outputs[0].text, generation_info={"finish_reason": o.outputs[0].finish_reason})]
+            for o in outputs
+        ])
+
+
+@pytest.mark.parametrize("stop", [None, ["t1011 t1012"]])
+def test_two_tier_vllm_continues_from_token_ids(monkeypatch, stop):
+    monkeypatch.setitem(sys.modules, "vllm", SimpleNamespace(SamplingParams=SamplingParams))
+    llm = StandInVLLM(client=StandInEngine())
+    single = generations(llm._generate(PROMPTS, stop=stop))
+    two_tier = TwoTierLLM(llm=llm, first_tier=12)
+
+    assert generations(two_tier._generate(PROMPTS, stop=stop)) == single
+    assert 0 < two_tier.pop_stats()["continued"] < len(PROMPTS)
+    if stop is None:
+        assert max(len(text.split()) for text, _ in single) == 24  # full budget, not the engine's default of 16
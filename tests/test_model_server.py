@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+from cot_eval import model_server
+from cot_eval.model_server import ModelServer, ServerLLM, health, vllm_server_command
+
+STAND_IN_SERVER = os.path.join(os.path.dirname(__file__), os.pardir, "scripts", "stand_in_model_server.py")
+STAND_IN_COMMAND = f"{sys.executable} {STAND_IN_SERVER} --host {{host}} --port {{port}} --model {{model}} --startup_delay 1"
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = ModelServer.for_model({"pretrained": "org/model"}, server_command=STAND_IN_COMMAND, startup_timeout=30, poll_interval=0.2)
+    with server:
+        yield server
+
+
+def test_server_is_healthy_after_start(server):
+    assert health(server.base_url)
+    assert server.ready - server.started >= 1.0  # waited for the startup delay
+
+
+def test_completions_with_stop_words_and_finish_reasons(server):
+    llm = ServerLLM(base_url=server.base_url, model="org/model", max_new_tokens=12, batch_size=2)
+    prompts = [f"Passage {'x' * k}\nReasoning:" for k in range(5)]
+
+    result = llm._generate(prompts)
+    stopped = llm._generate(prompts, stop=["step."])
+
+    assert all(g[0].text.startswith(" Let's think step by step.") for g in result.generations)
+    assert {g[0].generation_info["finish_reason"] for g in result.generations} <= {"stop", "length"}
+    assert "length" in {g[0].generation_info["finish_reason"] for g in result.generations}
+    assert all(len(g[0].text.split()) <= 12 for g in result.generations)
+    assert [g[0].text for g in stopped.generations] == [" Let's think step by "] * len(prompts)
+    assert {g[0].generation_info["finish_reason"] for g in stopped.generations} == {"stop"}
+    assert stopped.llm_output["token_usage"]["completion_tokens"] == 4 * len(prompts)
+
+
+def test_load_report_after_stop():
+    server = ModelServer.for_model({"pretrained": "org/model"}, server_command=STAND_IN_COMMAND, startup_timeout=30, poll_interval=0.2)
+    with server:
+        ServerLLM(base_url=server.base_url, model="org/model", max_new_tokens=8)._generate(["a", "bb", "ccc"])
+
+    report = server.load_report()
+
+    assert server.process.poll() is not None
+    assert report["startup_s"] >= 1.0
+    assert report["requests"] == 3
+    assert report["generation_tokens"] == 3 * 8
+    assert report["load_samples"] >= 1
+
+
+def test_prefix_caching_only_with_supporting_vllm(monkeypatch):
+    args = {"pretrained": "org/model", "max_length": "2048"}
+
+    monkeypatch.setattr(model_server, "vllm_version", lambda: (0, 3, 2))
+    assert "--enable-prefix-caching" not in vllm_server_command(args, "127.0.0.1", 8000)
+    monkeypatch.setattr(model_server, "vllm_version", lambda: (0, 4, 1))
+    assert "--enable-prefix-caching" in vllm_server_command(args, "127.0.0.1", 8000)
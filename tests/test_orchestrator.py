@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from cot_eval.orchestrator import Orchestrator, ResourcePool, Resources, Stage, fake_stage
+from cot_eval.run_manifest import RunManifest
+
+DURATION = 0.2
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("COTEVAL_CACHE_DIR", str(tmp_path))  # timeline spans of stages
+
+
+class Recorder:
+    """Wraps fake stages, recording start, end and GPUs of every run"""
+
+    def __init__(self):
+        self.runs = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name, deps=(), gpus=0, memory_gb=0.0, duration=DURATION, fail=False):
+        fake = fake_stage(Stage(name=name, run=None, deps=list(deps), resources=Resources(gpus, memory_gb)), duration)
+
+        def run(context):
+            start = time.monotonic()
+            fake.run(context)
+            with self._lock:
+                self.runs[name] = (start, time.monotonic(), context.gpu_ids)
+            if fail:
+                raise RuntimeError(f"{name} failed")
+
+        return Stage(name=name, run=run, deps=fake.deps, resources=fake.resources)
+
+    def overlap(self, a, b) -> bool:
+        return self.runs[a][0] < self.runs[b][1] and self.runs[b][0] < self.runs[a][1]
+
+
+def pool(num_gpus=2, memory_gb=64):
+    return ResourcePool(num_gpus, memory_gb, visible_devices=[str(i) for i in range(num_gpus)])
+
+
+def test_deps_finish_before_dependents_start():
+    rec = Recorder()
+    stages = [
+        rec.stage("eval_cot", deps=["generate"], gpus=1),
+        rec.stage("generate", deps=["create_configs"], gpus=1),
+        rec.stage("create_configs"),
+    ]
+
+    status = Orchestrator(stages, pool()).run()
+
+    assert status == {"create_configs": "finished", "generate": "finished", "eval_cot": "finished"}
+    assert rec.runs["create_configs"][1] <= rec.runs["generate"][0]
+    assert rec.runs["generate"][1] <= rec.runs["eval_cot"][0]
+
+
+def test_independent_stages_run_in_parallel_on_disjoint_gpus():
+    rec = Recorder()
+    stages = [rec.stage("eval_orig", gpus=1), rec.stage("generate", gpus=1)]
+
+    Orchestrator(stages, pool(num_gpus=2)).run()
+
+    assert rec.overlap("eval_orig", "generate")
+    assert {rec.runs["eval_orig"][2][0], rec.runs["generate"][2][0]} == {"0", "1"}
+
+
+def test_stages_wait_for_free_gpus():
+    rec = Recorder()
+    stages = [rec.stage("eval_orig", gpus=1), rec.stage("generate", gpus=1), rec.stage("upload")]
+
+    Orchestrator(stages, pool(num_gpus=1)).run()
+
+    assert not rec.overlap("eval_orig", "generate")
+    assert rec.overlap("upload", "eval_orig")  # needs no GPU, backfills
+
+
+def test_finished_stages_in_manifest_are_skipped(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.json"))
+    manifest.start("org/model", "main", "inputs")
+    manifest.mark_done("generate")
+    rec = Recorder()
+    stages = [rec.stage("generate", gpus=1), rec.stage("eval_cot", deps=["generate"], gpus=1)]
+
+    status = Orchestrator(stages, pool(), manifest=manifest).run()
+
+    assert status == {"generate": "skipped", "eval_cot": "finished"}
+    assert "generate" not in rec.runs
+    assert manifest.is_done("eval_cot")
+
+
+def test_failure_stops_dependents_and_is_not_recorded(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.json"))
+    manifest.start("org/model", "main", "inputs")
+    rec = Recorder()
+    stages = [
+        rec.stage("generate", gpus=1, fail=True),
+        rec.stage("eval_cot", deps=["generate"], gpus=1),
+        rec.stage("eval_orig", gpus=1, duration=2 * DURATION),
+    ]
+
+    with pytest.raises(RuntimeError, match="eval_cot"):
+        Orchestrator(stages, pool(), manifest=manifest).run()
+
+    assert "eval_cot" not in rec.runs
+    assert "eval_orig" in rec.runs  # running stages are waited for
+    assert not manifest.is_done("generate")
+    assert manifest.is_done("eval_orig")
+
+
+def test_invalid_graphs_are_rejected():
+    rec = Recorder()
+    with pytest.raises(ValueError, match="cycle"):
+        Orchestrator([rec.stage("a", deps=["b"]), rec.stage("b", deps=["a"])], pool())
+    with pytest.raises(ValueError, match="unknown"):
+        Orchestrator([rec.stage("a", deps=["c"])], pool())
+    with pytest.raises(ValueError, match="more resources"):
+        Orchestrator([rec.stage("a", gpus=4)], pool(num_gpus=2))
@@ -0,0 +1,74 @@
+from datasets import Dataset
+
+from cot_eval import preprocessing
+from cot_eval.preprocessing import (
+    EXAMPLE_ID_COLUMN,
+    PERMUTATION_COLUMN,
+    PREFIX_BLOCK_SIZE,
+    SEED_COLUMN,
+    load_and_preprocess_permutations,
+    prefill_reuse,
+    split_permutations,
+)
+
+SEEDS = [42, 43, 44]
+
+
+def task_dataset(n=4):
+    return Dataset.from_dict({
+        "passage": [f"passage {i // 2}" for i in range(n)],  # two questions per passage
+        "question": [f"question {i}" for i in range(n)],
+        "options": [[f"option {i}.{j}" for j in range(4)] for i in range(n)],
+        "answer": [i % 4 for i in range(n)],
+    })
+
+
+def permutations(monkeypatch, n=4):
+    monkeypatch.setattr(preprocessing, "load_task", lambda task, token=None: task_dataset(n))
+    return load_and_preprocess_permutations("logiqa", token=None, answer_shuffle_seeds=SEEDS)
+
+
+def test_permutations_of_an_example_are_adjacent(monkeypatch):
+    ds = permutations(monkeypatch)
+
+    assert len(ds) == 4 * len(SEEDS)
+    assert ds[EXAMPLE_ID_COLUMN] == [i for i in range(4) for _ in SEEDS]
+    assert ds[PERMUTATION_COLUMN] == [0, 1, 2] * 4
+    assert ds[SEED_COLUMN] == SEEDS * 4
+    for row in ds:
+        original = task_dataset()[row[EXAMPLE_ID_COLUMN]]
+        assert sorted(row["options"]) == sorted(original["options"])
+        assert row["options"][row["answer"]] == original["options"][original["answer"]]  # gold answer follows its option
+
+
+def test_split_permutations(monkeypatch):
+    ds = permutations(monkeypatch)
+
+    split = split_permutations(ds)
+
+    assert list(split) == [0, 1, 2]
+    assert all(part[EXAMPLE_ID_COLUMN] == [0, 1, 2, 3] for part in split.values())
+    assert split[1][SEED_COLUMN] == [43] * 4
+    plain = task_dataset()
+    assert split_permutations(plain) == {0: plain}
+
+
+def test_prefill_reuse(monkeypatch):
+    ds = permutations(monkeypatch)
+    template = "Read the passage and answer. " * 8 + "{passage}\n{question_options}\nReasoning:"
+
+    def count_tokens(texts):
+        return [len(t) for t in texts]  # one token per character
+
+    reuse = prefill_reuse(ds, template, count_tokens)
+
+    prefix = len(template[:template.index("{question_options}")].replace("{passage}", "passage 0"))
+    cached = prefix // PREFIX_BLOCK_SIZE * PREFIX_BLOCK_SIZE
+    # 2 passages with 2 questions x 3 permutations each: 5 rows reuse the prefix, vs. 1 per permutation in separate runs
+    assert reuse["reused_tokens"] == 2 * 5 * cached
+    assert reuse["reused_tokens_separate_runs"] == 2 * (6 - 3) * cached
+    assert reuse["prompt_tokens"] == sum(count_tokens([
+        template.replace("{passage}", p).replace("{question_options}", q).replace("\nReasoning:", "")
+        for p, q in zip(ds["passage"], ds["question_options"])
+    ]))
+    assert 0 < reuse["reuse"] < 1
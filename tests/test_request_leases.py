@@ -0,0 +1,132 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from cot_eval import request_leases
+from cot_eval.request_leases import LeaseConflict, RequestClaimer, claimable_requests
+from cot_eval.requests_queue import RequestsQueueIndex
+from tests.hub_stand_in import StandInHfApi
+
+REPO_ID = "stand-in/requests"
+
+
+def request_file(model: str, status: str = "PENDING", submitted_time: str = "2024-05-01T12:00:00Z", **kwargs):
+    path = f"{model}_eval_request_False_bfloat16_Original.json"
+    data = {"model": model, "status": status, "precision": "bfloat16", "submitted_time": submitted_time, "params": 7, **kwargs}
+    return path, data
+
+
+def make_claimer(api: StandInHfApi, tmp_path, worker_id: str, ttl: float = 60) -> RequestClaimer:
+    index = RequestsQueueIndex(REPO_ID, os.path.join(tmp_path, worker_id), api)
+    return RequestClaimer(index, worker_id=worker_id, ttl=ttl)
+
+
+@pytest.fixture(autouse=True)
+def short_backoff(monkeypatch):
+    monkeypatch.setattr(request_leases, "CAS_BACKOFF", 0.01)
+
+
+def race(claimers):
+    """Claim with all claimers at once, return their results"""
+    results = [None] * len(claimers)
+    barrier = threading.Barrier(len(claimers))
+
+    def claim(i):
+        barrier.wait()
+        results[i] = claimers[i].claim()
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(len(claimers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_claims_have_one_winner(tmp_path):
+    api = StandInHfApi(dict([request_file("org/model-a")]))
+    claimers = [make_claimer(api, tmp_path, f"worker-{i}") for i in range(8)]
+
+    results = race(claimers)
+
+    winners = [c.worker_id for c, r in zip(claimers, results) if r is not None]
+    assert len(winners) == 1
+    path, _ = request_file("org/model-a")
+    assert api.data(path)["status"] == "RUNNING"
+    assert api.data(path)["lease"]["worker_id"] == winners[0]
+
+
+def test_concurrent_claims_spread_over_requests(tmp_path):
+    files = dict(request_file(f"org/model-{i}", submitted_time=f"2024-05-0{i + 1}T12:00:00Z") for i in range(3))
+    api = StandInHfApi(files)
+    claimers = [make_claimer(api, tmp_path, f"worker-{i}") for i in range(6)]
+
+    results = race(claimers)
+
+    claimed = [r.model for r in results if r is not None]
+    assert sorted(claimed) == ["org/model-0", "org/model-1", "org/model-2"]
+    assert all(api.data(path)["status"] == "RUNNING" for path in files)
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    path, data = request_file("org/model-a")
+    api = StandInHfApi({path: data})
+    crashed = make_claimer(api, tmp_path, "crashed", ttl=0)
+    other = make_claimer(api, tmp_path, "other")
+
+    claimed = crashed.claim()
+    assert claimed is not None
+    assert [r.model for r in claimable_requests(other.index)] == []  # index not synced yet
+    other.index.sync()
+    assert [r.model for r in claimable_requests(other.index)] == ["org/model-a"]
+
+    reclaimed = other.claim()
+    assert reclaimed is not None and reclaimed.lease["worker_id"] == "other"
+    with pytest.raises(LeaseConflict):
+        crashed.renew(claimed)
+
+
+def test_live_lease_is_not_reclaimed(tmp_path):
+    path, data = request_file("org/model-a")
+    api = StandInHfApi({path: data})
+    holder = make_claimer(api, tmp_path, "holder")
+    other = make_claimer(api, tmp_path, "other")
+
+    claimed = holder.claim()
+    assert other.claim() is None
+    holder.renew(claimed)
+    holder.release(claimed, "FINISHED")
+    assert api.data(path)["status"] == "FINISHED"
+    assert "lease" not in api.data(path)
+
+
+def test_legacy_running_request_is_reclaimed_after_grace(tmp_path):
+    now = datetime.now(timezone.utc)
+    old = (now - timedelta(seconds=request_leases.LEGACY_RUNNING_GRACE + 60)).isoformat()
+    recent = (now - timedelta(hours=1)).isoformat()
+    files = dict([
+        request_file("org/stale", status="RUNNING", submitted_time=old),
+        request_file("org/recent", status="RUNNING", submitted_time=recent),
+    ])
+    api = StandInHfApi(files)
+    claimer = make_claimer(api, tmp_path, "worker")
+
+    claimed = claimer.claim()
+
+    assert claimed is not None and claimed.model == "org/stale"
+    assert claimer.claim() is None
+
+
+def test_request_failing_repeatedly_is_set_to_failed(tmp_path):
+    path, data = request_file("org/model-a")
+    api = StandInHfApi({path: data})
+
+    for attempt in range(1, 4):
+        claimed = make_claimer(api, tmp_path, f"crashed-{attempt}", ttl=0).claim()
+        assert claimed is not None and claimed.attempts == attempt
+
+    assert make_claimer(api, tmp_path, "next").claim() is None
+    assert api.data(path)["status"] == "FAILED"
+    assert "lease" not in api.data(path)
@@ -0,0 +1,63 @@
+from cot_eval.requests_queue import EvalRequest
+from cot_eval.scheduler import GpuInventory, estimate_memory_gb, plan_jobs, tensor_parallel_size_for
+
+NODE = GpuInventory(num_gpus=4, memory_gb=80, gpu_memory_utilization=0.9)
+
+
+def queue(*params, precision: str = "bfloat16"):
+    """Synthetic queue: one request per params value, in order of submission"""
+    return [
+        EvalRequest(
+            model=f"org/model-{i}",
+            status="PENDING",
+            json_filepath=f"org/model-{i}.json",
+            precision=precision,
+            params=p,
+            submitted_time=f"2024-05-{i + 1:02d}T12:00:00",
+        )
+        for i, p in enumerate(params)
+    ]
+
+
+def test_tensor_parallel_size():
+    assert tensor_parallel_size_for(estimate_memory_gb(7, "bfloat16"), NODE) == 1
+    assert tensor_parallel_size_for(estimate_memory_gb(70, "bfloat16"), NODE) == 4
+    assert tensor_parallel_size_for(estimate_memory_gb(70, "4bit"), NODE) == 1
+    assert tensor_parallel_size_for(estimate_memory_gb(400, "bfloat16"), NODE) is None
+
+
+def test_small_models_are_packed_onto_disjoint_gpus():
+    jobs = plan_jobs(queue(7, 7, 13, 7, 7), NODE)
+
+    assert [job.eval_request.model for job in jobs] == ["org/model-0", "org/model-1", "org/model-2", "org/model-3"]
+    assert [job.gpu_ids for job in jobs] == [[0], [1], [2], [3]]
+    assert all(job.tensor_parallel_size == 1 for job in jobs)
+
+
+def test_mixed_sizes_are_bin_packed():
+    node = GpuInventory(num_gpus=8, memory_gb=80)
+    jobs = plan_jobs(queue(70, 7, 7, 30), node)
+
+    assert [job.tensor_parallel_size for job in jobs] == [4, 1, 1, 2]
+    gpu_ids = [i for job in jobs for i in job.gpu_ids]
+    assert sorted(gpu_ids) == list(range(8))
+
+
+def test_oldest_request_waiting_for_gpus_blocks_younger_ones():
+    jobs = plan_jobs(queue(7, 70, 7), NODE)
+
+    # the 70B model needs all 4 GPUs, only 3 are free: the younger 7B model must not overtake it
+    assert [job.eval_request.model for job in jobs] == ["org/model-0"]
+
+
+def test_requests_that_never_fit_are_skipped():
+    jobs = plan_jobs(queue(400, None, 7), NODE)
+
+    assert [job.eval_request.model for job in jobs] == ["org/model-2"]
+
+
+def test_fifo_by_submission_time_and_max_jobs():
+    eval_requests = queue(7, 7, 7)
+    jobs = plan_jobs(list(reversed(eval_requests)), NODE, max_jobs=2)
+
+    assert [job.eval_request.model for job in jobs] == ["org/model-0", "org/model-1"]
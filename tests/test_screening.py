@@ -0,0 +1,82 @@
+import numpy as np
+
+from cot_eval.bootstrap import paired_bootstrap
+from cot_eval.screening import Screening, screening_record
+
+TASKS = {"logiqa": 651, "lsat-ar": 230}
+
+
+def screened_round(screening, p_base=0.4, p_cot=0.5, seed=0, gpu_seconds=lambda n: 60):
+    """Run the next round with synthetic correctness of base and one cot config, and GPU seconds for n examples"""
+    rng = np.random.default_rng(seed)
+    plan = screening.next_round()
+    correctness = {
+        task: {
+            "base": {i: float(rng.random() < p_base) for i in range(end - start)},
+            "HandsOn_0": {i: float(rng.random() < p_cot) for i in range(end - start)},
+        }
+        for task, (start, end) in plan["slices"].items()
+    }
+    screening.update(plan, correctness, gpu_seconds=gpu_seconds(sum(end - start for start, end in plan["slices"].values())))
+    return plan
+
+
+def test_alpha_is_spent_across_planned_rounds(tmp_path):
+    screening = Screening(str(tmp_path / "screening.json"), TASKS, first_round=100, growth=2.0, alpha=0.05)
+
+    assert screening.planned_rounds == 4  # 100, 200, 400, 651 examples
+    assert screening.alpha_per_round == 0.05 / 4
+    assert Screening(str(tmp_path / "small.json"), {"logiqa": 50}).planned_rounds == 1
+
+
+def test_round_cis_are_wider_than_unadjusted(tmp_path):
+    screening = Screening(str(tmp_path / "screening.json"), TASKS)
+    screened_round(screening)
+
+    for task, stats in screening.task_stats().items():
+        runs = screening.correctness[task]
+        doc_ids = sorted(runs["base"])
+        base = np.array([runs["base"][i] for i in doc_ids])
+        cot = np.array([[runs["HandsOn_0"][i] for i in doc_ids]])
+        lo_unadjusted, hi_unadjusted = paired_bootstrap(base, cot, alpha=screening.alpha)["delta_abs_ci"]
+        lo, hi = stats["delta_abs_ci"]
+        assert hi - lo > hi_unadjusted - lo_unadjusted
+
+
+def test_record_flags_alpha_spending(tmp_path):
+    screening = Screening(str(tmp_path / "screening.json"), TASKS)
+    while not screening.done:
+        screened_round(screening, seed=len(screening.rounds))
+
+    record = screening_record(screening.summary(), "org/model", "main", "bfloat16", list(TASKS))
+
+    flag = record["screening"]
+    assert flag["statistic"] == "max_over_configs"
+    assert flag["alpha_spending"] == "bonferroni"
+    assert flag["alpha_per_round"] == screening.alpha / screening.planned_rounds
+    assert all(decision is not None for decision in flag["decision"].values())
+    assert flag["gpu_hours_full_estimate_method"] in {"linear_fit", "proportional"}
+
+
+def test_full_estimate_pays_fixed_costs_once(tmp_path):
+    screening = Screening(str(tmp_path / "screening.json"), TASKS, max_halfwidth=0.0)  # screen everything
+    while not screening.done:
+        screened_round(screening, seed=len(screening.rounds), gpu_seconds=lambda n: 600 + 2.0 * n)
+
+    summary = screening.summary()
+
+    assert summary["gpu_hours_full_estimate_method"] == "linear_fit"
+    assert np.isclose(summary["gpu_fixed_seconds_per_round"], 600)
+    assert np.isclose(summary["gpu_seconds_per_example"], 2.0)
+    assert np.isclose(summary["gpu_hours_full_estimate"], (600 + 2.0 * sum(TASKS.values())) / 3600)
+    assert summary["gpu_hours_saved"] < 0  # fully screened in several rounds: fixed costs paid per round
+
+
+def test_full_estimate_of_a_single_round_is_proportional(tmp_path):
+    screening = Screening(str(tmp_path / "screening.json"), TASKS)
+    screened_round(screening, gpu_seconds=lambda n: 600 + 2.0 * n)
+
+    summary = screening.summary()
+
+    assert summary["gpu_hours_full_estimate_method"] == "proportional"
+    assert np.isclose(summary["gpu_hours_full_estimate"], summary["gpu_hours"] * sum(TASKS.values()) / 200)
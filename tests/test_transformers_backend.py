@@ -0,0 +1,71 @@
+import pytest
+
+from cot_eval.transformers_backend import TransformersCPU, length_buckets, truncate_at_stop
+
+
+def test_length_buckets():
+    lengths = [5, 1, 9, 3, 7]
+
+    assert length_buckets(lengths, batch_size=2) == [[1, 3], [0, 4], [2]]
+    assert length_buckets(lengths, batch_size=2, sort=False) == [[0, 1], [2, 3], [4]]
+    assert length_buckets([], batch_size=2) == []
+
+
+def test_truncate_at_stop():
+    assert truncate_at_stop("step 1. step 2.\nAnswer: B", ["\nAnswer", "step 2"]) == ("step 1. ", True)
+    assert truncate_at_stop("step 1.", ["\nAnswer"]) == ("step 1.", False)
+    assert truncate_at_stop("step 1.", None) == ("step 1.", False)
+
+
+PAD = 0
+COMPLETIONS = {"short": " ok.", "long": " step by step, and on and on", "stops": " first.\nQuestion: next"}
+
+
+class CharTokenizer:
+    """One token per character; pad (= eos) token 0; left padding"""
+
+    pad_token_id = PAD
+
+    def __call__(self, texts, return_tensors=None, padding=False):
+        import torch
+
+        ids = [[ord(c) for c in text] for text in texts]
+        if return_tensors != "pt":
+            return {"input_ids": ids}
+        width = max(len(x) for x in ids)
+        return {"input_ids": torch.tensor([[PAD] * (width - len(x)) + x for x in ids])}
+
+    def batch_decode(self, ids, skip_special_tokens=True):
+        return ["".join(chr(i) for i in row.tolist() if i != PAD) for row in ids]
+
+
+class CannedModel:
+    """Generates the canned completion of each prompt, padded with eos; stops at stop strings like transformers"""
+
+    def generate(self, input_ids, max_new_tokens, stop_strings=None, **kwargs):
+        import torch
+
+        rows = []
+        for row in input_ids.tolist():
+            prompt = "".join(chr(i) for i in row if i != PAD)
+            completion = COMPLETIONS[prompt][:max_new_tokens]
+            for stop in stop_strings or []:
+                if stop in completion:
+                    completion = completion[:completion.index(stop) + len(stop)]  # transformers keeps the stop string
+            new = [ord(c) for c in completion] + [PAD]  # eos
+            rows.append(row + (new + [PAD] * max_new_tokens)[:max_new_tokens])
+        return torch.tensor(rows)
+
+
+def test_finish_reasons():
+    pytest.importorskip("torch")
+    llm = TransformersCPU(model="stand-in", max_new_tokens=20, temperature=0, batch_size=2)
+    llm.tokenizer, llm.hf_model = CharTokenizer(), CannedModel()
+
+    result = llm._generate(["short", "long", "stops"], stop=["\nQuestion"])
+
+    texts = [g[0].text for g in result.generations]
+    reasons = [g[0].generation_info["finish_reason"] for g in result.generations]
+    assert texts == [" ok.", " step by step, and o", " first."]
+    assert reasons == ["stop", "length", "stop"]
+    assert result.llm_output["token_usage"]["completion_tokens"] == 4 + 20 + len(" first.\nQuestion")
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from cot_eval.requests_queue import EvalRequest
+from cot_eval.weight_prefetch import WeightPrefetcher, read_state, repo_folder
+
+REPO_ID = "org/model"
+COMMIT = "c0ffee"
+
+
+class StandInHub:
+    """Model repo files, served by a local file server with the Hub's `<repo>/resolve/<commit>/<path>` layout"""
+
+    def __init__(self, files, lfs=()):
+        self.files = files
+        self.lfs = set(lfs)
+        self.served = dict(files)  # content actually served, may be corrupted
+        self.requests = []  # (path, range header)
+
+    def model_info(self, repo_id, revision=None, files_metadata=False):
+        siblings = [
+            SimpleNamespace(
+                rfilename=path,
+                size=len(content),
+                blob_id=hashlib.sha1(content).hexdigest(),
+                lfs={"sha256": hashlib.sha256(content).hexdigest()} if path in self.lfs else None,
+            )
+            for path, content in self.files.items()
+        ]
+        return SimpleNamespace(sha=COMMIT, siblings=siblings)
+
+    def handler(self):
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                prefix = f"/{REPO_ID}/resolve/{COMMIT}/"
+                path = self.path[len(prefix):] if self.path.startswith(prefix) else None
+                if path not in hub.served:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                hub.requests.append((path, self.headers.get("Range")))
+                content, status = hub.served[path], 200
+                if self.headers.get("Range"):
+                    content, status = content[int(self.headers["Range"][len("bytes="):].rstrip("-")):], 206
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def serve(tmp_path):
+    servers = []
+
+    def start(hub):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), hub.handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return WeightPrefetcher(
+            hub, cache_dir=str(tmp_path / "hub"), endpoint=f"http://127.0.0.1:{server.server_port}", min_free_gb=0,
+        )
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def snapshot_file(prefetcher, path):
+    with open(os.path.join(repo_folder(prefetcher.cache_dir, REPO_ID), "snapshots", COMMIT, path), "rb") as fp:
+        return fp.read()
+
+
+def test_files_are_cached_in_hf_layout_once(serve):
+    files = {"config.json": b'{"model_type": "llama"}', "model.safetensors": os.urandom(4096), "README.md": b"# model"}
+    hub = StandInHub(files, lfs=["model.safetensors"])
+    prefetcher = serve(hub)
+
+    entry = prefetcher.prefetch_model(REPO_ID, "main")
+
+    assert entry["status"] == "complete" and entry["commit"] == COMMIT
+    assert snapshot_file(prefetcher, "model.safetensors") == files["model.safetensors"]
+    assert sorted(path for path, _ in hub.requests) == ["config.json", "model.safetensors"]  # README not needed
+    with open(os.path.join(repo_folder(prefetcher.cache_dir, REPO_ID), "refs", "main")) as fp:
+        assert fp.read() == COMMIT
+
+    assert prefetcher.prefetch_model(REPO_ID, "main")["downloaded"] == 0
+
+
+def test_partial_download_is_resumed(serve):
+    weights = os.urandom(8192)
+    hub = StandInHub({"config.json": b"{}", "model.safetensors": weights}, lfs=["model.safetensors"])
+    prefetcher = serve(hub)
+    sha256 = hashlib.sha256(weights).hexdigest()
+    blobs = os.path.join(repo_folder(prefetcher.cache_dir, REPO_ID), "blobs")
+    os.makedirs(blobs)
+    with open(os.path.join(blobs, f"{sha256}.incomplete"), "wb") as fp:
+        fp.write(weights[:3000])
+
+    entry = prefetcher.prefetch_model(REPO_ID, "main")
+
+    assert entry["status"] == "complete"
+    assert ("model.safetensors", "bytes=3000-") in hub.requests
+    assert snapshot_file(prefetcher, "model.safetensors") == weights
+
+
+def test_checksum_mismatch_fails_without_caching(serve):
+    weights = os.urandom(4096)
+    hub = StandInHub({"config.json": b"{}", "model.safetensors": weights}, lfs=["model.safetensors"])
+    hub.served["model.safetensors"] = weights[:-1] + bytes([weights[-1] ^ 0xFF])
+    prefetcher = serve(hub)
+
+    entries = prefetcher.prefetch([EvalRequest(model=REPO_ID, status="PENDING", json_filepath="", revision="main")])
+
+    assert entries[0]["status"] == "failed" and "Checksum mismatch" in entries[0]["error"]
+    assert read_state(prefetcher.cache_dir)[f"{REPO_ID}@main"]["status"] == "failed"
+    blobs = os.listdir(os.path.join(repo_folder(prefetcher.cache_dir, REPO_ID), "blobs"))
+    assert hashlib.sha256(weights).hexdigest() not in blobs
+    assert not any(b.endswith(".incomplete") for b in blobs)
+
+
+def test_weights_are_limited_to_index_and_preferred_format(serve):
+    index = {"weight_map": {"a": "model-00001-of-00002.safetensors", "b": "model-00002-of-00002.safetensors"}}
+    files = {
+        "config.json": b"{}",
+        "model.safetensors.index.json": json.dumps(index).encode(),
+        "model-00001-of-00002.safetensors": b"shard 1",
+        "model-00002-of-00002.safetensors": b"shard 2",
+        "consolidated.safetensors": b"not referenced by the index",
+        "pytorch_model.bin": b"other weight format",
+    }
+    hub = StandInHub(files)
+    prefetcher = serve(hub)
+
+    entry = prefetcher.prefetch_model(REPO_ID, "main")
+
+    assert entry["files"] == 4
+    assert sorted(path for path, _ in hub.requests) == [
+        "config.json", "model-00001-of-00002.safetensors", "model-00002-of-00002.safetensors", "model.safetensors.index.json",
+    ]